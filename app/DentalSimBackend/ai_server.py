@@ -1,27 +1,172 @@
 import os
-from flask import Flask, request, jsonify
+import json
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-from llama_cpp import Llama
+from llm_scheduler import GenerationScheduler, QueueFull
+from metrics import InferenceMetrics
+from model_loader import load_model, load_tokenizer
+from speculative import scores_buffer_mb
+from prompt_cache import PromptStateCache
+from worker_pool import WorkerPool, max_workers_for_budget
 
 app = Flask(__name__)
 CORS(app)
 
 MODEL_PATH = "/MODEL_FINAL_DENTAL.gguf"
 
-print(f"Se incarca modelul pe CPU din: {MODEL_PATH}...")
+# AI_WORKERS > 0: N procese, fiecare cu contextul lui, pe acelasi GGUF (mmap)
+# AI_WORKERS = 0: un singur proces cu AI_SLOTS contexte decodate in paralel
+#   (contexte separate, nu un batch comun; AI_SLOTS=auto: cate incap in RAM, cel mult AI_MAX_SLOTS)
+N_WORKERS = int(os.getenv("AI_WORKERS", "0"))
+N_SLOTS = os.getenv("AI_SLOTS", "auto")
+MAX_AUTO_SLOTS = int(os.getenv("AI_MAX_SLOTS", "4"))
+FIXED_THREADS = int(os.getenv("AI_THREADS", "0"))
 
-try:
-    llm = Llama(
-        model_path=MODEL_PATH,
-        n_ctx=4096,
-        n_threads=4,
-        verbose=False
-    )
-    print("Model incarcat cu succes!")
-except Exception as e:
-    print(f"Eroare la incrcarea modelului: {e}")
+
+def threads_per_context(n_contexts):
+    return FIXED_THREADS or max(1, (os.cpu_count() or 4) // max(1, n_contexts))
+
+
+N_THREADS = threads_per_context(N_WORKERS)
+MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "64"))
+# un worker mort e repornit de cel mult AI_WORKER_RESTARTS ori; clientul asteapta
+# cel mult AI_EVENT_TIMEOUT secunde intre doua evenimente ale generarii
+WORKER_RESTARTS = int(os.getenv("AI_WORKER_RESTARTS", "3"))
+EVENT_TIMEOUT = float(os.getenv("AI_EVENT_TIMEOUT", "300"))
+
+# Snapshot-uri dupa system prompt (cate unul per boala) + istoricul pe sesiune
+PROMPT_CACHE_SIZE = int(os.getenv("AI_PROMPT_CACHE_SIZE", "16"))
+# fiecare snapshot include si buffer-ul de logits (pana la n_batch x n_vocab float32)
+PROMPT_CACHE_MB = int(os.getenv("AI_PROMPT_CACHE_MB", "1024"))
+SESSION_CACHE_MB = int(os.getenv("AI_SESSION_CACHE_MB", "1024"))
+
+# Memorie estimata per worker pentru context + KV cache, peste greutatile partajate;
+# la bugetul per worker se adauga AI_PROMPT_CACHE_MB, AI_SESSION_CACHE_MB si,
+# cu decodare speculativa, buffer-ul logits_all (vezi per_worker_budget_mb)
+WORKER_MEM_MB = int(os.getenv("AI_WORKER_MEM_MB", "2048"))
+
+# Decodare speculativa: off | prompt_lookup | draft (AI_DRAFT_MODEL, acelasi vocabular ca modelul mare)
+SPECULATIVE = os.getenv("AI_SPECULATIVE", "off").lower()
+DRAFT_MODEL_PATH = os.getenv("AI_DRAFT_MODEL", "")
+DRAFT_TOKENS = int(os.getenv("AI_DRAFT_TOKENS", "10" if SPECULATIVE == "prompt_lookup" else "4"))
+
+# cu decodare speculativa llama.cpp tine logits pentru tot contextul (n_ctx x n_vocab),
+# deci fiecare snapshot ar avea GB si n-ar incapea niciodata in AI_PROMPT_CACHE_MB
+if SPECULATIVE != "off" and PROMPT_CACHE_SIZE > 0:
+    if __name__ != "__mp_main__":
+        print(f"Cache-ul de prompt e dezactivat cu AI_SPECULATIVE={SPECULATIVE} "
+              f"(starile includ buffer-ul logits_all)")
+    PROMPT_CACHE_SIZE = 0
+
+MODEL_CONFIG = {
+    "model_path": MODEL_PATH,
+    "n_ctx": 4096,
+    "n_threads": N_THREADS,
+    "session_cache_mb": SESSION_CACHE_MB,
+    "prompt_cache_size": PROMPT_CACHE_SIZE,
+    "prompt_cache_mb": PROMPT_CACHE_MB,
+    "speculative": SPECULATIVE,
+    "draft_model_path": DRAFT_MODEL_PATH,
+    "draft_tokens": DRAFT_TOKENS,
+    "lookup_ngram": int(os.getenv("AI_LOOKUP_NGRAM", "2")),
+}
+
+if SPECULATIVE == "draft" and not DRAFT_MODEL_PATH:
+    print("AI_SPECULATIVE=draft necesita AI_DRAFT_MODEL (calea catre un GGUF mic)")
     exit(1)
 
+GENERATION_PARAMS = {
+    "max_tokens": 256,
+    "temperature": 0.2,
+    "top_p": 0.9
+}
+
+
+def per_slot_budget_mb(n_vocab):
+    """RAM one llama.cpp context needs on top of the shared weights (KV, session cache, logits)."""
+    return WORKER_MEM_MB + SESSION_CACHE_MB + scores_buffer_mb(MODEL_CONFIG, n_vocab)
+
+
+def per_worker_budget_mb(n_vocab):
+    """RAM one worker needs on top of the shared weights: its context plus its own prompt cache."""
+    prompt_cache_mb = PROMPT_CACHE_MB if PROMPT_CACHE_SIZE > 0 else 0
+    return per_slot_budget_mb(n_vocab) + prompt_cache_mb
+
+
+def slots_for_budget(n_vocab):
+    """AI_SLOTS=auto: as many contexts as RAM allows (the prompt cache is shared), at least 1."""
+    prompt_cache_mb = PROMPT_CACHE_MB if PROMPT_CACHE_SIZE > 0 else 0
+    allowed, model_mb = max_workers_for_budget(MODEL_PATH, per_slot_budget_mb(n_vocab),
+                                               reserve_mb=1024 + prompt_cache_mb)
+    # sub 2 thread-uri per context, slot-urile in plus doar isi fura CPU
+    cpu_limit = max(1, (os.cpu_count() or 4) // 2)
+    n_slots = max(1, min(allowed, MAX_AUTO_SLOTS, cpu_limit))
+    print(f"AI_SLOTS=auto: {n_slots} slot(uri) (RAM permite {allowed}, CPU {cpu_limit}, maxim {MAX_AUTO_SLOTS})")
+    return n_slots
+
+
+def create_backend(n_vocab):
+    if N_WORKERS > 0:
+        per_worker_mb = per_worker_budget_mb(n_vocab)
+        allowed, model_mb = max_workers_for_budget(MODEL_PATH, per_worker_mb)
+        if N_WORKERS > allowed:
+            raise RuntimeError(
+                f"AI_WORKERS={N_WORKERS} exceeds the RAM budget: model {model_mb} MB shared + "
+                f"{per_worker_mb} MB per worker allows at most {allowed} worker(s)"
+            )
+        print(f"Se pornesc {N_WORKERS} worker(i) x {N_THREADS} thread(uri) pe: {MODEL_PATH}...")
+        return WorkerPool(MODEL_CONFIG, n_workers=N_WORKERS, max_queue=MAX_QUEUE,
+                          max_restarts=WORKER_RESTARTS, event_timeout=EVENT_TIMEOUT)
+
+    n_slots = slots_for_budget(n_vocab) if N_SLOTS == "auto" else int(N_SLOTS)
+    MODEL_CONFIG["n_threads"] = threads_per_context(n_slots)
+    print(f"Se incarca modelul pe CPU din: {MODEL_PATH} ({n_slots} slot(uri) x {MODEL_CONFIG['n_threads']} "
+          f"thread(uri), speculativ: {SPECULATIVE})...")
+    prompt_cache = PromptStateCache(capacity=PROMPT_CACHE_SIZE, capacity_mb=PROMPT_CACHE_MB)
+    backend = GenerationScheduler(
+        lambda slot_id: load_model(MODEL_CONFIG),
+        n_slots=n_slots,
+        max_queue=MAX_QUEUE,
+        prepare=prompt_cache.prepare if PROMPT_CACHE_SIZE > 0 else None
+    )
+    backend.prompt_cache = prompt_cache
+    return backend
+
+
+# Worker-ii (spawn) re-importa acest modul ca __mp_main__ si nu trebuie sa porneasca backend-ul
+if __name__ != "__mp_main__":
+    try:
+        tokenizer = load_tokenizer(MODEL_CONFIG)
+        scheduler = create_backend(tokenizer.n_vocab())
+        print("Model incarcat cu succes!")
+    except Exception as e:
+        print(f"Eroare la incrcarea modelului: {e}")
+        exit(1)
+
+
+# agregatele din blocul usage/timings al fiecarei generari, pe /metrics
+inference_metrics = InferenceMetrics()
+if __name__ != "__mp_main__":
+    inference_metrics.add_gauge("dentalsim_llm_active_generations", "Generations running on a slot.",
+                                lambda: scheduler.stats()["active"])
+    inference_metrics.add_gauge("dentalsim_llm_queue_depth", "Generations waiting for a slot.",
+                                lambda: scheduler.stats()["queue_depth"])
+
+
+def stream_generation(req):
+    """
+    NDJSON stream: one {"token": "..."} line per generated piece,
+    then {"done": true, "generated_text": "..."} (or {"error": "..."}).
+    """
+    try:
+        for event in req:
+            if "done" in event or "error" in event:
+                inference_metrics.observe(event)
+            yield json.dumps(event) + "\n"
+    finally:
+        req.cancel()
+
+
 @app.route('/generate', methods=['POST'])
 def generate():
     data = request.json
@@ -31,17 +176,51 @@ def generate():
         return jsonify({"error": "No messages provided"}), 400
 
     try:
-        output = llm.create_chat_completion(
-            messages=messages,
-            max_tokens=256,
-            temperature=0.2,
-            top_p=0.9
-        )
-        return jsonify({"generated_text": output['choices'][0]['message']['content']})
+        req = scheduler.submit(messages, **GENERATION_PARAMS)
+    except QueueFull as e:
+        return jsonify({"error": str(e)}), 503
+
+    if data.get("stream"):
+        return Response(stream_with_context(stream_generation(req)), mimetype="application/x-ndjson")
+
+    result = req.result()
+    inference_metrics.observe(result)
+    if "error" in result:
+        return jsonify({"error": result["error"]}), 500
+    return jsonify({
+        "generated_text": result["generated_text"],
+        "queue_wait_ms": result["queue_wait_ms"],
+        "usage": result.get("usage"),
+        "timings": result.get("timings"),
+        "speculative": result.get("speculative"),
+        "prompt_cache": result.get("prompt_cache")
+    })
+
+
+@app.route('/tokenize', methods=['POST'])
+def tokenize():
+    """{"texts": [...]} -> {"counts": [...]}: token counts with this model's tokenizer."""
+    texts = (request.json or {}).get("texts", [])
+    counts = [len(tokenizer.tokenize(t.encode("utf-8"), add_bos=False, special=False)) for t in texts]
+    return jsonify({"counts": counts})
+
+
+@app.route('/status', methods=['GET'])
+def status():
+    stats = scheduler.stats()
+    # fiecare slot / worker e un context separat care decodeaza o singura secventa:
+    # debitul e suma unor decodari independente, nu un batch continuu
+    stats["batching"] = "none: one sequence per context; slots/workers are separate llama.cpp contexts"
+    if hasattr(scheduler, "prompt_cache"):
+        stats["prompt_cache"] = scheduler.prompt_cache.stats()
+    return jsonify(stats)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(inference_metrics.render(), mimetype="text/plain; version=0.0.4")
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
     print("Serverul AI porneste")
-    app.run(host='127.0.0.1', port=5000)
\ No newline at end of file
+    app.run(host='127.0.0.1', port=5000, threaded=True)
@@ -0,0 +1,163 @@
+import math
+import random
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict
+
+VECTOR_DIM = 1 << 16
+
+
+def normalize_question(text):
+    """Lowercase, no diacritics / punctuation, single spaces: 'Does it HURT?!' -> 'does it hurt'."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"n't\b", " not", text)
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def embed_question(normalized):
+    """
+    Sparse, L2-normalized bag of hashed words and character trigrams.
+    Close paraphrases ('how long has it hurt' / 'how long has it been hurting')
+    share most features; unrelated questions share almost none.
+    """
+    features = {}
+    words = normalized.split()
+    for w in words:
+        h = zlib.crc32(b"w:" + w.encode("utf-8")) % VECTOR_DIM
+        features[h] = features.get(h, 0.0) + 2.0
+    padded = f" {normalized} "
+    for i in range(len(padded) - 2):
+        h = zlib.crc32(b"c:" + padded[i:i + 3].encode("utf-8")) % VECTOR_DIM
+        features[h] = features.get(h, 0.0) + 1.0
+    norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+    return {h: v / norm for h, v in features.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(h, 0.0) for h, v in a.items())
+
+
+class _Entry:
+    __slots__ = ("position", "question", "vector", "replies")
+
+    def __init__(self, position, question, vector):
+        self.position = position
+        self.question = question
+        self.vector = vector
+        self.replies = []
+
+
+class AnswerCache:
+    """
+    Patient replies to the opening questions of a visit, reused across sessions.
+
+    Key: (disease, position of the student's turn, question). Positions past
+    `max_position` are never cached: by then the reply depends on the
+    conversation, not only on the question. A question matches a cached one
+    when their embeddings' cosine similarity is at least `threshold`
+    (brute-force nearest neighbour within the disease + position bucket).
+
+    `prompt_version` (e.g. a hash of the disease's system prompt) is stored
+    per disease: when it changes, that disease's answers are dropped.
+
+    Each disease holds at most `per_disease` questions, evicted LRU.
+    A question keeps up to `variants` different replies; with `variants` > 1 it
+    only starts hitting once all variants were generated, then a random one
+    is returned so repeated visits don't read word-for-word the same.
+    """
+
+    def __init__(self, threshold=0.85, per_disease=300, max_position=3, variants=1):
+        self.threshold = threshold
+        self.per_disease = per_disease
+        self.max_position = max_position
+        self.variants = max(1, variants)
+        self._lock = threading.Lock()
+        self._diseases = {}   # disease_id -> (prompt_version, OrderedDict[(position, question)] = _Entry)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+
+    def cacheable(self, position):
+        return position is not None and 1 <= position <= self.max_position
+
+    def _entries(self, disease_id, prompt_version, create=False):
+        bucket = self._diseases.get(disease_id)
+        if bucket is not None and bucket[0] == prompt_version:
+            return bucket[1]
+        if not create:
+            return None
+        entries = OrderedDict()
+        self._diseases[disease_id] = (prompt_version, entries)
+        return entries
+
+    def _nearest(self, entries, position, vector):
+        best, best_score = None, self.threshold
+        for entry in entries.values():
+            if entry.position != position:
+                continue
+            score = cosine(vector, entry.vector)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def lookup(self, disease_id, prompt_version, position, question):
+        """Cached reply for this question, or None (miss)."""
+        if not self.cacheable(position):
+            return None
+        started = time.perf_counter()
+        normalized = normalize_question(question)
+        vector = embed_question(normalized)
+        with self._lock:
+            entries = self._entries(disease_id, prompt_version)
+            entry = self._nearest(entries, position, vector) if entries else None
+            if entry is None or len(entry.replies) < self.variants:
+                self.misses += 1
+                reply = None
+            else:
+                self.hits += 1
+                entries.move_to_end((entry.position, entry.question))
+                reply = random.choice(entry.replies)
+            self.lookup_seconds += time.perf_counter() - started
+        return reply
+
+    def store(self, disease_id, prompt_version, position, question, reply):
+        """Records a generated reply (call after a miss)."""
+        if not self.cacheable(position) or not reply.strip():
+            return
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        vector = embed_question(normalized)
+        with self._lock:
+            entries = self._entries(disease_id, prompt_version, create=True)
+            entry = self._nearest(entries, position, vector)
+            if entry is None:
+                entry = _Entry(position, normalized, vector)
+                entries[(position, normalized)] = entry
+                while len(entries) > self.per_disease:
+                    entries.popitem(last=False)
+                    self.evictions += 1
+            entries.move_to_end((entry.position, entry.question))
+            if len(entry.replies) < self.variants and reply not in entry.replies:
+                entry.replies.append(reply)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "diseases": len(self._diseases),
+                "entries": sum(len(b[1]) for b in self._diseases.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "avg_lookup_ms": round(self.lookup_seconds * 1000 / lookups, 3) if lookups else 0.0,
+            }
@@ -1,10 +1,16 @@
 
 import os
+import json
+import contextvars
+import atexit
+import threading
+import time
+import hashlib
 import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
 import random
 import string
-import requests
-from flask import Flask, request, jsonify, send_from_directory, abort
+from flask import Flask, request, jsonify, send_from_directory, abort, Response, stream_with_context
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -15,22 +21,86 @@ from email.mime.text import MIMEText
 from dotenv import load_dotenv
 import university_config
 from clinical_rules import resolve_clinical_test
+from disease_catalog import DiseaseCatalog
+from rank_service import RankService
+from llm_gateway import LLMGateway, LLMUnavailable
+from session_cache import SessionCache, MAX_SUMMARY_LINES
+from context_builder import TokenCounter, ContextBuilder, PromptTooLong, summary_line
+from answer_cache import AnswerCache
+from message_writer import MessageWriter
+from badges import load_earned_badges, evaluate_badges, award_badges
+from leaderboard_cache import LeaderboardCache
+import media_variants
+from media_signing import MediaSigner, IMAGE_TYPES
+from repository import open_repository
+from db_metrics import OpCounter, instrument_db
+from metrics import RequestMetrics
+from pagination import BadCursor, NEXT_CURSOR_HEADER, page_params, fetch_page, paged_response
 
 
 # --- APP CONFIGURATION ---
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
+CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
+     expose_headers=[NEXT_CURSOR_HEADER])
 
 # Schimbă cheia la producție!
 app.config['JWT_SECRET_KEY'] = 'super-secret-dental-key-change-me'
 jwt = JWTManager(app)
 
-# --- FIREBASE INIT ---
+# --- DATABASE INIT ---
+# DB_BACKEND=firestore (implicit) sau sqlite (fișier local, SQLITE_PATH; vezi repository.py)
+DB_BACKEND = os.getenv("DB_BACKEND", "firestore").lower()
 SERVICE_ACCOUNT_KEY_PATH = os.path.join(os.path.dirname(__file__), 'serviceAccountKey.json')
-if not firebase_admin._apps:
+if DB_BACKEND == "firestore" and not firebase_admin._apps:
     cred = credentials.Certificate(SERVICE_ACCOUNT_KEY_PATH)
     firebase_admin.initialize_app(cred)
-firebase_db = firestore.client()
+# fiecare citire / scriere / query e numărată pe request (vezi /metrics)
+db_op_counter = OpCounter()
+firebase_db = instrument_db(open_repository(DB_BACKEND), db_op_counter)
+
+# --- METRICS (latență per rută, operații DB, timp LLM; SLOW_REQUEST_MS=0 dezactivează logul) ---
+request_metrics = RequestMetrics(db_op_counter, slow_ms=int(os.getenv("SLOW_REQUEST_MS", "0")))
+request_metrics.init_app(app)
+
+# Citiri independente din același request rulează în paralel pe acest pool
+# (în modul gevent din serve.py thread-urile sunt greenlet-uri)
+io_pool = ThreadPoolExecutor(max_workers=int(os.getenv("IO_POOL_SIZE", "16")), thread_name_prefix="io")
+
+# --- DISEASE CATALOG (in-process cache of the `disease` collection) ---
+disease_catalog = DiseaseCatalog(
+    firebase_db,
+    ttl_seconds=int(os.getenv("DISEASE_CATALOG_TTL", "300")),
+    miss_refresh_interval=int(os.getenv("DISEASE_CATALOG_MISS_REFRESH", "30"))
+)
+# snapshot listeners există doar pe Firestore; pe SQLite rămâne reîncărcarea după TTL
+if DB_BACKEND == "firestore" and os.getenv("DISEASE_CATALOG_LISTEN", "1") == "1":
+    disease_catalog.start_listener()
+
+# --- CHAT SESSION CACHE (session doc + system prompt + last messages) ---
+session_cache = SessionCache(
+    capacity=int(os.getenv("SESSION_CACHE_SIZE", "1000")),
+    ttl_seconds=int(os.getenv("SESSION_CACHE_TTL", "1800")),
+    window=int(os.getenv("SESSION_WINDOW", "40"))
+)
+
+# --- CHAT MESSAGES: write-behind, group-committed in Firestore batches ---
+message_writer = MessageWriter(
+    firebase_db,
+    max_batch=int(os.getenv("MESSAGE_BATCH_SIZE", "400")),
+    flush_interval=float(os.getenv("MESSAGE_FLUSH_INTERVAL", "0.25"))
+)
+atexit.register(message_writer.stop)
+
+# --- LEADERBOARD SNAPSHOT (top-N global + per university, in memory) ---
+leaderboard_cache = LeaderboardCache(
+    firebase_db,
+    university_config.get_list_of_universities(),
+    top_n=50,
+    ttl_seconds=int(os.getenv("LEADERBOARD_TTL", "300"))
+)
+
+# --- GLOBAL RANK (aggregation counts instead of scanning `user`) ---
+rank_service = RankService(firebase_db)
 
 # --- EMAIL CONFIG ---
 load_dotenv()
@@ -47,15 +117,68 @@ if not SMTP_PASSWORD:
 #if not COLAB_URL:
 #    raise ValueError("Error: NGROK_DOMAIN not found in .env file")
 AI_SERVER_URL = "http://127.0.0.1:5000"
-HF_URL = f"{AI_SERVER_URL}/generate"
-#HF_URL = f"https://{COLAB_URL}/generate"
-HF_HEADERS = {"Content-Type": "application/json"}
+#AI_SERVER_URL = f"https://{COLAB_URL}"
+# Mai multe instante ai_server: AI_SERVER_URLS="http://10.0.0.5:5000,http://10.0.0.6:5000"
+AI_SERVER_URLS = [u.strip() for u in os.getenv("AI_SERVER_URLS", AI_SERVER_URL).split(",") if u.strip()]
+llm_gateway = LLMGateway(
+    AI_SERVER_URLS,
+    connect_timeout=float(os.getenv("AI_CONNECT_TIMEOUT", "3")),
+    read_timeout=float(os.getenv("AI_READ_TIMEOUT", "45")),
+    failure_threshold=int(os.getenv("AI_BREAKER_FAILURES", "3")),
+    cooldown=float(os.getenv("AI_BREAKER_COOLDOWN", "30")),
+    health_interval=float(os.getenv("AI_HEALTH_INTERVAL", "10")),
+    # conexiuni keep-alive spre ai_server; în modul gevent sunt sute de chat-uri simultane
+    pool_size=int(os.getenv("AI_POOL_SIZE", "32"))
+)
+
+request_metrics.add_gauge("dentalsim_message_writer_backlog", "Chat messages not yet committed.",
+                          lambda: message_writer.backlog)
+request_metrics.add_gauge("dentalsim_session_cache_entries", "Chat sessions held in the session cache.",
+                          lambda: session_cache.stats()["entries"])
+request_metrics.add_gauge("dentalsim_llm_backends_healthy", "LLM backends passing health checks.",
+                          lambda: sum(1 for b in llm_gateway.stats() if b["healthy"]))
+
+# --- CHAT CONTEXT (buget de tokeni în loc de ultimele 10 mesaje) ---
+# CHAT_PROMPT_BUDGET < n_ctx (4096) - max_new_tokens; numărarea folosește tokenizer-ul modelului
+token_counter = TokenCounter(llm_gateway.tokenize)
+context_builder = ContextBuilder(
+    token_counter,
+    prompt_budget=int(os.getenv("CHAT_PROMPT_BUDGET", "3072")),
+    summary_budget=int(os.getenv("CHAT_SUMMARY_BUDGET", "384"))
+)
+
+# --- ANSWER CACHE (opt-in: răspunsuri refolosite la întrebările de început) ---
+# pragul e conservator: similaritatea e lexicală, "hot coffee" vs "cold water" dă ~0.7
+answer_cache = AnswerCache(
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.85")),
+    per_disease=int(os.getenv("ANSWER_CACHE_PER_DISEASE", "300")),
+    max_position=int(os.getenv("ANSWER_CACHE_MAX_POSITION", "3")),
+    variants=int(os.getenv("ANSWER_CACHE_VARIANTS", "1"))
+) if os.getenv("ANSWER_CACHE", "0") == "1" else None
+if answer_cache is not None:
+    request_metrics.add_gauge("dentalsim_answer_cache_entries", "Questions held in the answer cache.",
+                              lambda: answer_cache.stats()["entries"])
+    request_metrics.add_gauge("dentalsim_answer_cache_hit_ratio", "Answer cache hits / lookups.",
+                              lambda: answer_cache.stats()["hit_ratio"])
 
 # --- ASSETS FOLDER ---
 ASSETS_FOLDER = os.path.join(os.path.dirname(__file__), 'clinical_assets')
+MEDIA_MAX_AGE = 365 * 24 * 3600  # imaginea unei sesiuni nu se schimbă niciodată
 
+# URL-uri semnate pentru imagini: verificabile fără nicio citire din baza de date
+media_signer = MediaSigner(
+    os.getenv("MEDIA_URL_SECRET", app.config['JWT_SECRET_KEY']),
+    ASSETS_FOLDER,
+    window_seconds=int(os.getenv("MEDIA_URL_WINDOW", "3600"))
+)
 
-# --- HELPERS (Firestore) ---
+# variantele (thumb/mobile/full, WebP/JPEG) se generează în fundal la pornire
+if os.getenv("MEDIA_VARIANTS_AT_STARTUP", "1") == "1":
+    threading.Thread(target=media_variants.build_variants, args=(ASSETS_FOLDER,),
+                     name="media-variants", daemon=True).start()
+
+
+# --- HELPERS (Firestore API; backend from DB_BACKEND) ---
 
 def get_user_by_username(username: str):
     docs = firebase_db.collection("user").where("username", "==", username).limit(1).get()
@@ -65,6 +188,33 @@ def get_user_doc(user_id: str):
     doc = firebase_db.collection("user").document(user_id).get()
     return doc if doc.exists else None
 
+def get_docs_by_ids(collection: str, ids, field_paths=None, chunk_size=300):
+    """
+    Batched lookup: {doc_id: data} for the ids that exist, via get_all
+    (one round-trip per `chunk_size` ids instead of one get per id).
+    """
+    unique_ids = list(dict.fromkeys(i for i in ids if i))
+    result = {}
+    col = firebase_db.collection(collection)
+    for start in range(0, len(unique_ids), chunk_size):
+        refs = [col.document(i) for i in unique_ids[start:start + chunk_size]]
+        for doc in firebase_db.get_all(refs, field_paths=field_paths):
+            if doc.exists:
+                result[doc.id] = doc.to_dict()
+    return result
+
+def get_docs(*refs):
+    """Snapshots for `refs` in the same order, fetched in one get_all round-trip."""
+    by_path = {doc.reference.path: doc for doc in firebase_db.get_all(list(refs))}
+    return [by_path.get(ref.path) for ref in refs]
+
+def run_concurrently(fn, *args):
+    """
+    Starts `fn` on io_pool inside a copy of the caller's context, so its DB ops
+    are still counted for the current request (by every OpCounter in use).
+    """
+    return io_pool.submit(contextvars.copy_context().run, fn, *args)
+
 def get_classroom_by_join_code(join_code: str):
     docs = firebase_db.collection("classroom").where("join_code", "==", join_code).limit(1).get()
     return docs[0] if docs else None
@@ -86,6 +236,8 @@ def create_user(username, password_hash, email, university, classroom_id=None, r
         "last_active_date": None,
         "role": role,
         "consecutive_correct": 0,
+        "completed_cases": 0,
+        "correct_by_category": {},
         "is_verified": False,
         "verification_code": verification_code,
     })
@@ -123,52 +275,7 @@ def add_class_membership(user_id: str, classroom_id: str, role_in_class: str = "
 
 
 def get_random_disease(allowed_names=None):
-    docs = firebase_db.collection("disease").get()
-    if not docs:
-        return None
-
-    # daca nu avem filtru, alegem direct
-    if allowed_names is None:
-        endo_docs = []
-        non_endo_docs = []
-
-        for d in docs:
-            data = d.to_dict()
-            category = data.get("category", "").lower()
-
-            if "non endodontic" in category:
-                non_endo_docs.append(d)
-            else:
-                endo_docs.append(d)
-
-        # Handle edge case: if we have no non-endo diseases in DB, just pick from all
-        if not non_endo_docs:
-            return random.choice(docs)
-
-        selection_pool = list(endo_docs)
-        selection_pool.append("NON_ENDO_GROUP_MARKER")
-
-        choice = random.choice(selection_pool)
-
-        # If the placeholder is picked, select a random Non-Endo disease
-        if choice == "NON_ENDO_GROUP_MARKER":
-            return random.choice(non_endo_docs)
-
-        return choice
-
-    # filtrăm documentele care au name în allowed_names
-    allowed_set = set(allowed_names)
-    filtered = []
-    for d in docs:
-        data = d.to_dict()
-        if data.get("name") in allowed_set:
-            filtered.append(d)
-
-    if not filtered:
-        # nu există boli care să se potrivească cu allowed_names
-        return None
-
-    return random.choice(filtered)
+    return disease_catalog.random_disease(allowed_names)
 
 
 def create_chat_session(user_id, disease_id, clinical_context, assignment_id=None):
@@ -190,14 +297,11 @@ def create_chat_session(user_id, disease_id, clinical_context, assignment_id=Non
 
 
 def add_chat_message(session_id, sender, content):
-    # Colecție rădăcină, ca în SQLite (FK = session_id)
-    ref = firebase_db.collection("chat_message").document()
-    ref.set({
-        "session_id": session_id,
-        "sender": sender,
-        "content": content,
-        "timestamp": firestore.SERVER_TIMESTAMP
-    })
+    # Colecție rădăcină, ca în SQLite (FK = session_id).
+    # Scrierea e asincronă (message_writer); documentul apare în Firestore la următorul batch.
+    ref = message_writer.enqueue(session_id, sender, content)
+    # fereastra din cache rămâne sincronizată cu Firestore
+    session_cache.append(session_id, sender, content)
     return ref
 
 def get_last_messages(session_id, limit=10):
@@ -208,22 +312,104 @@ def get_last_messages(session_id, limit=10):
         .limit(limit).get()
     return list(reversed(msgs))  # pentru ordinea cronologică
 
-def check_and_award_badge(user_id, badge_name, xp_bonus=0):
-    existing = firebase_db.collection("user_badge") \
+# --- USER STATS COUNTERS ---
+# Kept on the user doc and updated in the /chat/diagnose batch, so badge
+# thresholds are checked without reading the user's session history.
+
+def category_counter_key(category: str) -> str:
+    # "Non Endodontic" -> "non_endodontic" (safe as a Firestore field path)
+    return "".join(ch if ch.isalnum() else "_" for ch in (category or "").strip().lower()) or "uncategorized"
+
+
+def get_user_counters(user_id: str, user: dict):
+    """
+    Returns (counters, backfilled). Users created before the counters existed
+    get them rebuilt once from their completed sessions; the caller then
+    writes absolute values instead of increments.
+    """
+    if "completed_cases" in user:
+        return {
+            "completed_cases": int(user.get("completed_cases", 0)),
+            "correct_by_category": dict(user.get("correct_by_category") or {}),
+        }, False
+
+    completed_cases = 0
+    correct_by_category = {}
+    s_docs = firebase_db.collection("chat_session") \
         .where("user_id", "==", user_id) \
-        .where("badge_name", "==", badge_name) \
-        .limit(1).get()
-    if not existing:
-        firebase_db.collection("user_badge").document().set({
-            "user_id": user_id,
-            "badge_name": badge_name,
-            "awarded_at": firestore.SERVER_TIMESTAMP
-        })
-        firebase_db.collection("user").document(user_id).update({
-            "xp": firestore.Increment(xp_bonus)
-        })
-        return f" [BADGE: {badge_name}]"
-    return ""
+        .where("is_completed", "==", 1).stream()
+    for s_doc in s_docs:
+        s = s_doc.to_dict()
+        completed_cases += 1
+        if not s.get("was_correct"):
+            continue
+        d = disease_catalog.get(s.get("disease_id"))
+        if d:
+            key = category_counter_key(d.to_dict().get("category", ""))
+            correct_by_category[key] = correct_by_category.get(key, 0) + 1
+
+    return {
+        "completed_cases": completed_cases,
+        "correct_by_category": correct_by_category,
+    }, True
+
+
+def record_diagnosis_counters(batch, user_ref, counters, backfilled, category_key, is_correct):
+    """
+    Adds the counter updates for one diagnosis to `batch` and returns the
+    counters as they will be after the commit.
+    """
+    updated = {
+        "completed_cases": counters["completed_cases"] + 1,
+        "correct_by_category": dict(counters["correct_by_category"]),
+    }
+    if is_correct:
+        updated["correct_by_category"][category_key] = updated["correct_by_category"].get(category_key, 0) + 1
+
+    if backfilled:
+        batch.update(user_ref, updated)
+    else:
+        increments = {"completed_cases": firestore.Increment(1)}
+        if is_correct:
+            increments[f"correct_by_category.{category_key}"] = firestore.Increment(1)
+        batch.update(user_ref, increments)
+
+    return updated
+
+
+def get_chat_session_state(session_id):
+    """
+    Session doc, system prompt and last messages for /chat.
+    Served from session_cache; Firestore is read only on a miss.
+    Returns None if the session (or its disease) does not exist.
+    """
+    state = session_cache.get(session_id)
+    if state is not None:
+        return state
+
+    session_doc = firebase_db.collection("chat_session").document(session_id).get()
+    if not session_doc.exists:
+        return None
+    session = session_doc.to_dict()
+
+    disease_doc = disease_catalog.get(session.get("disease_id"))
+    if not disease_doc:
+        return None
+
+    # mesajele încă necomise din message_writer + cele din Firestore, fără dubluri;
+    # cele mai vechi decât fereastra refac rezumatul rulant (ținut doar în cache)
+    history_limit = session_cache.window + MAX_SUMMARY_LINES
+    pending = message_writer.pending_for(session_id)
+    by_id = {msg_doc.id: msg_doc.to_dict()
+             for msg_doc in get_last_messages(session_id, limit=history_limit)}
+    by_id.update(pending)
+    ordered = sorted(by_id.values(), key=lambda m: m["timestamp"])[-history_limit:]
+    msgs = [{"sender": m["sender"], "content": m["content"]} for m in ordered]
+    recent_msgs = msgs[-session_cache.window:]
+    summary_lines = [summary_line(m) for m in msgs[:-session_cache.window]]
+
+    return session_cache.put(session_id, session, disease_doc.to_dict()["system_prompt"],
+                             recent_msgs, summary_lines)
 
 def send_verification_email(to_email, code):
     subject = "Your DentalSim Verification Code"
@@ -302,7 +488,8 @@ def register():
         classroom_id=assigned_class_id,
         role=role
     )
-    send_verification_email(email, code)
+    # handshake-ul SMTP nu mai blochează răspunsul; erorile sunt logate de funcție
+    io_pool.submit(send_verification_email, email, code)
 
     if assigned_class_id:
         add_class_membership(user_ref.id, assigned_class_id, "Student")
@@ -438,26 +625,31 @@ def chat():
     session_id = data.get("session_id")
     user_message = data.get("message", "")
 
-    session_doc = firebase_db.collection("chat_session").document(session_id).get()
-    if not session_doc.exists:
+    state = get_chat_session_state(session_id)
+    if state is None:
         return jsonify({"error": "Invalid session"}), 404
-    session = session_doc.to_dict()
 
-    # mesajul studentului
-    add_chat_message(session_id, "student", user_message)
+    # promptul se construiește înainte de a salva mesajul: unul prea lung e refuzat
+    try:
+        conversation_history, _ = context_builder.build(
+            state.system_prompt,
+            list(state.messages) + [{"sender": "student", "content": user_message}],
+            list(state.summary_lines)
+        )
+    except PromptTooLong as e:
+        return jsonify({"error": str(e)}), 413
 
-    # sistem prompt din boală
-    disease_doc = firebase_db.collection("disease").document(session["disease_id"]).get()
-    if not disease_doc.exists:
-        return jsonify({"error": "Disease missing"}), 500
-    disease = disease_doc.to_dict()
+    # mesajul studentului (intră și în fereastra din cache)
+    add_chat_message(session_id, "student", user_message)
 
-    recent_msgs = get_last_messages(session_id, limit=10)
-    conversation_history = [{"role": "system", "content": disease["system_prompt"]}]
-    for msg_doc in recent_msgs:
-        m = msg_doc.to_dict()
-        role = "user" if m["sender"] == "student" else "assistant"
-        conversation_history.append({"role": role, "content": m["content"]})
+    cache_key = answer_cache_key(state)
+    if cache_key is not None:
+        cached_reply = answer_cache.lookup(*cache_key, user_message)
+        if cached_reply is not None:
+            add_chat_message(session_id, "patient", cached_reply)
+            if data.get("stream"):
+                return cached_chat_stream(cached_reply)
+            return jsonify({"reply": cached_reply})
 
     payload = {
         "messages": conversation_history,
@@ -465,40 +657,121 @@ def chat():
         "temperature": 0.2
     }
 
+    if data.get("stream"):
+        return relay_chat_stream(session_id, payload, cache_key, user_message)
+
     try:
-        response = requests.post(HF_URL, json=payload, headers=HF_HEADERS, timeout=120)
-        if response.status_code == 200:
-            ai_data = response.json()
-            bot_reply = ai_data.get("generated_text", "")
-            add_chat_message(session_id, "patient", bot_reply)
-            return jsonify({"reply": bot_reply})
-        else:
-            return jsonify({"error": f"LLM Error: {response.status_code}"}), 500
+        with request_metrics.llm_call("generate"):
+            ai_data = llm_gateway.generate(payload)
+    except LLMUnavailable as e:
+        return jsonify({"error": f"Patient unavailable: {e}"}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+    bot_reply = ai_data.get("generated_text", "")
+    add_chat_message(session_id, "patient", bot_reply)
+    if cache_key is not None:
+        answer_cache.store(*cache_key, user_message, bot_reply)
+    return jsonify({"reply": bot_reply})
+
+
+def answer_cache_key(state):
+    """
+    (disease_id, prompt_version, position) of the student's latest message for
+    answer_cache, or None when the cache is off or the turn is not cacheable.
+    """
+    if answer_cache is None or state.summary_lines:
+        return None
+    position = sum(1 for m in state.messages if m["sender"] == "student")
+    if not answer_cache.cacheable(position):
+        return None
+    prompt_version = hashlib.sha1(state.system_prompt.encode("utf-8")).hexdigest()[:12]
+    return state.session.get("disease_id"), prompt_version, position
+
+
+def cached_chat_stream(reply):
+    """A cached reply in the same NDJSON shape as relay_chat_stream."""
+    lines = [json.dumps({"token": reply}),
+             json.dumps({"done": True, "generated_text": reply, "cached": True})]
+    return Response("\n".join(lines) + "\n", mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache"})
+
+
+def relay_chat_stream(session_id, payload, cache_key=None, user_message=""):
+    """
+    Streaming variant of /chat: relays the NDJSON token stream from ai_server
+    ({"token": ...} lines, then {"done": true, ...}) and saves the full reply
+    once the stream ends.
+    """
+    try:
+        with request_metrics.llm_call("stream_open"):
+            upstream = llm_gateway.open_stream(payload)
+    except LLMUnavailable as e:
+        return jsonify({"error": f"Patient unavailable: {e}"}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+    def relay():
+        parts = []
+        failed = False
+        completed = False
+        started = time.perf_counter()
+        try:
+            for line in upstream.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "token" in event:
+                    parts.append(event["token"])
+                completed = completed or "done" in event
+                yield line + "\n"
+        except Exception as e:
+            # backend-ul a căzut sau a depășit timeout-ul în mijlocul răspunsului
+            failed = True
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            request_metrics.llm_duration.observe(("stream",), time.perf_counter() - started)
+            upstream.close(ok=not failed)
+            # salvăm și răspunsurile parțiale (clientul le-a văzut deja)
+            bot_reply = "".join(parts)
+            if bot_reply:
+                add_chat_message(session_id, "patient", bot_reply)
+                # doar răspunsurile complete ajung în cache
+                if cache_key is not None and completed:
+                    answer_cache.store(*cache_key, user_message, bot_reply)
+
+    return Response(
+        stream_with_context(relay()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 
 @app.route("/chat/diagnose", methods=["POST"])
 @jwt_required()
 def check_diagnosis():
     current_user_id = get_jwt_identity()
-    user_doc = get_user_doc(current_user_id)
-    if not user_doc:
-        return jsonify({"error": "User not found"}), 404
-    user = user_doc.to_dict()
-
     data = request.get_json()
     session_id = data.get("session_id")
     student_diagnosis = data.get("diagnosis", "").strip().lower()
 
+    # insignele depind doar de user: query-ul rulează în paralel cu citirea
+    # documentelor user + sesiune (un singur get_all)
+    earned_future = run_concurrently(load_earned_badges, firebase_db, current_user_id)
+    user_ref = firebase_db.collection("user").document(current_user_id)
     session_ref = firebase_db.collection("chat_session").document(session_id)
-    session_doc = session_ref.get()
-    if not session_doc.exists or session_doc.to_dict().get("user_id") != current_user_id:
+    user_doc, session_doc = get_docs(user_ref, session_ref)
+
+    if user_doc is None or not user_doc.exists:
+        return jsonify({"error": "User not found"}), 404
+    user = user_doc.to_dict()
+
+    if session_doc is None or not session_doc.exists or session_doc.to_dict().get("user_id") != current_user_id:
         return jsonify({"error": "Session not found"}), 404
     session = session_doc.to_dict()
 
-    disease_doc = firebase_db.collection("disease").document(session["disease_id"]).get()
-    if not disease_doc.exists:
+    disease_doc = disease_catalog.get(session["disease_id"])
+    if not disease_doc:
         return jsonify({"error": "Disease not found"}), 404
     disease = disease_doc.to_dict()
 
@@ -512,12 +785,7 @@ def check_diagnosis():
     else:
         is_correct = False
 
-    xp_gained = 0
-    message = ""
-    badge_alerts = ""
-
     batch = firebase_db.batch()
-    user_ref = firebase_db.collection("user").document(current_user_id)
 
     # durata (Timestamp Firestore -> datetime)
     start_time = session.get("start_time")
@@ -530,68 +798,21 @@ def check_diagnosis():
         except Exception as e:
             app.logger.warning(f"[diagnose] duration calc failed: {e}")
 
-    # ---------------- CORE XP & BADGES ----------------
+    # ---------------- COUNTERS ----------------
+    counters, backfilled = get_user_counters(current_user_id, user)
+    category_key = category_counter_key(disease.get("category", ""))
+    counters = record_diagnosis_counters(batch, user_ref, counters, backfilled, category_key, is_correct)
+
+    # ---------------- CORE XP ----------------
     if is_correct:
         xp_gained = 100
         message = f"Correct! The diagnosis was {disease['name']}."
-        batch.update(user_ref, {"consecutive_correct": int(user.get("consecutive_correct", 0)) + 1})
-
-        if duration < 120:
-            badge_alerts += check_and_award_badge(current_user_id, "Speed Demon", 100)
-
-        # Perfect Ten
         new_consec = int(user.get("consecutive_correct", 0)) + 1
-        if new_consec >= 10:
-            badge_alerts += check_and_award_badge(current_user_id, "Perfect Ten", 300)
-
-        # Endodontist Expert (20 pulpal)
-        if disease.get("category") == "Pulpal":
-            pulpal_correct = 0
-            s_docs = firebase_db.collection("chat_session") \
-                .where("user_id", "==", current_user_id) \
-                .where("was_correct", "==", 1).stream()
-            for s_doc in s_docs:
-                s = s_doc.to_dict()
-                d2 = firebase_db.collection("disease").document(s["disease_id"]).get()
-                if d2.exists and d2.to_dict().get("category") == "Pulpal":
-                    pulpal_correct += 1
-            if pulpal_correct + 1 >= 20:
-                badge_alerts += check_and_award_badge(current_user_id, "Endodontist Expert", 500)
-
-        # Periodontal Pro (20 perio)
-        if disease.get("category") == "Periodontal":
-            perio_correct = 0
-            s_docs = firebase_db.collection("chat_session") \
-                .where("user_id", "==", current_user_id) \
-                .where("was_correct", "==", 1).stream()
-            for s_doc in s_docs:
-                s = s_doc.to_dict()
-                d2 = firebase_db.collection("disease").document(s["disease_id"]).get()
-                if d2.exists and d2.to_dict().get("category") == "Periodontal":
-                    perio_correct += 1
-            if perio_correct + 1 >= 20:
-                badge_alerts += check_and_award_badge(current_user_id, "Periodontal Pro", 500)
-
     else:
         xp_gained = 10
         message = f"Incorrect. The correct diagnosis was {disease['name']}. (+10 XP for effort)"
-        batch.update(user_ref, {"consecutive_correct": 0})
-
-    # Global badges
-    badge_alerts += check_and_award_badge(current_user_id, "First Steps", 50)
-
-    total_cases_stream = firebase_db.collection("chat_session") \
-        .where("user_id", "==", current_user_id) \
-        .where("is_completed", "==", 1).stream()
-    total_cases = sum(1 for _ in total_cases_stream)
-    if total_cases + 1 >= 100:
-        badge_alerts += check_and_award_badge(current_user_id, "Master Diagnostician", 2000)
-
-    current_hour = dt.datetime.now(dt.UTC).hour
-    if current_hour < 7:
-        badge_alerts += check_and_award_badge(current_user_id, "Early Bird", 25)
-    if current_hour >= 23:
-        badge_alerts += check_and_award_badge(current_user_id, "Night Owl", 25)
+        new_consec = 0
+    batch.update(user_ref, {"consecutive_correct": new_consec})
 
     # ---------------- STREAK LOGIC ----------------
     def _to_aware_date(val) -> dt.date | None:
@@ -640,10 +861,21 @@ def check_diagnosis():
             "last_active_date": firestore.SERVER_TIMESTAMP
         })
 
-    if streak >= 7:
-        badge_alerts += check_and_award_badge(current_user_id, "Week Warrior", 150)
-    if streak >= 30:
-        badge_alerts += check_and_award_badge(current_user_id, "Monthly Master", 1000)
+    # ---------------- BADGES ----------------
+    # o singură citire a insignelor; premiile și bonusul XP intră în batch
+    stats = {
+        "is_correct": is_correct,
+        "duration": duration,
+        "category": disease.get("category"),
+        "category_correct": counters["correct_by_category"].get(category_key, 0),
+        "consecutive_correct": new_consec,
+        "completed_cases": counters["completed_cases"],
+        "streak": streak,
+        "hour": dt.datetime.now(dt.UTC).hour,
+    }
+    earned = earned_future.result()
+    awards = evaluate_badges(stats, earned)
+    badge_alerts, badge_xp = award_badges(firebase_db, batch, current_user_id, awards)
 
     # ---------------- ASSIGNMENT PROGRESS ----------------
     assignment_id = session.get("assignment_id")
@@ -651,6 +883,14 @@ def check_diagnosis():
         # durata sigură pentru raport (dacă nu am putut calcula, folosim 0)
         safe_duration = duration if isinstance(duration, (int, float)) and duration != 999_999 else 0
 
+        # progresul existent se citește în paralel cu assignment-ul
+        prog_future = run_concurrently(
+            lambda: firebase_db.collection("assignment_progress")
+            .where("assignment_id", "==", assignment_id)
+            .where("user_id", "==", current_user_id)
+            .limit(1).get()
+        )
+
         # citim assignment-ul ca să știm required_sessions și classroom_id
         ass_doc = firebase_db.collection("assignment").document(assignment_id).get()
         required_sessions = 0
@@ -660,10 +900,7 @@ def check_diagnosis():
             required_sessions = int(ass.get("required_sessions", 0))
             classroom_id_for_assignment = ass.get("classroom_id")
 
-        prog_query = firebase_db.collection("assignment_progress") \
-            .where("assignment_id", "==", assignment_id) \
-            .where("user_id", "==", current_user_id) \
-            .limit(1).get()
+        prog_query = prog_future.result()
 
         if prog_query:
             prog_doc = prog_query[0]
@@ -673,7 +910,7 @@ def check_diagnosis():
             total_duration_sec = float(prog.get("total_duration_sec", 0)) + safe_duration
             is_completed_assignment = required_sessions > 0 and completed_sessions >= required_sessions
 
-            prog_doc.reference.update({
+            batch.update(prog_doc.reference, {
                 "completed_sessions": completed_sessions,
                 "correct_sessions": correct_sessions,
                 "total_duration_sec": total_duration_sec,
@@ -686,7 +923,7 @@ def check_diagnosis():
             total_duration_sec = safe_duration
             is_completed_assignment = required_sessions > 0 and completed_sessions >= required_sessions
 
-            firebase_db.collection("assignment_progress").document().set({
+            batch.set(firebase_db.collection("assignment_progress").document(), {
                 "assignment_id": assignment_id,
                 "user_id": current_user_id,
                 "classroom_id": classroom_id_for_assignment,
@@ -698,13 +935,19 @@ def check_diagnosis():
             })
 
     # ---------------- FINAL XP & SESSION UPDATE ----------------
-    batch.update(user_ref, {"xp": firestore.Increment(xp_gained)})
+    batch.update(user_ref, {"xp": firestore.Increment(xp_gained + badge_xp)})
     batch.update(session_ref, {
         "is_completed": 1,
         "end_time": firestore.SERVER_TIMESTAMP,
         "was_correct": 1 if is_correct else 0
     })
     batch.commit()
+    session_cache.invalidate(session_id)
+    leaderboard_cache.record_user(current_user_id, {
+        **user,
+        "xp": int(user.get("xp", 0)) + xp_gained + badge_xp,
+        "streak": streak
+    })
 
     return jsonify({
         "correct": is_correct,
@@ -748,10 +991,12 @@ def get_clinical_data():
 
         if filename:
             response_data["type"] = "image"
-            # We return the filename so the frontend knows something exists.
-            # The frontend doesn't show this filename to the user;
-            # it just uses it to decide to open the modal.
-            response_data["content"] = filename
+            # Signed, content-addressed URL: the media route serves it without
+            # a session lookup and the file name (= diagnosis) never leaves the server.
+            signed_url = media_signer.sign(test_type, filename)
+            response_data["url"] = signed_url
+            # content stays non-empty so the frontend knows something exists
+            response_data["content"] = signed_url or "image"
         else:
             # Case has no X-ray/Photo
             response_data["content"] = ""
@@ -787,8 +1032,8 @@ def get_profile():
     accuracy = int((correct_cases / total_cases) * 100) if total_cases > 0 else 0
 
     user_xp = int(user.get("xp", 0))
-    higher = firebase_db.collection("user").where("xp", ">", user_xp).stream()
-    rank = sum(1 for _ in higher) + 1
+    rank = rank_service.rank(user_xp)
+    percentile = rank_service.percentile(rank)
 
     badges_stream = firebase_db.collection("user_badge").where("user_id", "==", current_user_id).stream()
     earned_badge_names = [b.to_dict().get("badge_name") for b in badges_stream]
@@ -806,6 +1051,7 @@ def get_profile():
         "consecutive_correct": int(user.get("consecutive_correct", 0)),  # FIXED: Added consecutive_correct
         "earned_badges": earned_badge_names,
         "rank": rank,
+        "percentile": percentile,
         "role": user.get("role", "Dental Student"),
         "is_verified": user.get("is_verified", False)  # FIXED: Added is_verified
     })
@@ -844,29 +1090,88 @@ def update_profile():
 
     if updates:
         user_ref.update(updates)
+        leaderboard_cache.record_user(current_user_id, {**user_doc.to_dict(), **updates})
 
     return jsonify({"message": "Profile updated successfully"})
 
 
 @app.route("/auth/leaderboard", methods=["GET"])
 def get_leaderboard():
-    # Poate necesita index pentru order_by('xp' DESC). Creezi din Firebase console când îți sugerează.
-    users = firebase_db.collection("user").order_by("xp", direction=firestore.Query.DESCENDING).limit(50).get()
-    leaderboard_data = []
-    for index, u_doc in enumerate(users):
-        u = u_doc.to_dict()
+    """
+    Top 50 by XP, served from leaderboard_cache (no Firestore read).
+    Optional ?university=<name> for the per-university board.
+    Supports ETag / If-None-Match.
+    """
+    university = request.args.get("university") or None
+    snapshot = leaderboard_cache.get(university)
+    if snapshot is None:
+        return jsonify({"error": "Unknown university"}), 404
+    payload, etag = snapshot
+
+    if request.if_none_match.contains(etag):
+        return Response(status=304, headers={"ETag": f'"{etag}"', "Cache-Control": "no-cache"})
+
+    return Response(payload, mimetype="application/json",
+                    headers={"ETag": f'"{etag}"', "Cache-Control": "no-cache"})
+
+@app.route("/auth/rank/nearby", methods=["GET"])
+@jwt_required()
+def get_rank_nearby():
+    """
+    Window of users around the current user on the global leaderboard.
+    Query: ?window=5 (max 25 on each side)
+    """
+    current_user_id = get_jwt_identity()
+    user_doc = get_user_doc(current_user_id)
+    if not user_doc:
+        return jsonify({"error": "User not found"}), 404
+    user = user_doc.to_dict()
+
+    window = max(1, min(request.args.get("window", 5, type=int), 25))
+    user_xp = int(user.get("xp", 0))
+    rank = rank_service.rank(user_xp)
+    above, below = rank_service.nearby(current_user_id, user_xp, window)
+
+    def _entry(u_id, u, entry_rank):
         xp_val = int(u.get("xp", 0))
-        leaderboard_data.append({
-            "id": u_doc.id,
+        return {
+            "id": u_id,
             "username": u.get("username"),
             "xp": xp_val,
             "streak": int(u.get("streak", 0)),
-            "rank": index + 1,
+            "rank": entry_rank,
             "level": int(xp_val / 1000) + 1,
-            "role": u.get("role", "Dental Student"),  # FIXED: Added role to leaderboard
-            "university": u.get("university")  # FIXED: Added university to leaderboard (optional)
-        })
-    return jsonify(leaderboard_data)
+            "role": u.get("role", "Dental Student"),
+            "university": u.get("university")
+        }
+
+    entries = []
+    for idx, u_doc in enumerate(above):
+        entries.append(_entry(u_doc.id, u_doc.to_dict(), rank - len(above) + idx))
+    entries.append(_entry(current_user_id, user, rank))
+    for idx, u_doc in enumerate(below, start=1):
+        entries.append(_entry(u_doc.id, u_doc.to_dict(), rank + idx))
+
+    return jsonify({
+        "rank": rank,
+        "percentile": rank_service.percentile(rank),
+        "total_users": rank_service.total_users(),
+        "users": entries
+    })
+
+@app.route("/status", methods=["GET"])
+def backend_status():
+    return jsonify({
+        "message_writer": message_writer.stats(),
+        "session_cache": session_cache.stats(),
+        "token_counter": token_counter.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "llm_backends": llm_gateway.stats()
+    })
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/universities', methods=['GET'])
 def list_universities():
@@ -1009,21 +1314,27 @@ def join_classroom():
 def get_my_classrooms():
     """
     Return the list of classrooms where the current user is a member.
+    Paginated: ?limit=&cursor=, next page cursor in the X-Next-Cursor header.
     """
     current_user_id = get_jwt_identity()
+    try:
+        limit, cursor = page_params()
+    except BadCursor as e:
+        return jsonify({"error": str(e)}), 400
 
-    memberships = firebase_db.collection("class_membership") \
-        .where("user_id", "==", current_user_id).stream()
+    query = firebase_db.collection("class_membership").where("user_id", "==", current_user_id)
+    page, next_cursor = fetch_page(query, limit, cursor)
+
+    memberships = [m_doc.to_dict() for m_doc in page]
+    classrooms = get_docs_by_ids("classroom", [m.get("classroom_id") for m in memberships])
 
     classes = []
-    for m_doc in memberships:
-        m = m_doc.to_dict()
+    for m in memberships:
         c_id = m.get("classroom_id")
         role_in_class = m.get("role_in_class", "Student")
-        c_doc = firebase_db.collection("classroom").document(c_id).get()
-        if not c_doc.exists:
+        c = classrooms.get(c_id)
+        if c is None:
             continue
-        c = c_doc.to_dict()
         classes.append({
             "id": c_id,
             "name": c.get("name"),
@@ -1033,7 +1344,7 @@ def get_my_classrooms():
             "role_in_class": role_in_class
         })
 
-    return jsonify(classes), 200
+    return paged_response(classes, next_cursor)
 
 @app.route("/classroom/<classroom_id>/assignments", methods=["POST"])
 @jwt_required()
@@ -1097,10 +1408,16 @@ def create_assignment(classroom_id):
 @jwt_required()
 def list_class_assignments(class_id):
     """
-    List all assignments for a classroom.
+    List the assignments of a classroom.
+    Paginated: ?limit=&cursor=, next page cursor in the X-Next-Cursor header.
     """
-    assignments = firebase_db.collection("assignment") \
-        .where("classroom_id", "==", class_id).stream()
+    try:
+        limit, cursor = page_params()
+    except BadCursor as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = firebase_db.collection("assignment").where("classroom_id", "==", class_id)
+    assignments, next_cursor = fetch_page(query, limit, cursor)
 
     result = []
     for a_doc in assignments:
@@ -1115,27 +1432,38 @@ def list_class_assignments(class_id):
             "due_at": a.get("due_at")
         })
 
-    return jsonify(result), 200
+    return paged_response(result, next_cursor)
 
 @app.route("/classroom/<class_id>/leaderboard", methods=["GET"])
 @jwt_required()
 def classroom_leaderboard(class_id):
     """
     Leaderboard for a single classroom, based on user XP.
+    Paginated by rank: ?limit=&cursor=, next page cursor in the X-Next-Cursor header.
+    XP lives on the user docs, so ranking needs every member; only the
+    fields used for ranking are read and the response is one page.
     """
+    try:
+        limit, cursor = page_params(int_fields=("xp",))
+    except BadCursor as e:
+        return jsonify({"error": str(e)}), 400
+
     # 1. Get all members
     memberships = firebase_db.collection("class_membership") \
-        .where("classroom_id", "==", class_id).stream()
+        .where("classroom_id", "==", class_id) \
+        .select(["user_id", "role_in_class"]).stream()
+
+    memberships = [m_doc.to_dict() for m_doc in memberships]
+    users = get_docs_by_ids("user", [m.get("user_id") for m in memberships],
+                            field_paths=["username", "xp", "streak"])
 
     users_data = []
-    for m_doc in memberships:
-        m = m_doc.to_dict()
+    for m in memberships:
         user_id = m.get("user_id")
         role_in_class = m.get("role_in_class", "Student")
-        u_doc = firebase_db.collection("user").document(user_id).get()
-        if not u_doc.exists:
+        u = users.get(user_id)
+        if u is None:
             continue
-        u = u_doc.to_dict()
         xp_val = int(u.get("xp", 0))
         users_data.append({
             "user_id": user_id,
@@ -1145,12 +1473,23 @@ def classroom_leaderboard(class_id):
             "role_in_class": role_in_class
         })
 
-    users_data.sort(key=lambda x: x["xp"], reverse=True)
+    # ordine stabilă: XP descrescător, apoi user_id
+    users_data.sort(key=lambda x: (-x["xp"], x["user_id"]))
     for idx, u in enumerate(users_data, start=1):
         u["rank"] = idx
         u["level"] = int(u["xp"] / 1000) + 1
 
-    return jsonify(users_data), 200
+    start = 0
+    if cursor:
+        after = (-cursor["xp"], cursor["id"])
+        start = next((i for i, u in enumerate(users_data) if (-u["xp"], u["user_id"]) > after), len(users_data))
+    page = users_data[start:start + limit]
+
+    next_cursor = None
+    if start + limit < len(users_data):
+        next_cursor = {"xp": page[-1]["xp"], "id": page[-1]["user_id"]}
+
+    return paged_response(page, next_cursor)
 
 @app.route("/assignment/<assignment_id>/progress", methods=["GET"])
 @jwt_required()
@@ -1158,7 +1497,13 @@ def assignment_progress(assignment_id):
     """
     Report for an assignment:
     For each student in the classroom: completed/correct/avg time + done/not done.
+    Paginated: ?limit=&cursor=, next page cursor in the X-Next-Cursor header.
     """
+    try:
+        limit, cursor = page_params()
+    except BadCursor as e:
+        return jsonify({"error": str(e)}), 400
+
     ass_doc = firebase_db.collection("assignment").document(assignment_id).get()
     if not ass_doc.exists:
         return jsonify({"error": "Assignment not found"}), 404
@@ -1167,34 +1512,40 @@ def assignment_progress(assignment_id):
     classroom_id = ass.get("classroom_id")
     required_sessions = int(ass.get("required_sessions", 0))
 
-    # All students in this class
-    memberships = firebase_db.collection("class_membership") \
+    # Students in this class, one page at a time
+    query = firebase_db.collection("class_membership") \
         .where("classroom_id", "==", classroom_id) \
-        .where("role_in_class", "==", "Student").stream()
+        .where("role_in_class", "==", "Student")
+    page, next_cursor = fetch_page(query, limit, cursor)
+
+    memberships = [m_doc.to_dict() for m_doc in page]
+    user_ids = [m.get("user_id") for m in memberships if m.get("user_id")]
+    users = get_docs_by_ids("user", user_ids, field_paths=["username"])
+
+    # Progress rows of this page's students, joined by user_id
+    # ("in" acceptă max. 30 de valori per interogare)
+    progress_by_user = {}
+    for start in range(0, len(user_ids), 30):
+        for p_doc in firebase_db.collection("assignment_progress") \
+                .where("assignment_id", "==", assignment_id) \
+                .where("user_id", "in", user_ids[start:start + 30]).stream():
+            p = p_doc.to_dict()
+            progress_by_user[p.get("user_id")] = p
 
     result = []
-    for m_doc in memberships:
-        m = m_doc.to_dict()
+    for m in memberships:
         user_id = m.get("user_id")
-
-        u_doc = firebase_db.collection("user").document(user_id).get()
-        if not u_doc.exists:
+        u = users.get(user_id)
+        if u is None:
             continue
-        u = u_doc.to_dict()
-
-        # Progress for this user on this assignment
-        prog_query = firebase_db.collection("assignment_progress") \
-            .where("assignment_id", "==", assignment_id) \
-            .where("user_id", "==", user_id) \
-            .limit(1).get()
 
         completed_sessions = 0
         correct_sessions = 0
         total_duration_sec = 0.0
         is_completed_flag = False
 
-        if prog_query:
-            p = prog_query[0].to_dict()
+        p = progress_by_user.get(user_id)
+        if p:
             completed_sessions = int(p.get("completed_sessions", 0))
             correct_sessions = int(p.get("correct_sessions", 0))
             total_duration_sec = float(p.get("total_duration_sec", 0))
@@ -1212,7 +1563,7 @@ def assignment_progress(assignment_id):
             "avg_time_seconds": avg_time
         })
 
-    return jsonify(result), 200
+    return paged_response(result, next_cursor)
 
 @app.route("/chat/media/<session_id>/<image_type>", methods=["GET"])
 def serve_clinical_image(session_id, image_type):
@@ -1248,14 +1599,51 @@ def serve_clinical_image(session_id, image_type):
 
     # 3. Securely send the file from the server's hard drive
     # The browser receives the image, but the URL remains generic.
+    return send_clinical_image(subfolder, filename, cache_control=f"private, max-age={MEDIA_MAX_AGE}, immutable")
+
+@app.route("/media/<image_type>/<digest>", methods=["GET"])
+def serve_signed_clinical_image(image_type, digest):
+    """
+    Signed URL handed out by /chat/clinical-test:
+    /media/xray/<digest>?exp=...&sig=...  (verified without any database access)
+    """
+    exp = request.args.get("exp")
+    if not media_signer.verify(image_type, digest, exp, request.args.get("sig")):
+        return abort(403)
+
+    found = media_signer.lookup(digest)
+    if not found or found[0] != IMAGE_TYPES[image_type]:
+        return abort(404)
+    subfolder, filename = found
+
+    # conținutul nu se schimbă niciodată pentru un digest; URL-ul e valabil până la exp
+    remaining = max(0, int(exp) - int(dt.datetime.now(dt.UTC).timestamp()))
+    return send_clinical_image(subfolder, filename, cache_control=f"public, max-age={remaining}, immutable")
+
+def send_clinical_image(subfolder, filename, cache_control):
+    """
+    ?w=<px> + Accept choose the size bucket / format (WebP if accepted);
+    without built variants we fall back to the original JPG.
+    """
+    variant = media_variants.resolve_variant(
+        ASSETS_FOLDER, subfolder, filename,
+        request.args.get("w", type=int), request.accept_mimetypes
+    )
     try:
-        return send_from_directory(
-            directory=os.path.join(ASSETS_FOLDER, subfolder),
-            path=filename
-        )
+        if variant:
+            directory, name, mimetype = variant
+            response = send_from_directory(directory, name, mimetype=mimetype,
+                                           conditional=True, max_age=MEDIA_MAX_AGE)
+        else:
+            response = send_from_directory(os.path.join(ASSETS_FOLDER, subfolder), filename,
+                                           conditional=True, max_age=MEDIA_MAX_AGE)
     except FileNotFoundError:
         return abort(404)
 
+    response.headers["Cache-Control"] = cache_control
+    response.headers["Vary"] = "Accept"
+    return response
+
 @app.route("/chat/submit-treatment", methods=["POST"])
 @jwt_required()
 def submit_treatment_plan():
@@ -0,0 +1,49 @@
+from firebase_admin import firestore
+
+# Regulile pentru insigne, in ordinea in care apar in mesajul de raspuns.
+# (nume, bonus XP, conditie evaluata pe statisticile cererii /chat/diagnose)
+# Statistici disponibile: is_correct, duration, category, category_correct,
+# consecutive_correct, completed_cases, streak, hour (UTC).
+BADGE_RULES = [
+    ("Speed Demon", 100, lambda s: s["is_correct"] and s["duration"] < 120),
+    ("Perfect Ten", 300, lambda s: s["is_correct"] and s["consecutive_correct"] >= 10),
+    ("Endodontist Expert", 500, lambda s: s["is_correct"] and s["category"] == "Pulpal" and s["category_correct"] >= 20),
+    ("Periodontal Pro", 500, lambda s: s["is_correct"] and s["category"] == "Periodontal" and s["category_correct"] >= 20),
+    ("First Steps", 50, lambda s: True),
+    ("Master Diagnostician", 2000, lambda s: s["completed_cases"] >= 100),
+    ("Early Bird", 25, lambda s: s["hour"] < 7),
+    ("Night Owl", 25, lambda s: s["hour"] >= 23),
+    ("Week Warrior", 150, lambda s: s["streak"] >= 7),
+    ("Monthly Master", 1000, lambda s: s["streak"] >= 30),
+]
+
+
+def load_earned_badges(db, user_id):
+    """All badge names the user already has: one query per request."""
+    docs = db.collection("user_badge").where("user_id", "==", user_id).stream()
+    return {d.to_dict().get("badge_name") for d in docs}
+
+
+def evaluate_badges(stats, earned):
+    """Rules that pass and are not earned yet: [(badge_name, xp_bonus)]."""
+    return [(name, xp) for name, xp, rule in BADGE_RULES
+            if name not in earned and rule(stats)]
+
+
+def award_badges(db, batch, user_id, awards):
+    """
+    Adds one user_badge doc per award to `batch` (nothing is written until
+    the caller commits). Returns (alerts text, total XP bonus); the bonus is
+    meant to be folded into the request's own xp increment.
+    """
+    alerts = ""
+    xp_bonus = 0
+    for name, xp in awards:
+        batch.set(db.collection("user_badge").document(), {
+            "user_id": user_id,
+            "badge_name": name,
+            "awarded_at": firestore.SERVER_TIMESTAMP
+        })
+        alerts += f" [BADGE: {name}]"
+        xp_bonus += xp
+    return alerts, xp_bonus
@@ -0,0 +1,399 @@
+"""
+Offline evaluation of the patient model on the reference dialogues.
+
+Every conversation in ai/datasets/date_verificate and ai/datasets/Toate Bolile
+is replayed turn by turn: for each student message the model gets the
+reference history up to that message (system prompt included) and its reply
+is compared with the reference patient reply. Per disease the report has:
+
+  throughput   TTFT p50/p95 and decode tokens/s (from ai_server's timings)
+  leakage      replies naming the diagnosis when the reference reply doesn't
+  consistency  symptoms both replies talk about (cold, heat, biting, swelling,
+               fever, night pain, ...) with the same yes/no polarity;
+               contradictions are the ones where they disagree
+  overlap      word-level F1 against the reference reply
+
+Targets: a running ai_server (--server, streamed /generate) or the GGUF
+loaded in-process (--local, same GenerationScheduler as ai_server).
+Turns run `--concurrency` at a time. Each finished turn is appended to the
+checkpoint (JSONL), so an interrupted run resumes where it stopped when
+started again with the same --checkpoint; --fresh discards it.
+
+    python bench/evaluate.py --server http://127.0.0.1:5000 --concurrency 4
+    python bench/evaluate.py --local /MODEL_FINAL_DENTAL.gguf --slots 2 --diseases "Pulp Necrosis"
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+DATASETS_DIR = os.path.join(BACKEND_DIR, "..", "..", "ai", "datasets")
+DEFAULT_DATASETS = ("date_verificate", "Toate Bolile")
+sys.path.insert(0, BACKEND_DIR)
+
+from run import percentile  # noqa: E402
+
+# cuvinte din numele bolii care nu trădează diagnosticul singure
+GENERIC_WORDS = {"acute", "chronic", "chronical", "simple", "total", "related", "pain",
+                 "reversible", "irreversible", "tooth"}
+NEGATIONS = {"no", "not", "don't", "doesn't", "didn't", "never", "nothing", "nope",
+             "neither", "nor", "without", "haven't", "hasn't", "isn't", "wasn't", "can't"}
+SYMPTOMS = {
+    "cold": ("cold", "ice", "iced", "chilled", "freezing"),
+    "heat": ("hot", "heat", "warm", "coffee", "tea"),
+    "biting": ("bite", "biting", "chew", "chewing", "bit"),
+    "swelling": ("swelling", "swollen", "swell", "puffy"),
+    "fever": ("fever", "feverish", "temperature"),
+    "night": ("night", "sleep", "asleep", "wake", "woke"),
+    "spontaneous": ("spontaneous", "spontaneously", "constant", "constantly", "throbbing"),
+    "percussion": ("tap", "tapping", "tapped", "percussion"),
+    "pus": ("pus", "discharge", "drainage"),
+    "gum": ("gum", "gums", "palpation"),
+}
+WORD_RE = re.compile(r"[a-z']+")
+
+
+# --- dataset ---
+
+def iter_turns(dataset_names, diseases=None):
+    """
+    Yields one dict per patient reply that follows a student message:
+    {key, dataset, disease, prompt (messages before the reply), reference}.
+    Files are read one at a time.
+    """
+    for name in dataset_names:
+        folder = os.path.join(DATASETS_DIR, name)
+        for filename in sorted(os.listdir(folder)):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(folder, filename), encoding="utf-8") as f:
+                conversations = json.load(f)
+            for ci, conv in enumerate(conversations):
+                disease = conv["diagnostic"]
+                if diseases and disease not in diseases:
+                    continue
+                messages = conv["messages"]
+                for j in range(1, len(messages)):
+                    if messages[j]["role"] == "assistant" and messages[j - 1]["role"] == "user":
+                        yield {
+                            "key": f"{name}/{filename}#{ci}:{j}",
+                            "dataset": name,
+                            "disease": disease,
+                            "prompt": messages[:j],
+                            "reference": messages[j]["content"],
+                        }
+
+
+# --- targets ---
+
+class ServerTarget:
+    """Streamed /generate on a running ai_server."""
+
+    def __init__(self, url, timeout=120):
+        self.url = url.rstrip("/") + "/generate"
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def generate(self, messages):
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        with self.session.post(self.url, json={"messages": messages, "stream": True},
+                               stream=True, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                return {"error": f"HTTP {response.status_code}: {response.text[:200]}"}
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if "token" in event:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    parts.append(event["token"])
+                elif "error" in event:
+                    return {"error": event["error"]}
+                elif "done" in event:
+                    return _result(event, parts, started, first_token_at)
+        return {"error": "stream ended without a done event"}
+
+
+class LocalTarget:
+    """The GGUF loaded in this process (needs llama_cpp)."""
+
+    def __init__(self, model_path, slots=1, n_threads=0, max_tokens=256, temperature=0.2, top_p=0.9):
+        from llm_scheduler import GenerationScheduler
+        from model_loader import load_model
+        from prompt_cache import PromptStateCache
+
+        n_threads = n_threads or max(1, (os.cpu_count() or 4) // slots)
+        config = {"model_path": model_path, "n_ctx": 4096, "n_threads": n_threads}
+        prompt_cache = PromptStateCache(capacity=16)
+        self.scheduler = GenerationScheduler(lambda slot_id: load_model(config), n_slots=slots,
+                                             max_queue=1024, prepare=prompt_cache.prepare)
+        self.params = {"max_tokens": max_tokens, "temperature": temperature, "top_p": top_p}
+
+    def generate(self, messages):
+        started = time.perf_counter()
+        first_token_at = None
+        parts = []
+        for event in self.scheduler.submit(messages, **self.params):
+            if "token" in event:
+                if first_token_at is None:
+                    first_token_at = time.perf_counter()
+                parts.append(event["token"])
+            elif "error" in event:
+                return {"error": event["error"]}
+            else:
+                return _result(event, parts, started, first_token_at)
+        return {"error": "generation ended without a done event"}
+
+
+def _result(done, parts, started, first_token_at):
+    finished = time.perf_counter()
+    timings = done.get("timings") or {}
+    usage = done.get("usage") or {}
+    first = first_token_at or finished
+    decode_s = finished - first
+    # fără usage (ai_server mai vechi): o bucată de stream ~ un token
+    completion = usage.get("completion_tokens", len(parts))
+    return {
+        "text": "".join(parts),
+        "ttft_ms": timings.get("ttft_ms", round((first - started) * 1000, 1)),
+        "decode_tokens_per_s": timings.get("decode_tokens_per_s",
+                                           round((completion - 1) / decode_s, 1) if decode_s > 0 and completion > 1 else 0.0),
+        "prompt_tokens": usage.get("prompt_tokens", 0),
+        "completion_tokens": completion,
+        "total_ms": round((finished - started) * 1000, 1),
+    }
+
+
+# --- quality ---
+
+def words(text):
+    return WORD_RE.findall(text.lower())
+
+
+def leaked_terms(diagnosis, reply, reference):
+    """Diagnosis words in the reply that the reference reply does not use."""
+    terms = [w for w in words(diagnosis) if w not in GENERIC_WORDS and len(w) > 3]
+    reply_words, reference_words = set(words(reply)), set(words(reference))
+    return sorted(t for t in terms if t in reply_words and t not in reference_words)
+
+
+def symptom_polarity(text):
+    """{symptom: True (confirmed) / False (denied)} per sentence; plus "answer" for a leading yes/no."""
+    found = {}
+    sentences = [s for s in re.split(r"(?<=[.!?])\s+", text.strip()) if s]
+    for sentence in sentences:
+        ws = words(sentence)
+        negative = any(w in NEGATIONS for w in ws)
+        for symptom, cues in SYMPTOMS.items():
+            if any(w in cues for w in ws):
+                found[symptom] = not negative
+    first = words(text[:20])
+    if first and first[0] in ("yes", "yeah", "yep"):
+        found["answer"] = True
+    elif first and first[0] in ("no", "nope", "not"):
+        found["answer"] = False
+    return found
+
+
+def score_turn(turn, reply):
+    ref_symptoms = symptom_polarity(turn["reference"])
+    gen_symptoms = symptom_polarity(reply)
+    shared = [s for s in ref_symptoms if s in gen_symptoms]
+    contradictions = [s for s in shared if ref_symptoms[s] != gen_symptoms[s]]
+
+    ref_words, gen_words = words(turn["reference"]), words(reply)
+    common = sum(min(ref_words.count(w), gen_words.count(w)) for w in set(gen_words))
+    f1 = 2 * common / (len(ref_words) + len(gen_words)) if ref_words and gen_words else 0.0
+
+    return {
+        "leaked": leaked_terms(turn["disease"], reply, turn["reference"]),
+        "shared_symptoms": len(shared),
+        "contradictions": contradictions,
+        "overlap_f1": round(f1, 3),
+    }
+
+
+# --- checkpoint ---
+
+def load_checkpoint(path):
+    """Finished turns by key. Failed turns (e.g. ai_server was down) are left out, so they are retried."""
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # ultima linie poate fi trunchiată de o întrerupere
+            if "error" not in record:
+                records[record["key"]] = record
+    return records
+
+
+def evaluate_turn(target, turn):
+    try:
+        result = target.generate(turn["prompt"])
+    except Exception as e:
+        result = {"error": str(e)}
+    record = {"key": turn["key"], "dataset": turn["dataset"], "disease": turn["disease"]}
+    if "error" in result:
+        record["error"] = result["error"]
+        return record
+    record.update({k: v for k, v in result.items() if k != "text"})
+    record.update(score_turn(turn, result["text"]))
+    record["reply"] = result["text"]
+    return record
+
+
+# --- report ---
+
+def summarize(records):
+    ok = [r for r in records if "error" not in r]
+    with_shared = [r for r in ok if r["shared_symptoms"]]
+    shared_total = sum(r["shared_symptoms"] for r in ok)
+    contradictions = sum(len(r["contradictions"]) for r in ok)
+    decode_speeds = [r["decode_tokens_per_s"] for r in ok if r["decode_tokens_per_s"]]
+    ttfts = [r["ttft_ms"] for r in ok]
+    return {
+        "turns": len(records),
+        "errors": len(records) - len(ok),
+        "ttft_p50_ms": round(percentile(ttfts, 50), 1),
+        "ttft_p95_ms": round(percentile(ttfts, 95), 1),
+        "decode_tokens_per_s": round(statistics.fmean(decode_speeds), 1) if decode_speeds else 0.0,
+        "completion_tokens_mean": round(statistics.fmean(r["completion_tokens"] for r in ok), 1) if ok else 0.0,
+        "leak_rate": round(sum(1 for r in ok if r["leaked"]) / len(ok), 3) if ok else 0.0,
+        "symptom_consistency": round(1 - contradictions / shared_total, 3) if shared_total else None,
+        "turns_with_contradiction": sum(1 for r in with_shared if r["contradictions"]),
+        "overlap_f1": round(statistics.fmean(r["overlap_f1"] for r in ok), 3) if ok else 0.0,
+    }
+
+
+def build_results(records, args, wall_seconds):
+    by_disease = defaultdict(list)
+    for r in records:
+        by_disease[r["disease"]].append(r)
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": dt.datetime.now(dt.UTC).isoformat(),
+        "target": args.server or args.local,
+        "datasets": args.datasets,
+        "wall_seconds": round(wall_seconds, 1),
+        "overall": summarize(records),
+        "diseases": {disease: summarize(rs) for disease, rs in sorted(by_disease.items())},
+    }
+
+
+def print_results(results):
+    print(f"\ncommit {results['commit']}  target {results['target']}  {results['wall_seconds']}s")
+    header = (f"{'disease':<34}{'turns':>6}{'err':>5}{'ttft50':>9}{'ttft95':>9}{'tok/s':>8}"
+              f"{'leak':>7}{'consist':>9}{'f1':>7}")
+    print(header)
+    print("-" * len(header))
+    rows = list(results["diseases"].items()) + [("ALL", results["overall"])]
+    for disease, s in rows:
+        consistency = "-" if s["symptom_consistency"] is None else f"{s['symptom_consistency']:.3f}"
+        print(f"{disease[:33]:<34}{s['turns']:>6}{s['errors']:>5}{s['ttft_p50_ms']:>9.0f}{s['ttft_p95_ms']:>9.0f}"
+              f"{s['decode_tokens_per_s']:>8.1f}{s['leak_rate']:>7.3f}{consistency:>9}{s['overlap_f1']:>7.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the reference dialogues against the patient model")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--server", help="ai_server base URL, e.g. http://127.0.0.1:5000")
+    target.add_argument("--local", help="path to a GGUF to load in-process")
+    parser.add_argument("--datasets", nargs="+", default=list(DEFAULT_DATASETS),
+                        help="folders under ai/datasets")
+    parser.add_argument("--diseases", nargs="*", help="only these diagnoses")
+    parser.add_argument("--limit", type=int, default=0, help="evaluate at most N new turns (0 = all)")
+    parser.add_argument("--concurrency", type=int, default=2, help="turns in flight")
+    parser.add_argument("--slots", type=int, default=1, help="--local: model contexts")
+    parser.add_argument("--threads", type=int, default=0, help="--local: threads per context")
+    parser.add_argument("--checkpoint", default=os.path.join(BENCH_DIR, "results", "eval_checkpoint.jsonl"))
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results", "eval.json"))
+    parser.add_argument("--fresh", action="store_true", help="ignore and overwrite the checkpoint")
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.checkpoint)), exist_ok=True)
+    if args.fresh and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    done = load_checkpoint(args.checkpoint)
+    if done:
+        print(f"Resuming: {len(done)} turns already in {args.checkpoint}")
+
+    target = ServerTarget(args.server) if args.server else LocalTarget(args.local, args.slots, args.threads)
+
+    started = time.perf_counter()
+    submitted = 0
+    interrupted = False
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+    pending = set()
+    with open(args.checkpoint, "a", encoding="utf-8") as checkpoint:
+        def drain(return_when):
+            nonlocal pending
+            finished, pending = wait(pending, return_when=return_when)
+            for future in finished:
+                record = future.result()
+                done[record["key"]] = record
+                checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                if len(done) % 50 == 0:
+                    print(f"{len(done)} turns evaluated")
+
+        try:
+            for turn in iter_turns(args.datasets, set(args.diseases or ())):
+                if args.limit and submitted >= args.limit:
+                    break
+                if turn["key"] in done:
+                    continue
+                # cel mult `concurrency` ture în zbor: nu citim tot setul în memorie
+                if len(pending) >= args.concurrency:
+                    drain(FIRST_COMPLETED)
+                pending.add(pool.submit(evaluate_turn, target, turn))
+                submitted += 1
+            while pending:
+                drain(FIRST_COMPLETED)
+        except KeyboardInterrupt:
+            interrupted = True
+            print("\nInterrupted; finishing the turns in flight (Ctrl+C again to abort)...")
+            pool.shutdown(wait=False, cancel_futures=True)
+            try:
+                while pending:
+                    drain(FIRST_COMPLETED)
+            except KeyboardInterrupt:
+                pass
+    pool.shutdown(wait=False)
+
+    wanted_diseases = set(args.diseases or ())
+    records = [r for r in done.values() if r["dataset"] in args.datasets
+               and (not wanted_diseases or r["disease"] in wanted_diseases)]
+    results = build_results(records, args, time.perf_counter() - started)
+    print_results(results)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"results written to {args.out}" + ("  (partial: rerun to resume)" if interrupted else ""))
+
+
+if __name__ == "__main__":
+    main()
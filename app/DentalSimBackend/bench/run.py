@@ -0,0 +1,281 @@
+"""
+Load test for app.py without Firebase or a model.
+
+The app is imported with DB_BACKEND=sqlite on an in-memory database
+(the Firestore-API fake from repository.py), wrapped so every read,
+write and query is counted per request, and with AI_SERVER_URLS pointing
+at bench/stub_llm.py. Each simulated student then runs the usual flow:
+
+    register -> verify -> login -> start random case -> N chat turns
+    -> clinical tests -> diagnose -> profile -> leaderboard
+
+through Flask's test client, `--concurrency` students at a time.
+The report (p50/p95/p99 and ops per route) is printed and written as JSON
+together with the commit it was measured on; `--compare old.json` prints
+the difference against an earlier run.
+
+    python bench/run.py --students 100 --concurrency 16 --llm-latency 0.3
+    python bench/run.py --out bench/results/new.json --compare bench/results/base.json
+"""
+import argparse
+import datetime as dt
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from stub_llm import start_stub  # noqa: E402
+from db_metrics import OpCounter, instrument_db  # noqa: E402
+
+CATEGORIES = ["Pulpal", "Periodontal", "Non Endodontic"]
+CHAT_QUESTIONS = [
+    "Hello, what brings you in today?",
+    "Where exactly does it hurt?",
+    "When did the pain start?",
+    "Does it hurt with cold or hot drinks?",
+    "How long does the pain last after the stimulus?",
+    "Does it wake you up at night?",
+    "Does it hurt when you bite down?",
+    "Have you noticed any swelling?",
+    "Have you taken any painkillers?",
+    "Have you had any dental work on this tooth?",
+]
+CLINICAL_TESTS = ["percussion", "thermal", "examine", "xray"]
+
+
+def load_app(llm_url):
+    """Imports app.py against the in-memory store and the stub LLM."""
+    os.environ.update({
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": ":memory:",
+        "AI_SERVER_URLS": llm_url,
+        "SMTP_EMAIL": "bench@example.com",
+        "SMTP_PASSWORD": "bench",
+        "DISEASE_CATALOG_LISTEN": "0",
+        "MEDIA_VARIANTS_AT_STARTUP": "0",
+        "AI_HEALTH_INTERVAL": "0",
+    })
+    import repository
+
+    counter = OpCounter()
+    stores = []
+    open_repository = repository.open_repository
+
+    def open_counted(*args, **kwargs):
+        stores.append(open_repository(*args, **kwargs))
+        return instrument_db(stores[-1], counter)
+    repository.open_repository = open_counted
+
+    import app as app_module
+    app_module.send_verification_email = lambda to_email, code: None
+    # stores[0]: store-ul fără proxy, pentru seed și citirile proprii ale benchmark-ului
+    return app_module, counter, stores[0]
+
+
+def seed_diseases(db, assets_folder):
+    """One disease per x-ray / examine image family in clinical_assets."""
+    families = defaultdict(lambda: {"xray_images": [], "examine_images": []})
+    for subfolder, key in (("xrays", "xray_images"), ("examine", "examine_images")):
+        folder = os.path.join(assets_folder, subfolder)
+        for filename in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            stem = os.path.splitext(filename)[0].rstrip("0123456789").replace("_", "-")
+            families[stem][key].append(filename)
+
+    batch = db.batch()
+    for index, (stem, images) in enumerate(sorted(families.items())):
+        name = stem.replace("-", " ").title()
+        batch.set(db.collection("disease").document(), {
+            "name": name,
+            "category": CATEGORIES[index % len(CATEGORIES)],
+            # prompt de lungimea celor reale (~2-3 KB)
+            "system_prompt": f"### ROLE\nYou are a simulated dental patient. Your diagnosis is {name}.\n" * 30,
+            **images,
+        })
+    batch.commit()
+    return [n.replace("-", " ").title() for n in sorted(families)]
+
+
+class Recorder:
+    def __init__(self, counter):
+        self.counter = counter
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)   # route -> [(ms, status, ops)]
+
+    def call(self, client, method, path, route=None, **kwargs):
+        self.counter.begin()
+        started = time.perf_counter()
+        response = getattr(client, method)(path, **kwargs)
+        body = response.get_data(as_text=True)  # consumă și răspunsurile stream
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        ops = self.counter.end()
+        status = response.status_code
+        if response.mimetype == "application/x-ndjson" and stream_failed(body):
+            status = 502  # eroarea a venit în corpul stream-ului, după 200
+        with self._lock:
+            self.samples[route or path].append((elapsed_ms, status, ops))
+        return response
+
+
+def stream_failed(body):
+    """True if an NDJSON body has an {"error"} line or never reached {"done"}."""
+    events = [json.loads(line) for line in body.splitlines() if line.strip()]
+    return any("error" in e for e in events) or not any("done" in e for e in events)
+
+
+def student_flow(flask_app, store, recorder, index, disease_names, args, rng):
+    client = flask_app.test_client()
+    username = f"bench{index}_{rng.randrange(10 ** 6)}"
+    email = f"{username}@umfcluj.ro"
+
+    recorder.call(client, "post", "/auth/register",
+                  json={"username": username, "password": "bench-pass", "email": email})
+    # codul trimis pe email îl citim direct din store (fără numărare)
+    user_doc = store.collection("user").where("email", "==", email).limit(1).get()[0]
+    recorder.call(client, "post", "/auth/verify",
+                  json={"email": email, "code": user_doc.to_dict()["verification_code"]})
+    token = recorder.call(client, "post", "/auth/login",
+                          json={"username": username, "password": "bench-pass"}).get_json()["token"]
+    headers = {"Authorization": f"Bearer {token}"}
+
+    session_id = recorder.call(client, "post", "/chat/start/random",
+                               headers=headers, json={}).get_json()["session_id"]
+
+    for question in CHAT_QUESTIONS[:args.turns]:
+        recorder.call(client, "post", "/chat", headers=headers,
+                      json={"session_id": session_id, "message": question, "stream": args.stream})
+
+    for test_type in CLINICAL_TESTS:
+        recorder.call(client, "post", "/chat/clinical-test", headers=headers,
+                      json={"session_id": session_id, "test_type": test_type})
+
+    recorder.call(client, "post", "/chat/diagnose", headers=headers,
+                  json={"session_id": session_id, "diagnosis": rng.choice(disease_names)})
+    recorder.call(client, "get", "/auth/profile", headers=headers)
+    recorder.call(client, "get", "/auth/leaderboard", headers=headers)
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo, hi = int(k), min(int(k) + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+def build_report(recorder, args, wall_seconds):
+    routes = {}
+    for route, samples in sorted(recorder.samples.items()):
+        latencies = [s[0] for s in samples]
+        n = len(samples)
+        ops_total = defaultdict(int)
+        for _, _, ops in samples:
+            for kind, count in ops.items():
+                ops_total[kind] += count
+        routes[route] = {
+            "requests": n,
+            "errors": sum(1 for s in samples if s[1] >= 400),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "mean_ms": round(statistics.fmean(latencies), 2),
+            "ops_per_request": {kind: round(total / n, 2) for kind, total in sorted(ops_total.items())},
+        }
+
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                         cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "created_at": dt.datetime.now(dt.UTC).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "wall_seconds": round(wall_seconds, 2),
+        "total_requests": sum(r["requests"] for r in routes.values()),
+        "background_ops": recorder.counter.background_totals(),
+        "routes": routes,
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"\ncommit {report['commit']}  {report['total_requests']} requests in {report['wall_seconds']}s  "
+          f"config {json.dumps(report['config'])}")
+    header = f"{'route':<22}{'n':>6}{'err':>5}{'p50':>9}{'p95':>9}{'p99':>9}   ops/request"
+    print(header)
+    print("-" * len(header))
+    for route, r in report["routes"].items():
+        ops = " ".join(f"{k}={v:g}" for k, v in r["ops_per_request"].items())
+        line = f"{route:<22}{r['requests']:>6}{r['errors']:>5}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}   {ops}"
+        old = (baseline or {}).get("routes", {}).get(route)
+        if old:
+            delta = r["p95_ms"] - old["p95_ms"]
+            line += f"   (p95 {delta:+.1f} ms vs {baseline.get('commit')})"
+            old_ops = old["ops_per_request"]
+            changed = {k: v - old_ops.get(k, 0) for k, v in r["ops_per_request"].items() if v != old_ops.get(k, 0)}
+            if changed:
+                line += " ops " + " ".join(f"{k}{v:+g}" for k, v in changed.items())
+        print(line)
+    print(f"background ops: {report['background_ops']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DentalSim backend load test")
+    parser.add_argument("--students", type=int, default=50, help="number of student flows")
+    parser.add_argument("--concurrency", type=int, default=8, help="flows running at the same time")
+    parser.add_argument("--turns", type=int, default=10, help="chat turns per flow")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="stub seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="stub seconds per token")
+    parser.add_argument("--stream", action="store_true", help="use streaming /chat")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default=os.path.join(BENCH_DIR, "results", "latest.json"))
+    parser.add_argument("--compare", help="earlier report to diff against")
+    args = parser.parse_args()
+
+    _, llm_url = start_stub(latency=args.llm_latency, token_delay=args.token_delay)
+    app_module, counter, store = load_app(llm_url)
+    disease_names = seed_diseases(store, app_module.ASSETS_FOLDER)
+
+    recorder = Recorder(counter)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [pool.submit(student_flow, app_module.app, store, recorder, i, disease_names, args,
+                               random.Random(args.seed * 100_003 + i))
+                   for i in range(args.students)]
+        for future in futures:
+            future.result()
+    wall_seconds = time.perf_counter() - started
+    app_module.message_writer.flush()
+
+    report = build_report(recorder, args, wall_seconds)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"report written to {args.out}")
+
+    chat_errors = sum(r["errors"] for route, r in report["routes"].items() if route.startswith("/chat"))
+    if chat_errors:
+        print(f"FAILED: {chat_errors} /chat request(s) returned errors")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Stand-in for ai_server.py: same /generate, /tokenize and /status contract, no model.
+
+Every reply takes `latency` seconds before the first token and
+`token_delay` seconds per token after that, so the backend sees the same
+waiting pattern as with a real model without loading one.
+
+    python bench/stub_llm.py --port 5000 --latency 0.5 --token-delay 0.02
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = ("It started about three days ago. The pain comes and goes, "
+         "mostly when I drink something cold, and it keeps me up at night.")
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.5
+    token_delay = 0.0
+
+    def log_message(self, fmt, *args):
+        pass  # fără log per request; ar domina timpul măsurat
+
+    def _send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._send_json(200, {"status": "ok", "stub": True})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path == "/tokenize":
+            length = int(self.headers.get("Content-Length", 0))
+            texts = json.loads(self.rfile.read(length) or b"{}").get("texts", [])
+            # aproximare: ~1.3 tokeni per cuvânt
+            self._send_json(200, {"counts": [int(len(t.split()) * 1.3) + 1 for t in texts]})
+            return
+        if self.path != "/generate":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        tokens = [w + " " for w in REPLY.split()][:int(payload.get("max_new_tokens", 150))]
+
+        time.sleep(self.latency)
+        if not payload.get("stream"):
+            time.sleep(self.token_delay * len(tokens))
+            self._send_json(200, {"generated_text": "".join(tokens).strip()})
+            return
+
+        # NDJSON ca ai_server: {"token"} ..., apoi {"done", "generated_text"}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for token in tokens:
+            self.wfile.write((json.dumps({"token": token}) + "\n").encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.token_delay)
+        done = {"done": True, "generated_text": "".join(tokens).strip()}
+        self.wfile.write((json.dumps(done) + "\n").encode("utf-8"))
+        self.close_connection = True
+
+
+def start_stub(port=0, latency=0.5, token_delay=0.0):
+    """Starts the stub in a daemon thread. Returns (server, base_url)."""
+    handler = type("ConfiguredStubLLMHandler", (StubLLMHandler,),
+                   {"latency": latency, "token_delay": token_delay})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub /generate server for benchmarks")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first token")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds per generated token")
+    args = parser.parse_args()
+
+    server, url = start_stub(args.port, args.latency, args.token_delay)
+    print(f"Stub LLM on {url} (latency {args.latency}s, {args.token_delay}s/token)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,181 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+# tokenii adăugați de chat template în jurul fiecărui mesaj (antet rol + terminator)
+MESSAGE_OVERHEAD_TOKENS = 5
+SUMMARY_HEADER = "Summary of the earlier part of this visit (stay consistent with it):"
+
+
+class PromptTooLong(Exception):
+    """The system prompt plus the newest message alone exceed the prompt budget."""
+
+    def __init__(self, tokens, budget):
+        super().__init__(f"Message too long: {tokens} prompt tokens, the limit is {budget}")
+        self.tokens = tokens
+        self.budget = budget
+
+
+def summary_line(message, max_chars=160):
+    """
+    One extractive line for a message that left the context window: the
+    student's question, or the first sentence of the patient's answer.
+    """
+    text = " ".join(message["content"].split())
+    if message["sender"] == "student":
+        line = f"- Student asked: {text}"
+    else:
+        first = re.split(r"(?<=[.!?])\s", text, maxsplit=1)[0]
+        line = f"- You answered: {first}"
+    return line if len(line) <= max_chars else line[:max_chars - 3].rstrip() + "..."
+
+
+class TokenCounter:
+    """
+    Token counts from the model's own tokenizer (ai_server /tokenize through
+    `tokenize_remote(texts) -> [counts]`), cached per text in an LRU, so each
+    message is tokenized once per backend process. If the tokenizer cannot
+    be reached the count is estimated from the length and not cached.
+    """
+
+    def __init__(self, tokenize_remote, capacity=50_000, chars_per_token=3.5):
+        self._tokenize_remote = tokenize_remote
+        self.capacity = capacity
+        self.chars_per_token = chars_per_token
+        self._lock = threading.Lock()
+        self._counts = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.estimated = 0
+        self._degraded = False
+
+    @staticmethod
+    def _key(text):
+        return hashlib.sha1(text.encode("utf-8")).digest()
+
+    def count_many(self, texts):
+        keys = [self._key(t) for t in texts]
+        counts = [None] * len(texts)
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._counts:
+                    self._counts.move_to_end(key)
+                    counts[i] = self._counts[key]
+        missing = [i for i, c in enumerate(counts) if c is None]
+        with self._lock:
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        if not missing:
+            return counts
+
+        try:
+            fetched = self._tokenize_remote([texts[i] for i in missing])
+        except Exception as e:
+            if not self._degraded:
+                print(f"[context_builder] tokenizer unavailable, estimating: {e}")
+            self._degraded = True
+            with self._lock:
+                self.estimated += len(missing)
+            for i in missing:
+                counts[i] = int(len(texts[i]) / self.chars_per_token) + 1
+            return counts
+
+        self._degraded = False
+        with self._lock:
+            for i, n in zip(missing, fetched):
+                counts[i] = n
+                self._counts[keys[i]] = n
+            while len(self._counts) > self.capacity:
+                self._counts.popitem(last=False)
+        return counts
+
+    def count(self, text):
+        return self.count_many([text])[0]
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._counts), "hits": self.hits,
+                    "misses": self.misses, "estimated": self.estimated}
+
+
+class ContextBuilder:
+    """
+    Builds the /chat prompt inside a fixed token budget:
+
+      system prompt
+      + rolling summary of older turns (at most `summary_budget` tokens)
+      + as many of the most recent messages as fit, newest first
+
+    `prompt_budget` covers everything sent as prompt, so prefill per turn
+    is bounded; keep it below n_ctx minus the reply's max_new_tokens.
+    The latest message is always kept whole: if it does not fit next to the
+    system prompt, build() raises PromptTooLong instead of overflowing n_ctx.
+    """
+
+    def __init__(self, counter, prompt_budget=3072, summary_budget=384):
+        self.counter = counter
+        self.prompt_budget = prompt_budget
+        self.summary_budget = summary_budget
+
+    def build(self, system_prompt, messages, older_summary=()):
+        """
+        `messages`: [{"sender", "content"}] oldest first; `older_summary`:
+        summary lines of messages no longer in `messages`.
+        Returns (chat messages for the LLM, stats dict).
+        """
+        messages = list(messages)
+        counts = self.counter.count_many([system_prompt] + [m["content"] for m in messages])
+        used = counts[0] + MESSAGE_OVERHEAD_TOKENS
+        if messages and used + counts[-1] + MESSAGE_OVERHEAD_TOKENS > self.prompt_budget:
+            raise PromptTooLong(used + counts[-1] + MESSAGE_OVERHEAD_TOKENS, self.prompt_budget)
+
+        # rezervăm loc pentru rezumat doar dacă există ceva de rezumat
+        kept, history_tokens = self._fit_history(counts[1:], self.prompt_budget - used)
+        if kept < len(messages) or older_summary:
+            kept, history_tokens = self._fit_history(counts[1:], self.prompt_budget - used - self.summary_budget)
+        dropped = messages[:len(messages) - kept]
+
+        lines = list(older_summary) + [summary_line(m) for m in dropped]
+        summary, summary_tokens = self._fit_summary(lines)
+
+        chat = [{"role": "system", "content": system_prompt}]
+        if summary:
+            chat.append({"role": "system", "content": summary})
+        for m in messages[len(messages) - kept:]:
+            chat.append({"role": "user" if m["sender"] == "student" else "assistant", "content": m["content"]})
+
+        return chat, {
+            "prompt_tokens": used + history_tokens + summary_tokens,
+            "messages_kept": kept,
+            "messages_summarized": len(lines),
+        }
+
+    @staticmethod
+    def _fit_history(counts, budget):
+        """How many of the newest messages fit in `budget` (at least one)."""
+        kept = 0
+        tokens = 0
+        for n in reversed(counts):
+            cost = n + MESSAGE_OVERHEAD_TOKENS
+            if kept and tokens + cost > budget:
+                break
+            tokens += cost
+            kept += 1
+        return kept, tokens
+
+    def _fit_summary(self, lines):
+        """Newest summary lines that fit in summary_budget (older ones fall off)."""
+        if not lines or self.summary_budget <= 0:
+            return "", 0
+        counts = self.counter.count_many([SUMMARY_HEADER] + lines)
+        total = counts[0] + MESSAGE_OVERHEAD_TOKENS
+        start = len(lines)
+        for i in range(len(lines) - 1, -1, -1):
+            if total + counts[i + 1] + 1 > self.summary_budget:
+                break
+            total += counts[i + 1] + 1
+            start = i
+        if start == len(lines):
+            return "", 0
+        return SUMMARY_HEADER + "\n" + "\n".join(lines[start:]), total
@@ -0,0 +1,140 @@
+"""
+Proxy around the database object (Firestore client or SQLiteRepository)
+that counts reads, writes, queries and batch commits.
+
+Counts go to the scope opened with begin() (one HTTP request, see
+metrics.py, or one call of the load test). The scope lives in a context
+variable, so work submitted to another thread inside a copy of the caller's
+context (app.run_concurrently) is counted for the same request; operations
+made outside a scope, e.g. by the message writer thread, land in `background`.
+Reads are counted per returned document, the way Firestore bills them.
+"""
+import contextvars
+import itertools
+import threading
+from collections import defaultdict
+
+# metode care întorc alt obiect din lanțul Firestore (referință / query / batch)
+_CHAINED = {"collection", "document", "where", "order_by", "limit", "start_after", "select", "count", "batch"}
+_ids = itertools.count()
+
+
+class OpCounter:
+    def __init__(self):
+        self._ops = contextvars.ContextVar(f"db_ops_{next(_ids)}", default=None)
+        self._lock = threading.Lock()
+        self.background = defaultdict(int)
+
+    def begin(self):
+        self._ops.set(defaultdict(int))
+
+    def current(self):
+        """Counts of the open scope so far (empty dict outside a scope)."""
+        with self._lock:
+            return dict(self._ops.get() or {})
+
+    def end(self):
+        ops = self._ops.get()
+        self._ops.set(None)
+        with self._lock:
+            return dict(ops or {})
+
+    def add(self, kind, n=1):
+        ops = self._ops.get()
+        with self._lock:
+            # același dict poate primi operații și de pe firele io_pool ale cererii
+            if ops is not None:
+                ops[kind] += n
+            else:
+                self.background[kind] += n
+
+    def background_totals(self):
+        with self._lock:
+            return dict(self.background)
+
+
+class _Proxy:
+    def __init__(self, target, counter, kind):
+        self._target = target
+        self._counter = counter
+        self._kind = kind          # client | query | document | batch | aggregation
+        self._pending = 0          # scrieri adunate într-un batch
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            args = [_unwrap(a) for a in args]
+            if name == "get_all":
+                return self._count_docs(attr(*args, **kwargs), query=False)
+            result = attr(*args, **kwargs)
+            return self._account(name, result)
+
+        return call
+
+    def _account(self, name, result):
+        counter = self._counter
+        if name in _CHAINED:
+            kind = {"collection": "query", "document": "document", "batch": "batch",
+                    "count": "aggregation"}.get(name, self._kind)
+            if name == "document" and self._kind == "document":
+                kind = "query"  # subcolecție
+            return _Proxy(result, counter, kind)
+
+        if self._kind == "batch":
+            if name in ("set", "update", "delete", "create"):
+                self._pending += 1
+            elif name == "commit":
+                counter.add("writes", self._pending)
+                counter.add("commits")
+                self._pending = 0
+            return result
+
+        if self._kind == "document":
+            if name == "get":
+                counter.add("reads")
+            elif name in ("set", "update", "delete", "create"):
+                counter.add("writes")
+            return result
+
+        if self._kind == "aggregation" and name == "get":
+            counter.add("queries")
+            counter.add("reads")  # Firestore taxează o citire per 1000 de intrări de index
+            return result
+
+        if self._kind == "query":
+            if name == "add":
+                counter.add("writes")
+            elif name == "get":
+                return self._count_docs(result, query=True)
+            elif name == "stream":
+                return self._count_docs(result, query=True)
+        return result
+
+    def _count_docs(self, docs, query):
+        counter = self._counter
+        if query:
+            counter.add("queries")
+        if isinstance(docs, list):
+            counter.add("reads", len(docs))
+            return docs
+
+        def counted():
+            for doc in docs:
+                counter.add("reads")
+                yield doc
+        return counted()
+
+
+def _unwrap(value):
+    if isinstance(value, _Proxy):
+        return value._target
+    if isinstance(value, list):
+        return [_unwrap(v) for v in value]
+    return value
+
+
+def instrument_db(db, counter):
+    return _Proxy(db, counter, "client")
@@ -0,0 +1,179 @@
+import random
+import threading
+import time
+
+
+class DiseaseCatalog:
+    """
+    In-process copy of the `disease` collection.
+
+    Diseases are loaded once and kept together with the endo / non-endo
+    selection pools and the id / name indexes, so session start and every
+    chat turn can resolve a disease without a Firestore read.
+    The copy is refreshed either by a snapshot listener (start_listener)
+    or, as a fallback, when it is older than `ttl_seconds`: the first load is
+    made by one caller while the others wait for it, later ones run on a
+    background thread while the previous copy keeps being served.
+    An unknown id triggers at most one reload per `miss_refresh_interval`
+    seconds, so lookups of deleted ids don't reload the whole collection.
+    """
+
+    def __init__(self, db, collection="disease", ttl_seconds=300, miss_refresh_interval=30):
+        self._db = db
+        self._collection = collection
+        self._ttl = ttl_seconds
+        self._miss_refresh_interval = miss_refresh_interval
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._loaded_at = 0.0
+        self._listener = None
+
+        self._docs = []
+        self._by_id = {}
+        self._by_name = {}
+        self._endo_docs = []
+        self._non_endo_docs = []
+
+    # --- loading ---
+
+    def _rebuild(self, docs):
+        docs = list(docs)
+        by_id = {}
+        by_name = {}
+        endo_docs = []
+        non_endo_docs = []
+
+        for d in docs:
+            data = d.to_dict() or {}
+            by_id[d.id] = d
+            if data.get("name"):
+                by_name[data["name"]] = d
+
+            category = data.get("category", "").lower()
+            if "non endodontic" in category:
+                non_endo_docs.append(d)
+            else:
+                endo_docs.append(d)
+
+        # swap everything at once, readers never see a half-built catalog
+        with self._lock:
+            changed = len(docs) != len(self._docs) or not self._loaded_at
+            self._docs = docs
+            self._by_id = by_id
+            self._by_name = by_name
+            self._endo_docs = endo_docs
+            self._non_endo_docs = non_endo_docs
+            self._loaded_at = time.monotonic()
+
+        # listener-ul reconstruiește la fiecare modificare; logăm doar când se schimbă numărul
+        if changed:
+            print(f"[disease_catalog] loaded {len(docs)} diseases "
+                  f"({len(endo_docs)} endo, {len(non_endo_docs)} non-endo)")
+
+    def refresh(self):
+        self._rebuild(self._db.collection(self._collection).get())
+
+    def _ensure_fresh(self):
+        if not self._loaded_at:
+            # prima încărcare: un singur apelant citește colecția, ceilalți îl așteaptă
+            with self._load_lock:
+                if not self._loaded_at:
+                    self.refresh()
+            return
+        if self._listener is not None or time.monotonic() - self._loaded_at <= self._ttl:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="disease-catalog-refresh", daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"[disease_catalog] refresh failed, serving the previous copy: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def start_listener(self):
+        """
+        Keep the catalog in sync through a Firestore snapshot listener.
+        The callback receives the full collection, so we simply rebuild.
+        """
+        if self._listener is not None:
+            return
+
+        def on_snapshot(col_snapshot, changes, read_time):
+            self._rebuild(col_snapshot)
+
+        self._listener = self._db.collection(self._collection).on_snapshot(on_snapshot)
+
+    def stop_listener(self):
+        if self._listener is not None:
+            self._listener.unsubscribe()
+            self._listener = None
+
+    # --- lookups ---
+
+    def _refresh_on_miss(self):
+        """Reloads for an unknown id unless the catalog is listened to or was loaded recently."""
+        if self._listener is not None:
+            return False
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self._miss_refresh_interval:
+                return False
+            # ceilalți care ratează în același timp nu mai reîncarcă
+            self._loaded_at = time.monotonic()
+        self.refresh()
+        return True
+
+    def get(self, disease_id):
+        if not disease_id:
+            return None
+        self._ensure_fresh()
+        doc = self._by_id.get(disease_id)
+        if doc is None and self._refresh_on_miss():
+            # disease added since the last refresh
+            doc = self._by_id.get(disease_id)
+        return doc
+
+    def get_by_name(self, name):
+        self._ensure_fresh()
+        return self._by_name.get(name)
+
+    def all(self):
+        self._ensure_fresh()
+        return list(self._docs)
+
+    def random_disease(self, allowed_names=None):
+        self._ensure_fresh()
+        with self._lock:
+            docs = self._docs
+            endo_docs = self._endo_docs
+            non_endo_docs = self._non_endo_docs
+            by_name = self._by_name
+
+        if not docs:
+            return None
+
+        # daca nu avem filtru, alegem direct
+        if allowed_names is None:
+            # Handle edge case: if we have no non-endo diseases in DB, just pick from all
+            if not non_endo_docs:
+                return random.choice(docs)
+
+            # all non-endo diseases together weigh as much as one endo disease
+            choice = random.randrange(len(endo_docs) + 1)
+            if choice == len(endo_docs):
+                return random.choice(non_endo_docs)
+            return endo_docs[choice]
+
+        filtered = [by_name[n] for n in set(allowed_names) if n in by_name]
+        if not filtered:
+            # nu există boli care să se potrivească cu allowed_names
+            return None
+
+        return random.choice(filtered)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import threading
+import time
+
+from firebase_admin import firestore
+
+
+def _entry(user_id, u):
+    return {
+        "id": user_id,
+        "username": u.get("username"),
+        "xp": int(u.get("xp", 0)),
+        "streak": int(u.get("streak", 0)),
+        "role": u.get("role", "Dental Student"),
+        "university": u.get("university"),
+    }
+
+
+class _Board:
+    """One top-N list with its serialized payload and ETag."""
+
+    def __init__(self, top_n):
+        self.top_n = top_n
+        self.entries = []
+        self.payload = b"[]"
+        self.etag = ""
+
+    def set(self, entries):
+        self.entries = sorted(entries, key=lambda e: (-e["xp"], e["id"]))[:self.top_n]
+        self._serialize()
+
+    def upsert(self, entry):
+        """Returns True if the board changed."""
+        others = [e for e in self.entries if e["id"] != entry["id"]]
+        in_board = len(others) != len(self.entries)
+        if not in_board and len(others) >= self.top_n and entry["xp"] <= others[-1]["xp"]:
+            return False
+        self.set(others + [entry])
+        return True
+
+    def _serialize(self):
+        data = []
+        for index, e in enumerate(self.entries):
+            data.append({
+                "id": e["id"],
+                "username": e["username"],
+                "xp": e["xp"],
+                "streak": e["streak"],
+                "rank": index + 1,
+                "level": int(e["xp"] / 1000) + 1,
+                "role": e["role"],
+                "university": e["university"],
+            })
+        self.payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+        self.etag = hashlib.sha1(self.payload).hexdigest()[:16]
+
+
+class LeaderboardCache:
+    """
+    In-memory top-N leaderboards: global and one per university.
+
+    Boards are loaded from Firestore once (and re-synced every `ttl_seconds`
+    to pick up XP changed by other backend processes); in between they are
+    updated in place when this process changes a user's XP, so
+    /auth/leaderboard serves prebuilt bytes without any Firestore read.
+    The first load happens once, in the first caller; after the TTL one
+    background refresh runs while requests keep serving the stale boards.
+    """
+
+    def __init__(self, db, universities, top_n=50, ttl_seconds=300):
+        self._db = db
+        self._universities = list(universities)
+        self.top_n = top_n
+        self._ttl = ttl_seconds
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._refreshing = False
+        self._loaded_at = 0.0
+        self._global = _Board(top_n)
+        self._by_university = {name: _Board(top_n) for name in self._universities}
+
+    def _query_top(self, university=None):
+        query = self._db.collection("user")
+        if university is not None:
+            # necesită index compus (university, xp desc) în Firestore
+            query = query.where("university", "==", university)
+        docs = query.order_by("xp", direction=firestore.Query.DESCENDING).limit(self.top_n).get()
+        return [_entry(d.id, d.to_dict()) for d in docs]
+
+    def refresh(self):
+        global_entries = self._query_top()
+        per_university = {name: self._query_top(name) for name in self._universities}
+        with self._lock:
+            self._global.set(global_entries)
+            for name, entries in per_university.items():
+                self._by_university[name].set(entries)
+            self._loaded_at = time.monotonic()
+
+    def _ensure_fresh(self):
+        if not self._loaded_at:
+            # prima încărcare: un singur apelant interoghează, ceilalți îl așteaptă
+            with self._load_lock:
+                if not self._loaded_at:
+                    self.refresh()
+            return
+        if time.monotonic() - self._loaded_at <= self._ttl:
+            return
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, name="leaderboard-refresh", daemon=True).start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"[leaderboard_cache] refresh failed, serving the previous boards: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self, university=None):
+        """(payload bytes, etag) or None for an unknown university."""
+        self._ensure_fresh()
+        with self._lock:
+            board = self._global if university is None else self._by_university.get(university)
+            if board is None:
+                return None
+            return board.payload, board.etag
+
+    def record_user(self, user_id, user):
+        """
+        Call after committing a change to a user's XP / streak / username;
+        `user` holds the values as they are now.
+        """
+        if not self._loaded_at:
+            return
+        entry = _entry(user_id, user)
+        with self._lock:
+            self._global.upsert(entry)
+            board = self._by_university.get(entry["university"])
+            if board is not None:
+                board.upsert(entry)
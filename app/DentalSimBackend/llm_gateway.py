@@ -0,0 +1,247 @@
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class LLMUnavailable(Exception):
+    pass
+
+
+class Backend:
+    """
+    One ai_server instance plus its circuit breaker:
+    closed -> (failure_threshold consecutive failures) -> open for `cooldown`
+    seconds -> half-open (a single trial request) -> closed again on success.
+    """
+
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.healthy = True
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.serves_tokenize = True   # False după un 404 pe /tokenize (ai_server mai vechi)
+
+    def state(self, now):
+        if self.open_until == 0.0:
+            return "closed"
+        return "open" if now < self.open_until else "half_open"
+
+    def available(self, now):
+        state = self.state(now)
+        if state == "closed":
+            return self.healthy
+        if state == "half_open":
+            return not self.trial_in_flight
+        return False
+
+
+class Lease:
+    """One request placed on a backend; `trial` if it is the half-open trial request."""
+
+    __slots__ = ("backend", "trial")
+
+    def __init__(self, backend, trial):
+        self.backend = backend
+        self.trial = trial
+
+
+class LLMGateway:
+    """
+    Client for a set of ai_server backends: pooled keep-alive connections,
+    background health checks on /status, least-outstanding-requests routing,
+    per-backend circuit breaking and bounded timeouts. Only transport errors
+    and 5xx answers count as backend failures; a 4xx is the caller's fault.
+    A request that cannot be placed (all backends open/unhealthy, or every one refused it) fails
+    fast with LLMUnavailable instead of holding the Flask worker.
+    """
+
+    def __init__(self, urls, connect_timeout=3.0, read_timeout=45.0,
+                 failure_threshold=3, cooldown=30.0, health_interval=10.0, pool_size=32):
+        if not urls:
+            raise ValueError("LLMGateway needs at least one backend URL")
+        self.backends = [Backend(u) for u in urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health_interval = health_interval
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.backends), pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({"Content-Type": "application/json"})
+
+        if health_interval > 0:
+            threading.Thread(target=self._health_loop, name="llm-health", daemon=True).start()
+
+    # --- routing & breaker ---
+
+    def _acquire(self, exclude):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [b for b in self.backends if b not in exclude and b.available(now)]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda b: b.outstanding)
+            trial = backend.state(now) == "half_open"
+            if trial:
+                backend.trial_in_flight = True
+            backend.outstanding += 1
+            return Lease(backend, trial)
+
+    def _release(self, lease, ok, count_failure=True):
+        """ok: the backend answered properly; not ok and not count_failure: neither (e.g. a 4xx)."""
+        backend = lease.backend
+        with self._lock:
+            backend.outstanding -= 1
+            if lease.trial:
+                # doar cererea care a luat slotul de probă îl eliberează
+                backend.trial_in_flight = False
+            if ok:
+                backend.failures = 0
+                backend.open_until = 0.0
+            elif count_failure:
+                backend.failures += 1
+                if backend.failures >= self.failure_threshold or backend.open_until:
+                    backend.open_until = time.monotonic() + self.cooldown
+                    print(f"[llm_gateway] circuit open for {backend.url} ({backend.failures} failures)")
+
+    def _send(self, payload, stream, path="/generate", exclude=()):
+        tried = list(exclude)
+        last_error = "no healthy LLM backend"
+        while True:
+            lease = self._acquire(tried)
+            if lease is None:
+                raise LLMUnavailable(last_error)
+            backend = lease.backend
+            tried.append(backend)
+
+            try:
+                response = self.session.post(f"{backend.url}{path}", json=payload,
+                                             timeout=self.timeout, stream=stream)
+            except requests.RequestException as e:
+                self._release(lease, ok=False)
+                last_error = f"{backend.url}: {e}"
+                continue
+
+            if response.status_code == 503:
+                # coada backend-ului e plina: nu e o defectiune, incercam altul
+                response.close()
+                self._release(lease, ok=True)
+                last_error = f"{backend.url}: busy"
+                continue
+            if response.status_code >= 500:
+                response.close()
+                self._release(lease, ok=False)
+                last_error = f"LLM Error: {response.status_code}"
+                continue
+
+            return lease, response
+
+    # --- public API ---
+
+    def generate(self, payload):
+        lease, response = self._send(payload, stream=False)
+        try:
+            data = response.json()
+        except ValueError as e:
+            self._release(lease, ok=False)
+            raise LLMUnavailable(f"{lease.backend.url}: invalid response ({e})")
+        # aici status < 500: un 4xx e o cerere gresita, nu un backend defect
+        self._release(lease, ok=response.status_code == 200, count_failure=False)
+        if response.status_code != 200:
+            raise LLMUnavailable(data.get("error") or f"LLM Error: {response.status_code}")
+        return data
+
+    def open_stream(self, payload):
+        lease, response = self._send({**payload, "stream": True}, stream=True)
+        if response.status_code != 200:
+            response.close()
+            self._release(lease, ok=False, count_failure=False)
+            raise LLMUnavailable(f"LLM Error: {response.status_code}")
+        return LLMStream(self, lease, response)
+
+    def tokenize(self, texts):
+        """
+        Token counts of `texts` with the served model's tokenizer. A backend
+        answering 404 (an older ai_server without /tokenize) is remembered and
+        not asked again until the health check sees it come back up after being
+        down; that is not a backend failure.
+        """
+        while True:
+            lacking = [b for b in self.backends if not b.serves_tokenize]
+            if len(lacking) == len(self.backends):
+                raise LLMUnavailable("no LLM backend serves /tokenize")
+            lease, response = self._send({"texts": texts}, stream=False, path="/tokenize", exclude=lacking)
+            if response.status_code == 404:
+                response.close()
+                self._release(lease, ok=True)
+                lease.backend.serves_tokenize = False
+                print(f"[llm_gateway] {lease.backend.url} has no /tokenize, counting tokens elsewhere")
+                continue
+            if response.status_code != 200:
+                # 4xx: cererea e greșită, nu backend-ul; corpul poate fi și HTML
+                response.close()
+                self._release(lease, ok=False, count_failure=False)
+                raise LLMUnavailable(f"LLM Error: {response.status_code}")
+            try:
+                data = response.json()
+            except ValueError as e:
+                self._release(lease, ok=False)
+                raise LLMUnavailable(f"{lease.backend.url}: invalid response ({e})")
+            self._release(lease, ok=True)
+            return data["counts"]
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "url": b.url,
+                "healthy": b.healthy,
+                "circuit": b.state(now),
+                "outstanding": b.outstanding,
+                "failures": b.failures,
+            } for b in self.backends]
+
+    # --- health checks ---
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                try:
+                    ok = self.session.get(f"{backend.url}/status", timeout=self.timeout[0]).status_code == 200
+                except requests.RequestException:
+                    ok = False
+                if ok != backend.healthy:
+                    print(f"[llm_gateway] {backend.url} is {'up' if ok else 'down'}")
+                    if ok:
+                        backend.serves_tokenize = True  # poate a repornit cu o versiune nouă
+                backend.healthy = ok
+            time.sleep(self.health_interval)
+
+
+class LLMStream:
+    """An open NDJSON stream from one backend; close() must always be called."""
+
+    def __init__(self, gateway, lease, response):
+        self._gateway = gateway
+        self._lease = lease
+        self._response = response
+        self._closed = False
+
+    def iter_lines(self):
+        # application/x-ndjson nu are charset: fără asta requests întoarce bytes
+        self._response.encoding = "utf-8"
+        return self._response.iter_lines(decode_unicode=True)
+
+    def close(self, ok=True):
+        if self._closed:
+            return
+        self._closed = True
+        self._response.close()
+        self._gateway._release(self._lease, ok)
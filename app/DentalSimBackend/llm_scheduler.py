@@ -0,0 +1,202 @@
+import itertools
+import queue
+import threading
+import time
+
+
+class QueueFull(Exception):
+    pass
+
+
+class GenerationRequest:
+    """
+    One queued /generate call. The slot that runs it pushes events
+    ({"token": ...}, then {"done": ...} or {"error": ...}) into `events`;
+    iterating the request yields them until the final one, or until no event
+    arrived for `event_timeout` seconds (None: wait as long as it takes).
+    """
+
+    _ids = itertools.count(1)
+    event_timeout = None
+
+    def __init__(self, messages, params):
+        self.id = next(self._ids)
+        self.messages = messages
+        self.params = params
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.events = queue.Queue()
+
+    @property
+    def queue_wait_ms(self):
+        start = self.started_at if self.started_at is not None else time.monotonic()
+        return (start - self.submitted_at) * 1000
+
+    def cancel(self):
+        # clientul a închis conexiunea; slotul se oprește la următorul token
+        self.cancelled = True
+
+    def __iter__(self):
+        while True:
+            try:
+                event = self.events.get(timeout=self.event_timeout)
+            except queue.Empty:
+                self.cancel()
+                yield {"error": f"no event from the model for {self.event_timeout:.0f}s",
+                       "queue_wait_ms": self.queue_wait_ms}
+                return
+            yield event
+            if "done" in event or "error" in event:
+                return
+
+    def result(self):
+        """Blocks until the request finishes; returns the final event."""
+        event = {}
+        for event in self:
+            pass
+        return event
+
+
+class GenerationScheduler:
+    """
+    Queues incoming generations and runs them on `n_slots` model contexts.
+
+    Each slot owns one llama.cpp context (the GGUF weights are mmap-ed, so
+    slots share them through the page cache) and decodes in its own thread;
+    llama.cpp releases the GIL while decoding, so slots run truly in parallel.
+    A slot picks the next queued request as soon as its current sequence
+    ends, so new requests are admitted between sequences instead of waiting
+    for the whole batch.
+
+    `prepare(llm, messages)`, if given, runs on the slot right before each
+    generation (used to restore cached prompt states); what it returns is
+    reported as the done event's "prompt_cache" outcome.
+    """
+
+    def __init__(self, model_factory, n_slots=1, max_queue=64, prepare=None):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._completed = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self.n_slots = n_slots
+        self._prepare = prepare
+
+        for slot_id in range(n_slots):
+            llm = model_factory(slot_id)
+            t = threading.Thread(target=self._slot_loop, args=(slot_id, llm),
+                                 name=f"llm-slot-{slot_id}", daemon=True)
+            t.start()
+
+    def submit(self, messages, **params):
+        req = GenerationRequest(messages, params)
+        try:
+            self._queue.put_nowait(req)
+        except queue.Full:
+            raise QueueFull(f"Too many pending generations ({self._queue.maxsize})")
+        return req
+
+    def stats(self):
+        with self._lock:
+            completed = self._completed
+            return {
+                "slots": self.n_slots,
+                "active": self._active,
+                "queue_depth": self._queue.qsize(),
+                "completed": completed,
+                "avg_queue_wait_ms": round(self._total_wait_ms / completed, 1) if completed else 0.0,
+                "max_queue_wait_ms": round(self._max_wait_ms, 1),
+            }
+
+    def _slot_loop(self, slot_id, llm):
+        while True:
+            req = self._queue.get()
+            if req.cancelled:
+                continue
+
+            req.started_at = time.monotonic()
+            wait_ms = req.queue_wait_ms
+            with self._lock:
+                self._active += 1
+
+            try:
+                self._run(llm, req)
+            finally:
+                req.finished_at = time.monotonic()
+                with self._lock:
+                    self._active -= 1
+                    self._completed += 1
+                    self._total_wait_ms += wait_ms
+                    self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+
+    def _run(self, llm, req):
+        parts = []
+        prompt_tokens = None
+        first_token_at = None
+        draft = getattr(llm, "draft_model", None)
+        draft_before = draft.snapshot() if draft is not None else None
+        cache_outcome = None
+        try:
+            if self._prepare is not None:
+                cache_outcome = self._prepare(llm, req.messages)
+            for chunk in llm.create_chat_completion(messages=req.messages, stream=True, **req.params):
+                if prompt_tokens is None:
+                    # primul chunk vine dupa prefill: contextul tine exact promptul
+                    prompt_tokens = llm.n_tokens
+                if req.cancelled:
+                    break
+                token = chunk['choices'][0].get('delta', {}).get('content')
+                if token:
+                    if first_token_at is None:
+                        first_token_at = time.monotonic()
+                    parts.append(token)
+                    req.events.put({"token": token})
+            finished_at = time.monotonic()
+            prompt_tokens = prompt_tokens or 0
+            if draft is not None:
+                # la oprire contextul poate contine inca draft-uri neverificate
+                completion_tokens = len(parts)
+            else:
+                completion_tokens = max(len(parts), llm.n_tokens - prompt_tokens)
+            done = {
+                "done": True,
+                "generated_text": "".join(parts),
+                "queue_wait_ms": round(req.queue_wait_ms, 1),
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+                "timings": generation_timings(req, first_token_at, finished_at, prompt_tokens, completion_tokens),
+            }
+            if cache_outcome is not None:
+                done["prompt_cache"] = cache_outcome
+            if draft is not None:
+                done["speculative"] = draft.report(draft_before, completion_tokens)
+            req.events.put(done)
+        except Exception as e:
+            req.events.put({"error": str(e)})
+
+
+def generation_timings(req, first_token_at, finished_at, prompt_tokens, completion_tokens):
+    """
+    Timings of one generation (ms):
+      prefill  slot start -> first token (cached prompt restore + prompt eval + first sample)
+      ttft     submit -> first token (queue wait + prefill)
+      decode   first token -> end, with decode_tokens_per_s over the tokens after the first
+    """
+    first = first_token_at if first_token_at is not None else finished_at
+    prefill_s = first - req.started_at
+    decode_s = finished_at - first
+    return {
+        "queue_wait_ms": round(req.queue_wait_ms, 1),
+        "prefill_ms": round(prefill_s * 1000, 1),
+        "prompt_tokens_per_s": round(prompt_tokens / prefill_s, 1) if prefill_s > 0 else 0.0,
+        "ttft_ms": round((first - req.submitted_at) * 1000, 1),
+        "decode_ms": round(decode_s * 1000, 1),
+        "decode_tokens_per_s": round((completion_tokens - 1) / decode_s, 1) if decode_s > 0 and completion_tokens > 1 else 0.0,
+        "total_ms": round((finished_at - req.submitted_at) * 1000, 1),
+    }
@@ -0,0 +1,85 @@
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+# image_type din URL -> subfolder în clinical_assets
+IMAGE_TYPES = {"xray": "xrays", "examine": "examine"}
+
+
+class MediaSigner:
+    """
+    Short-lived, HMAC-signed, content-addressed URLs for clinical images:
+
+        /media/<image_type>/<digest>?exp=<unix>&sig=<hmac>
+
+    `digest` is a hash of the file bytes, so it reveals nothing about the
+    diagnosis, and the media route can verify and serve the file without
+    touching the database. `exp` is rounded up to a `window`, so the URL for a
+    given image stays identical for that window and browsers / a reverse proxy
+    can cache it.
+    """
+
+    def __init__(self, secret, assets_folder, window_seconds=3600):
+        self._secret = secret.encode("utf-8") if isinstance(secret, str) else secret
+        self._assets_folder = assets_folder
+        self.window = window_seconds
+        self._lock = threading.Lock()
+        self._by_digest = None   # digest -> (subfolder, filename)
+        self._by_file = None     # (subfolder, filename) -> digest
+
+    # --- content index ---
+
+    def _build_index(self):
+        by_digest, by_file = {}, {}
+        for subfolder in IMAGE_TYPES.values():
+            folder = os.path.join(self._assets_folder, subfolder)
+            if not os.path.isdir(folder):
+                continue
+            for filename in os.listdir(folder):
+                path = os.path.join(folder, filename)
+                if not os.path.isfile(path):
+                    continue
+                with open(path, "rb") as f:
+                    digest = hashlib.sha256(f.read()).hexdigest()[:32]
+                by_digest[digest] = (subfolder, filename)
+                by_file[(subfolder, filename)] = digest
+        with self._lock:
+            self._by_digest, self._by_file = by_digest, by_file
+
+    def _index(self):
+        if self._by_digest is None:
+            self._build_index()
+        return self._by_digest, self._by_file
+
+    def lookup(self, digest):
+        """(subfolder, filename) for a digest, or None."""
+        return self._index()[0].get(digest)
+
+    # --- signing ---
+
+    def _signature(self, image_type, digest, exp):
+        msg = f"{image_type}:{digest}:{exp}".encode("utf-8")
+        return hmac.new(self._secret, msg, hashlib.sha256).hexdigest()[:32]
+
+    def sign(self, image_type, filename):
+        """Path + query for an image, or None if the file is unknown."""
+        subfolder = IMAGE_TYPES.get(image_type)
+        digest = self._index()[1].get((subfolder, filename))
+        if digest is None:
+            return None
+        # valabil cel puțin o fereastră întreagă, identic în interiorul ferestrei
+        exp = (int(time.time()) // self.window + 2) * self.window
+        return f"/media/{image_type}/{digest}?exp={exp}&sig={self._signature(image_type, digest, exp)}"
+
+    def verify(self, image_type, digest, exp, sig):
+        if image_type not in IMAGE_TYPES or not exp or not sig:
+            return False
+        try:
+            exp = int(exp)
+        except ValueError:
+            return False
+        if exp < time.time():
+            return False
+        return hmac.compare_digest(self._signature(image_type, digest, exp), sig)
@@ -0,0 +1,128 @@
+"""
+Size-bucketed variants of the clinical images (xrays / examine photos).
+
+Every original JPG gets a thumbnail, mobile and full variant, each in WebP
+and JPEG, with EXIF and other metadata stripped. They are written to
+clinical_assets/.variants/<subfolder>/ and rebuilt only when the original
+is newer. Run offline with `python media_variants.py [--force]`, or let
+app.py build them in the background at startup.
+Pillow is optional: without it the endpoint keeps serving the originals.
+"""
+import os
+import sys
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow lipsește -> servim originalele
+    Image = None
+
+# lățimea maximă per bucket (px); "full" doar recomprimă, plafonat la 2048
+SIZE_BUCKETS = [
+    ("thumb", 320),
+    ("mobile", 960),
+    ("full", 2048),
+]
+
+FORMATS = {
+    "webp": ("WEBP", "image/webp", {"quality": 80, "method": 6}),
+    "jpeg": ("JPEG", "image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+SUBFOLDERS = ("xrays", "examine")
+VARIANTS_DIRNAME = ".variants"
+
+
+def variants_dir(assets_folder, subfolder):
+    return os.path.join(assets_folder, VARIANTS_DIRNAME, subfolder)
+
+
+def variant_name(filename, bucket, fmt):
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}.{bucket}.{'jpg' if fmt == 'jpeg' else fmt}"
+
+
+def _is_stale(path, src_mtime):
+    return not os.path.exists(path) or os.path.getmtime(path) < src_mtime
+
+
+def build_variants(assets_folder, force=False):
+    """Generates missing / outdated variants. Returns how many files were written."""
+    if Image is None:
+        print("[media_variants] Pillow not installed, skipping variant generation")
+        return 0
+
+    written = 0
+    for subfolder in SUBFOLDERS:
+        src_dir = os.path.join(assets_folder, subfolder)
+        if not os.path.isdir(src_dir):
+            continue
+        out_dir = variants_dir(assets_folder, subfolder)
+        os.makedirs(out_dir, exist_ok=True)
+
+        for filename in sorted(os.listdir(src_dir)):
+            if not filename.lower().endswith((".jpg", ".jpeg", ".png")):
+                continue
+            src = os.path.join(src_dir, filename)
+            src_mtime = os.path.getmtime(src)
+
+            targets = [(bucket, width, fmt) for bucket, width in SIZE_BUCKETS for fmt in FORMATS
+                       if force or _is_stale(os.path.join(out_dir, variant_name(filename, bucket, fmt)), src_mtime)]
+            if not targets:
+                continue
+
+            with Image.open(src) as original:
+                # aplicăm orientarea din EXIF înainte să o aruncăm
+                image = ImageOps.exif_transpose(original).convert("RGB")
+
+            for bucket, width, fmt in targets:
+                resized = image.copy()
+                resized.thumbnail((width, width * 4), Image.LANCZOS)
+                pil_format, _, options = FORMATS[fmt]
+                out_path = os.path.join(out_dir, variant_name(filename, bucket, fmt))
+                tmp_path = out_path + ".tmp"
+                # fără exif=/icc_profile= -> metadatele nu sunt copiate
+                resized.save(tmp_path, pil_format, **options)
+                os.replace(tmp_path, out_path)
+                written += 1
+
+    print(f"[media_variants] {written} variant(s) written")
+    return written
+
+
+def pick_bucket(width):
+    """Smallest bucket at least `width` px wide (None -> mobile)."""
+    if not width:
+        return "mobile"
+    for bucket, bucket_width in SIZE_BUCKETS:
+        if width <= bucket_width:
+            return bucket
+    return SIZE_BUCKETS[-1][0]
+
+
+def negotiate_format(accept_mimetypes):
+    """
+    `accept_mimetypes` is Flask's request.accept_mimetypes. Only an explicit
+    image/webp counts: wildcards like image/* are also sent by clients that
+    cannot decode WebP.
+    """
+    if "image/webp" in accept_mimetypes.values():
+        return "webp"
+    return "jpeg"
+
+
+def resolve_variant(assets_folder, subfolder, filename, width, accept_mimetypes):
+    """
+    (directory, file name, mimetype) of the best built variant,
+    or None if variants are not available for this image.
+    """
+    fmt = negotiate_format(accept_mimetypes)
+    name = variant_name(filename, pick_bucket(width), fmt)
+    directory = variants_dir(assets_folder, subfolder)
+    if not os.path.isfile(os.path.join(directory, name)):
+        return None
+    return directory, name, FORMATS[fmt][1]
+
+
+if __name__ == "__main__":
+    folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "clinical_assets")
+    build_variants(folder, force="--force" in sys.argv)
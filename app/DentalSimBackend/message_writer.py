@@ -0,0 +1,142 @@
+import datetime as dt
+import threading
+import time
+from collections import deque
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+
+    enqueue() only allocates a document id (no RPC) and returns; a background
+    thread group-commits pending messages in Firestore batches of up to
+    `max_batch` writes, or whatever accumulated after `flush_interval` seconds.
+    Messages are committed in enqueue order and each one gets a strictly
+    increasing client timestamp, so the `timestamp` ordering used by
+    get_last_messages matches the order of the conversation even when the
+    student and patient messages land in the same batch.
+    """
+
+    def __init__(self, db, collection="chat_message", max_batch=400, flush_interval=0.25, max_retries=3):
+        self._db = db
+        self._collection = collection
+        self.max_batch = min(max_batch, 500)  # limita Firestore per batch
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._pending = deque()       # (ref, data)
+        self._in_flight = []          # batch being committed right now
+        self._last_ts = dt.datetime.now(dt.UTC)
+        self._stopped = False
+        self._flush_requested = False
+
+        self.committed = 0
+        self.batches = 0
+        self.dropped = 0
+        self.last_commit_ms = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="message-writer", daemon=True)
+        self._thread.start()
+
+    def _next_timestamp(self):
+        now = dt.datetime.now(dt.UTC)
+        if now <= self._last_ts:
+            now = self._last_ts + dt.timedelta(microseconds=1)
+        self._last_ts = now
+        return now
+
+    def enqueue(self, session_id, sender, content):
+        ref = self._db.collection(self._collection).document()
+        with self._cond:
+            data = {
+                "session_id": session_id,
+                "sender": sender,
+                "content": content,
+                "timestamp": self._next_timestamp()
+            }
+            self._pending.append((ref, data))
+            self._cond.notify_all()
+        return ref
+
+    def pending_for(self, session_id):
+        """Messages of a session not yet visible in Firestore: [(doc_id, data)]."""
+        with self._cond:
+            return [(ref.id, data) for ref, data in list(self._in_flight) + list(self._pending)
+                    if data["session_id"] == session_id]
+
+    @property
+    def backlog(self):
+        with self._cond:
+            return len(self._pending) + len(self._in_flight)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopped:
+                    self._cond.wait()
+                if not self._pending:
+                    return  # oprit si golit
+
+                # lasam mesajele sa se adune (group commit) pana la batch plin sau flush_interval
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._pending) < self.max_batch and not self._stopped and not self._flush_requested:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                self._flush_requested = False
+
+                n = min(len(self._pending), self.max_batch)
+                self._in_flight = [self._pending.popleft() for _ in range(n)]
+
+            self._commit(self._in_flight)
+
+            with self._cond:
+                self._in_flight = []
+                self._cond.notify_all()
+
+    def _commit(self, items):
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                started = time.monotonic()
+                batch = self._db.batch()
+                for ref, data in items:
+                    batch.set(ref, data)
+                batch.commit()
+                self.last_commit_ms = (time.monotonic() - started) * 1000
+                self.committed += len(items)
+                self.batches += 1
+                return
+            except Exception as e:
+                print(f"[message_writer] commit of {len(items)} message(s) failed (attempt {attempt}): {e}")
+                time.sleep(0.2 * attempt)
+        self.dropped += len(items)
+
+    def flush(self, timeout=10.0):
+        """Blocks until everything enqueued so far is committed (or timeout)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._pending or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def stop(self, timeout=10.0):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "backlog": self.backlog,
+            "committed": self.committed,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "last_commit_ms": round(self.last_commit_ms, 1),
+        }
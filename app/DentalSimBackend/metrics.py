@@ -0,0 +1,250 @@
+"""
+Per-request instrumentation exposed in Prometheus text format.
+
+RequestMetrics hooks into Flask (before/after_request) and records, per
+route template:
+  - request latency histogram and request counts by status
+  - database reads / writes / queries / commits (from db_metrics.OpCounter)
+  - time spent waiting on the LLM (llm_call() around the gateway calls)
+
+For streamed responses the latency is time to the first byte: after_request
+runs before the body is sent. Requests slower than `slow_ms` are logged
+with their op breakdown.
+
+InferenceMetrics does the same for ai_server.py, from the usage / timings
+(and, with speculative decoding, speculative) block and the prompt cache
+outcome of each finished generation.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DB_OPS = ("reads", "writes", "queries", "commits")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+def _render_gauges(gauges):
+    lines = []
+    for name, help_text, fn in gauges:
+        try:
+            value = fn()
+        except Exception as e:
+            print(f"[metrics] gauge {name} failed: {e}")
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    return lines
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                names = self.labelnames + ("le",)
+                for bound, count in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (bound,))} {count}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+class RequestMetrics:
+    def __init__(self, op_counter, slow_ms=0, prefix="dentalsim"):
+        self.op_counter = op_counter
+        self.slow_ms = slow_ms
+        self.request_duration = Histogram(
+            f"{prefix}_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+        self.requests = Counter(
+            f"{prefix}_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+        self.db_ops = Counter(
+            f"{prefix}_db_operations_total", "Database operations by route and kind.", ("route", "op"))
+        self.db_ops_per_request = Histogram(
+            f"{prefix}_db_operations_per_request", "Reads + writes + queries per request.", ("route",),
+            buckets=(0, 1, 2, 5, 10, 20, 50, 100, 250, 500))
+        self.llm_duration = Histogram(
+            f"{prefix}_llm_call_duration_seconds", "Time spent waiting on the LLM backend.", ("kind",))
+        self._gauges = []   # (name, help, fn)
+
+    def add_gauge(self, name, help_text, fn):
+        self._gauges.append((name, help_text, fn))
+
+    def init_app(self, app):
+        app.before_request(self._before)
+        app.after_request(self._after)
+
+    # --- hooks ---
+
+    def _before(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_llm_seconds = 0.0
+        self.op_counter.begin()
+
+    def _after(self, response):
+        started = g.pop("metrics_started", None)
+        if started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        ops = self.op_counter.end()
+        route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+
+        self.request_duration.observe((request.method, route), elapsed)
+        self.requests.inc((request.method, route, str(response.status_code)))
+        for op in DB_OPS:
+            if ops.get(op):
+                self.db_ops.inc((route, op), ops[op])
+        self.db_ops_per_request.observe((route,), ops.get("reads", 0) + ops.get("writes", 0) + ops.get("queries", 0))
+
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+            llm_ms = g.get("metrics_llm_seconds", 0.0) * 1000
+            breakdown = " ".join(f"{op}={ops.get(op, 0)}" for op in DB_OPS)
+            print(f"[slow] {request.method} {route} {response.status_code} {elapsed * 1000:.0f}ms "
+                  f"llm={llm_ms:.0f}ms {breakdown}")
+        return response
+
+    @contextmanager
+    def llm_call(self, kind):
+        """Times a call to the LLM gateway (also added to the request's slow log line)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.llm_duration.observe((kind,), elapsed)
+            if has_request_context() and "metrics_llm_seconds" in g:
+                g.metrics_llm_seconds += elapsed
+
+    # --- exposition ---
+
+    def render(self):
+        lines = []
+        for metric in (self.request_duration, self.requests, self.db_ops,
+                       self.db_ops_per_request, self.llm_duration):
+            lines.extend(metric.render())
+
+        background = self.op_counter.background_totals()
+        name = self.db_ops.name.replace("_total", "_background_total")
+        lines += [f"# HELP {name} Database operations made outside a request (e.g. message writer).",
+                  f"# TYPE {name} counter"]
+        lines += [f'{name}{{op="{op}"}} {background.get(op, 0)}' for op in DB_OPS]
+
+        lines.extend(_render_gauges(self._gauges))
+        return "\n".join(lines) + "\n"
+
+
+class InferenceMetrics:
+    """
+    Aggregates the `usage` / `timings` block of finished generations
+    (ai_server.py): queue wait, prefill, TTFT, decode speed and token counts.
+    """
+
+    def __init__(self, prefix="dentalsim_llm"):
+        self.generations = Counter(f"{prefix}_generations_total", "Finished generations by outcome.", ("outcome",))
+        self.prompt_tokens_total = Counter(f"{prefix}_prompt_tokens_total", "Prompt tokens processed.")
+        self.completion_tokens_total = Counter(f"{prefix}_completion_tokens_total", "Tokens generated.")
+        self.queue_wait = Histogram(f"{prefix}_queue_wait_seconds", "Time spent queued before a slot picked the request.")
+        self.prefill = Histogram(f"{prefix}_prefill_seconds", "Slot start to first token (prompt evaluation).")
+        self.ttft = Histogram(f"{prefix}_time_to_first_token_seconds", "Submit to first token.")
+        self.decode_speed = Histogram(f"{prefix}_decode_tokens_per_second", "Decode speed after the first token.",
+                                      buckets=(1, 2, 5, 10, 15, 20, 30, 50, 75, 100, 200))
+        self.prompt_tokens = Histogram(f"{prefix}_prompt_tokens", "Prompt length per generation.",
+                                       buckets=(64, 128, 256, 512, 1024, 1536, 2048, 3072, 4096, 8192))
+        self.completion_tokens = Histogram(f"{prefix}_completion_tokens", "Completion length per generation.",
+                                           buckets=(8, 16, 32, 64, 128, 256, 512))
+        self.draft_tokens = Counter(f"{prefix}_draft_tokens_total",
+                                    "Speculative draft tokens by outcome (proposed / accepted).", ("outcome",))
+        self.acceptance_rate = Histogram(f"{prefix}_draft_acceptance_rate", "Accepted / proposed draft tokens per generation.",
+                                         buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0))
+        self.tokens_per_step = Histogram(f"{prefix}_tokens_per_decode_step", "Tokens produced per target-model decode step.",
+                                         buckets=(1, 1.5, 2, 3, 4, 6, 8, 12))
+        self.prompt_cache = Counter(f"{prefix}_prompt_cache_lookups_total",
+                                    "System-prompt state cache lookups by outcome (hit / miss / skipped).", ("outcome",))
+        self._gauges = []
+
+    def add_gauge(self, name, help_text, fn):
+        self._gauges.append((name, help_text, fn))
+
+    def observe(self, event):
+        """Call with the final event of a generation ({"done": ...} or {"error": ...})."""
+        if "error" in event:
+            self.generations.inc(("error",))
+            return
+        self.generations.inc(("ok",))
+        if event.get("prompt_cache"):
+            self.prompt_cache.inc((event["prompt_cache"],))
+        usage = event.get("usage") or {}
+        timings = event.get("timings") or {}
+        self.prompt_tokens_total.inc((), usage.get("prompt_tokens", 0))
+        self.completion_tokens_total.inc((), usage.get("completion_tokens", 0))
+        self.prompt_tokens.observe((), usage.get("prompt_tokens", 0))
+        self.completion_tokens.observe((), usage.get("completion_tokens", 0))
+        self.queue_wait.observe((), timings.get("queue_wait_ms", 0.0) / 1000)
+        self.prefill.observe((), timings.get("prefill_ms", 0.0) / 1000)
+        self.ttft.observe((), timings.get("ttft_ms", 0.0) / 1000)
+        if timings.get("decode_tokens_per_s"):
+            self.decode_speed.observe((), timings["decode_tokens_per_s"])
+        speculative = event.get("speculative")
+        if speculative:
+            self.draft_tokens.inc(("proposed",), speculative["proposed_tokens"])
+            self.draft_tokens.inc(("accepted",), speculative["accepted_tokens"])
+            if speculative["proposed_tokens"]:
+                self.acceptance_rate.observe((), speculative["acceptance_rate"])
+            self.tokens_per_step.observe((), speculative["tokens_per_step"])
+
+    def render(self):
+        lines = []
+        for metric in (self.generations, self.prompt_tokens_total, self.completion_tokens_total,
+                       self.queue_wait, self.prefill, self.ttft, self.decode_speed,
+                       self.prompt_tokens, self.completion_tokens,
+                       self.draft_tokens, self.acceptance_rate, self.tokens_per_step, self.prompt_cache):
+            lines.extend(metric.render())
+        lines.extend(_render_gauges(self._gauges))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,37 @@
+from llama_cpp import Llama, LlamaRAMCache
+
+from speculative import check_draft_vocab, make_draft
+
+
+def load_model(config):
+    """
+    Builds one llama.cpp context from a plain config dict (picklable, so the
+    same function is used by in-process slots and by pool workers).
+    The GGUF is mmap-ed read-only: every context opened on the same file
+    shares the weights through the OS page cache.
+    """
+    # AI_SPECULATIVE: prompt lookup sau un model draft mic, verificat pe batch de model;
+    # dat in constructor, altfel llama-cpp-python nu activeaza logits_all
+    draft = make_draft(config)
+    llm = Llama(
+        model_path=config["model_path"],
+        n_ctx=config.get("n_ctx", 4096),
+        n_threads=config.get("n_threads", 4),
+        use_mmap=True,
+        use_mlock=False,
+        draft_model=draft,
+        verbose=False
+    )
+    if draft is not None:
+        check_draft_vocab(llm, draft)
+    session_cache_mb = config.get("session_cache_mb", 0)
+    if session_cache_mb > 0:
+        # llama.cpp salveaza starea dupa fiecare raspuns (prompt + completare);
+        # tura urmatoare a aceleiasi sesiuni reia de acolo.
+        llm.set_cache(LlamaRAMCache(capacity_bytes=session_cache_mb << 20))
+    return llm
+
+
+def load_tokenizer(config):
+    """Vocabulary-only instance of the same GGUF: tokenizes without a context or KV cache."""
+    return Llama(model_path=config["model_path"], vocab_only=True, verbose=False)
@@ -0,0 +1,76 @@
+import base64
+import json
+
+from flask import request, jsonify
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Cursorul urmatoarei pagini se trimite in header, ca body-ul sa ramana
+# aceeasi lista JSON pe care o asteapta deja frontend-ul.
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+class BadCursor(ValueError):
+    pass
+
+
+def encode_cursor(data: dict) -> str:
+    raw = json.dumps(data, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, int_fields=()) -> dict:
+    """
+    Decodes a cursor and checks its shape: a non-empty string "id", plus an
+    integer for every name in `int_fields`. Raises BadCursor otherwise.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeDecodeError) as e:
+        raise BadCursor(f"Invalid cursor: {e}")
+    if not isinstance(data, dict):
+        raise BadCursor("Invalid cursor")
+    if not isinstance(data.get("id"), str) or not data["id"]:
+        raise BadCursor("Invalid cursor: missing id")
+    for field in int_fields:
+        # bool e subclasa de int in Python, dar nu e un cursor valid
+        if not isinstance(data.get(field), int) or isinstance(data[field], bool):
+            raise BadCursor(f"Invalid cursor: {field} must be an integer")
+    return data
+
+
+def page_params(int_fields=()):
+    """
+    Reads ?limit=&cursor= from the request.
+    Returns (limit, cursor dict or None); raises BadCursor on a bad token.
+    `int_fields`: integer keys the endpoint's cursors must carry besides "id".
+    """
+    limit = request.args.get("limit", DEFAULT_PAGE_SIZE, type=int)
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    token = request.args.get("cursor")
+    return limit, (decode_cursor(token, int_fields) if token else None)
+
+
+def fetch_page(query, limit, cursor):
+    """
+    One page of `query` in document-id order, resumed after the id stored in
+    the cursor (Firestore start_after, no offset scan).
+    Returns (docs, next cursor dict or None).
+    """
+    query = query.order_by("__name__")
+    if cursor:
+        query = query.start_after({"__name__": cursor["id"]})
+    docs = list(query.limit(limit + 1).stream())
+    if len(docs) > limit:
+        return docs[:limit], {"id": docs[limit - 1].id}
+    return docs, None
+
+
+def paged_response(items, next_cursor, status=200):
+    response = jsonify(items)
+    response.status_code = status
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(next_cursor)
+    return response
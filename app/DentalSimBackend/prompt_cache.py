@@ -0,0 +1,142 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class PromptStateCache:
+    """
+    LRU of llama.cpp states captured right after a disease's system prompt
+    was evaluated, keyed by the hash of that prompt.
+
+    Before a generation, prepare() makes sure the context already holds the
+    system prompt: either it is still resident from the previous request, or
+    its snapshot is restored, or it is evaluated once and snapshotted.
+    llama.cpp then reuses the longest matching token prefix, so only the
+    conversation suffix is prefilled. States come from the same GGUF and
+    n_ctx, so one cache is shared by all slots.
+
+    A state holds the KV blob plus llama.cpp's logits buffer (up to
+    n_batch x n_vocab float32, ~260 MB with a 128k vocabulary), so the cache
+    is bounded by bytes (`capacity_mb`) as well as by entry count. A prompt
+    whose state alone exceeds `capacity_mb` is remembered as oversized and
+    left to llama.cpp's own prefix reuse from then on ("skipped").
+    """
+
+    def __init__(self, capacity=16, capacity_mb=1024):
+        self.capacity = capacity
+        self.capacity_bytes = capacity_mb << 20
+        self._lock = threading.Lock()
+        self._states = OrderedDict()   # key -> LlamaState
+        self._prefixes = {}            # key -> list[int] (system prompt tokens)
+        self._oversized = set()         # chei ale caror stari nu incap in buget
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    @staticmethod
+    def state_bytes(state):
+        return state.llama_state_size + state.scores.nbytes + state.input_ids.nbytes
+
+    @staticmethod
+    def _key(system_prompt: str) -> str:
+        return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+
+    def _get_state(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            return state
+
+    def _put_state(self, key, state):
+        """Stores `state`; False if it is larger than the whole budget."""
+        size = self.state_bytes(state)
+        if size > self.capacity_bytes:
+            with self._lock:
+                self._oversized.add(key)
+            print(f"[prompt_cache] state of {size >> 20} MB exceeds the {self.capacity_bytes >> 20} MB budget, "
+                  f"this prompt is no longer snapshotted")
+            return False
+        with self._lock:
+            old = self._states.pop(key, None)
+            if old is not None:
+                self._bytes -= self.state_bytes(old)
+            self._states[key] = state
+            self._bytes += size
+            while len(self._states) > self.capacity or self._bytes > self.capacity_bytes:
+                old_key, old_state = self._states.popitem(last=False)
+                self._bytes -= self.state_bytes(old_state)
+                self._prefixes.pop(old_key, None)
+        return True
+
+    def _prefix_tokens(self, llm, key, system_message):
+        with self._lock:
+            tokens = self._prefixes.get(key)
+        if tokens is not None:
+            return tokens
+
+        from llama_cpp.llama_chat_format import Jinja2ChatFormatter
+
+        # Randam doar mesajul de sistem cu template-ul modelului, fara
+        # promptul de generare, ca sa obtinem exact prefixul conversatiei.
+        eos_id, bos_id = llm.token_eos(), llm.token_bos()
+        formatter = Jinja2ChatFormatter(
+            template=llm.metadata["tokenizer.chat_template"],
+            eos_token=llm._model.token_get_text(eos_id) if eos_id != -1 else "",
+            bos_token=llm._model.token_get_text(bos_id) if bos_id != -1 else "",
+            add_generation_prompt=False,
+        )
+        prompt = formatter(messages=[system_message]).prompt
+        tokens = llm.tokenize(prompt.encode("utf-8"), add_bos=False, special=True)
+
+        with self._lock:
+            self._prefixes[key] = tokens
+        return tokens
+
+    def _count(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def prepare(self, llm, messages):
+        """Returns "hit", "miss" or "skipped" (state too large to cache), or None if not applicable."""
+        if not messages or messages[0].get("role") != "system":
+            return None
+        try:
+            key = self._key(messages[0]["content"])
+            prefix = self._prefix_tokens(llm, key, messages[0])
+        except Exception as e:
+            # model fara chat template in metadata etc. -> fara cache
+            print(f"[prompt_cache] disabled for this request: {e}")
+            return None
+
+        # still resident from the previous request on this slot
+        if llm.n_tokens >= len(prefix) and list(llm._input_ids[:len(prefix)]) == prefix:
+            self._count("hits")
+            return "hit"
+
+        state = self._get_state(key)
+        if state is not None:
+            llm.load_state(state)
+            self._count("hits")
+            return "hit"
+
+        with self._lock:
+            oversized = key in self._oversized
+        if oversized:
+            self._count("skipped")
+            return "skipped"
+
+        llm.reset()
+        llm.eval(prefix)
+        if self._put_state(key, llm.save_state()):
+            self._count("misses")
+            return "miss"
+        self._count("skipped")
+        return "skipped"
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._states), "capacity": self.capacity,
+                    "used_mb": round(self._bytes / (1 << 20), 1), "capacity_mb": self.capacity_bytes >> 20,
+                    "hits": self.hits, "misses": self.misses, "skipped": self.skipped}
@@ -0,0 +1,69 @@
+import threading
+import time
+
+from firebase_admin import firestore
+
+
+class RankService:
+    """
+    Global XP rank without scanning the `user` collection.
+
+    rank(xp) is answered by a Firestore aggregation count over the xp index
+    (billed as one read per 1000 index entries, nothing is downloaded).
+    The total number of users only moves on registration, so it is cached
+    for `total_ttl_seconds` and percentile() costs one count query.
+    """
+
+    def __init__(self, db, collection="user", total_ttl_seconds=60):
+        self._db = db
+        self._collection = collection
+        self._total_ttl = total_ttl_seconds
+        self._lock = threading.Lock()
+        self._total = None
+        self._total_at = 0.0
+
+    def _count(self, query):
+        result = query.count(alias="n").get()
+        return int(result[0][0].value)
+
+    def rank(self, xp: int) -> int:
+        higher = self._db.collection(self._collection).where("xp", ">", xp)
+        return self._count(higher) + 1
+
+    def total_users(self) -> int:
+        with self._lock:
+            if self._total is not None and time.monotonic() - self._total_at < self._total_ttl:
+                return self._total
+        total = self._count(self._db.collection(self._collection))
+        with self._lock:
+            self._total = total
+            self._total_at = time.monotonic()
+        return total
+
+    def percentile(self, rank: int) -> int:
+        """
+        Share of users (0-100) ranked below this one; 100 = top of the board.
+        """
+        total = self.total_users()
+        if total <= 1:
+            return 100
+        return max(0, min(100, int((total - rank) * 100 / (total - 1))))
+
+    def nearby(self, user_id: str, xp: int, window: int = 5):
+        """
+        Users right above and right below `user_id` on the global board.
+        Costs at most 2 * window + 1 document reads.
+        """
+        users = self._db.collection(self._collection)
+
+        above = users.where("xp", ">", xp) \
+            .order_by("xp", direction=firestore.Query.ASCENDING) \
+            .limit(window).get()
+
+        # +1: the user itself (and ties) live on this side
+        below = users.where("xp", "<=", xp) \
+            .order_by("xp", direction=firestore.Query.DESCENDING) \
+            .limit(window + 1).get()
+        below = [d for d in below if d.id != user_id][:window]
+
+        return list(reversed(above)), below
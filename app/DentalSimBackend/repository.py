@@ -0,0 +1,453 @@
+"""
+Storage backends for the app.
+
+Every helper and route talks to the database through the Firestore client
+API (collection / document / where / order_by / batch ...). This module
+returns an object with that API for the backend chosen by DB_BACKEND:
+
+    firestore  the real Firestore client (default)
+    sqlite     SQLiteRepository: the same API on an embedded SQLite file
+               (SQLITE_PATH, default instance/dentalsim_store.db),
+               WAL mode, one table per collection and expression indexes on
+               the queried fields, so single-campus deployments get local
+               reads and offline tests run without a Firebase project.
+
+Only the subset of the API used by the app is implemented by SQLiteRepository;
+snapshot listeners (on_snapshot) are not, so app.py only starts them on Firestore.
+"""
+import datetime as dt
+import json
+import os
+import random
+import sqlite3
+import string
+import threading
+from collections import namedtuple
+
+from firebase_admin import firestore
+
+# (colecție, câmpuri) interogate de aplicație -> un index pe expresiile json_extract
+# (echivalentul firestore.indexes.json pentru backend-ul SQLite)
+INDEXES = {
+    "user": [("username",), ("email",), ("xp",), ("university", "xp")],
+    "classroom": [("join_code",)],
+    "class_membership": [("user_id", "classroom_id"), ("classroom_id", "role_in_class")],
+    "chat_session": [("user_id", "is_completed")],
+    "chat_message": [("session_id", "timestamp")],
+    "user_badge": [("user_id",)],
+    "assignment": [("classroom_id",)],
+    "assignment_progress": [("assignment_id", "user_id")],
+}
+
+_DT_PREFIX = "__datetime__:"
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+AggregationResult = namedtuple("AggregationResult", ["alias", "value"])
+
+
+def open_repository(backend=None, sqlite_path=None):
+    """Database object for DB_BACKEND (firestore | sqlite)."""
+    backend = (backend or os.getenv("DB_BACKEND", "firestore")).lower()
+    if backend == "firestore":
+        return firestore.client()
+    if backend == "sqlite":
+        path = sqlite_path or os.getenv("SQLITE_PATH") or os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "instance", "dentalsim_store.db")
+        return SQLiteRepository(path)
+    raise ValueError(f"Unknown DB_BACKEND: {backend}")
+
+
+# --- value encoding (datetimes survive the JSON round-trip and sort as text) ---
+
+def _encode(value):
+    if isinstance(value, dt.datetime):
+        aware = value if value.tzinfo else value.replace(tzinfo=dt.UTC)
+        return _DT_PREFIX + aware.astimezone(dt.UTC).strftime("%Y-%m-%dT%H:%M:%S.%f")
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, str) and value.startswith(_DT_PREFIX):
+        return dt.datetime.strptime(value[len(_DT_PREFIX):], "%Y-%m-%dT%H:%M:%S.%f").replace(tzinfo=dt.UTC)
+    if isinstance(value, dict):
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def _json_path(field):
+    return "$" + "".join(f'."{part}"' for part in field.split("."))
+
+
+def _field_sql(field):
+    if field == "__name__":
+        return "id"
+    return f"json_extract(data, '{_json_path(field)}')"
+
+
+def _table(collection):
+    if not collection.replace("_", "").isalnum():
+        raise ValueError(f"Invalid collection name: {collection}")
+    return f"doc_{collection}"
+
+
+def _get_field(data, field):
+    for part in field.split("."):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+def _apply_update(data, updates, now):
+    """Firestore update semantics: dotted paths, transforms and DELETE_FIELD."""
+    for path, value in updates.items():
+        parts = path.split(".")
+        target = data
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        key = parts[-1]
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif value is firestore.SERVER_TIMESTAMP:
+            target[key] = now
+        elif isinstance(value, firestore.Increment):
+            current = target.get(key)
+            target[key] = (current if isinstance(current, (int, float)) else 0) + value.value
+        else:
+            target[key] = _resolve(value, now)
+    return data
+
+
+def _resolve(value, now):
+    """Replaces SERVER_TIMESTAMP sentinels in a value passed to set()."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return now
+    if isinstance(value, firestore.Increment):
+        return value.value
+    if isinstance(value, dict):
+        return {k: _resolve(v, now) for k, v in value.items() if v is not firestore.DELETE_FIELD}
+    return value
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self._data = data
+
+    @property
+    def id(self):
+        return self.reference.id
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return None if self._data is None else _decode(self._data)
+
+    def get(self, field):
+        return _get_field(self.to_dict() or {}, field)
+
+
+class DocumentReference:
+    def __init__(self, repo, collection, doc_id):
+        self._repo = repo
+        self._collection = collection
+        self.id = doc_id
+
+    @property
+    def path(self):
+        return f"{self._collection}/{self.id}"
+
+    def get(self, field_paths=None):
+        return self._repo._get(self, field_paths)
+
+    def set(self, data):
+        batch = self._repo.batch()
+        batch.set(self, data)
+        batch.commit()
+
+    def update(self, data):
+        batch = self._repo.batch()
+        batch.update(self, data)
+        batch.commit()
+
+    def delete(self):
+        batch = self._repo.batch()
+        batch.delete(self)
+        batch.commit()
+
+
+class Query:
+    _OPS = {"==": "=", "!=": "!=", "<": "<", "<=": "<=", ">": ">", ">=": ">="}
+
+    def __init__(self, repo, collection, filters=(), orders=(), limit=None, cursor=None, projection=None):
+        self._repo = repo
+        self._collection = collection
+        self._filters = list(filters)
+        self._orders = list(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._projection = projection
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     cursor=self._cursor, projection=self._projection)
+        state.update(changes)
+        return Query(self._repo, self._collection, **state)
+
+    def where(self, field, op, value):
+        if op not in self._OPS and op != "in":
+            raise ValueError(f"Operator not supported by the SQLite backend: {op}")
+        return self._copy(filters=self._filters + [(field, op, value)])
+
+    def order_by(self, field, direction=firestore.Query.ASCENDING):
+        return self._copy(orders=self._orders + [(field, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, values):
+        if isinstance(values, DocumentSnapshot):
+            snapshot = values
+            values = {f: (snapshot.id if f == "__name__" else snapshot.get(f)) for f, _ in self._orders}
+        return self._copy(cursor=dict(values))
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def count(self, alias=None):
+        return _CountQuery(self, alias or "count")
+
+    def _where_sql(self):
+        clauses, params = [], []
+        for field, op, value in self._filters:
+            column = _field_sql(field)
+            if op == "in":
+                clauses.append(f"{column} IN ({', '.join('?' for _ in value)})")
+                params.extend(_encode(v) for v in value)
+            elif value is None and op in ("==", "!="):
+                clauses.append(f"{column} IS {'NOT ' if op == '!=' else ''}NULL")
+            else:
+                clauses.append(f"{column} {self._OPS[op]} ?")
+                params.append(_encode(value))
+
+        if self._cursor is not None:
+            # keyset: (a, b, id) după valorile din cursor, în direcția fiecărei coloane
+            keys = self._order_keys()
+            disjuncts = []
+            for i, (field, direction) in enumerate(keys):
+                if field not in self._cursor:
+                    break
+                terms = [f"{_field_sql(f)} = ?" for f, _ in keys[:i]]
+                cmp = "<" if direction == firestore.Query.DESCENDING else ">"
+                terms.append(f"{_field_sql(field)} {cmp} ?")
+                disjuncts.append("(" + " AND ".join(terms) + ")")
+                params.extend(_encode(self._cursor[f]) for f, _ in keys[:i + 1])
+            if disjuncts:
+                clauses.append("(" + " OR ".join(disjuncts) + ")")
+
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _order_keys(self):
+        keys = list(self._orders)
+        if not any(f == "__name__" for f, _ in keys):
+            # ca în Firestore: egalitățile se departajează după id
+            last = keys[-1][1] if keys else firestore.Query.ASCENDING
+            keys.append(("__name__", last))
+        return keys
+
+    def _sql(self):
+        where, params = self._where_sql()
+        order = ", ".join(f"{_field_sql(f)} {'DESC' if d == firestore.Query.DESCENDING else 'ASC'}"
+                          for f, d in self._order_keys())
+        sql = f'SELECT id, data FROM "{_table(self._collection)}"{where} ORDER BY {order}'
+        if self._limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(self._limit))
+        return sql, params
+
+    def stream(self):
+        sql, params = self._sql()
+        rows = self._repo._read(self._collection, sql, params)
+        for doc_id, raw in rows:
+            data = json.loads(raw)
+            if self._projection is not None:
+                data = {f: _get_field(data, f) for f in self._projection if _get_field(data, f) is not None}
+            yield DocumentSnapshot(DocumentReference(self._repo, self._collection, doc_id), data)
+
+    def get(self):
+        return list(self.stream())
+
+
+class _CountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias
+
+    def get(self):
+        where, params = self._query._where_sql()
+        sql = f'SELECT COUNT(*) FROM "{_table(self._query._collection)}"{where}'
+        (value,), = self._query._repo._read(self._query._collection, sql, params)
+        return [[AggregationResult(self._alias, value)]]
+
+
+class CollectionReference(Query):
+    def __init__(self, repo, collection):
+        super().__init__(repo, collection)
+
+    @property
+    def id(self):
+        return self._collection
+
+    def document(self, doc_id=None):
+        if doc_id is None:
+            doc_id = "".join(random.choice(_ID_ALPHABET) for _ in range(20))
+        return DocumentReference(self._repo, self._collection, doc_id)
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return dt.datetime.now(dt.UTC), ref
+
+
+class WriteBatch:
+    """Applied in one SQLite transaction on commit()."""
+
+    def __init__(self, repo):
+        self._repo = repo
+        self._ops = []
+
+    def set(self, ref, data):
+        self._ops.append(("set", ref, data))
+
+    def update(self, ref, data):
+        self._ops.append(("update", ref, data))
+
+    def delete(self, ref):
+        self._ops.append(("delete", ref, None))
+
+    def commit(self):
+        self._repo._commit(self._ops)
+        self._ops = []
+
+
+class SQLiteRepository:
+    """
+    Firestore-shaped document store on SQLite.
+
+    Each collection is a table (id TEXT PRIMARY KEY, data JSON); the fields
+    listed in INDEXES get expression indexes that match the SQL generated by
+    Query, so equality + order_by lookups are index scans. Connections are
+    per thread (WAL lets readers run next to the writer); writes are
+    serialized by a lock and each batch is one IMMEDIATE transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._uri = False
+        self._keepalive = None
+        if path == ":memory:":
+            # o bază în memorie partajată de toate thread-urile (teste / benchmark)
+            self.path = f"file:repo{id(self)}?mode=memory&cache=shared"
+            self._uri = True
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._tables = set()
+        self._tables_lock = threading.Lock()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None,
+                                   uri=self._uri, check_same_thread=False)
+            if self._keepalive is None:
+                self._keepalive = conn
+            if self._uri:
+                # shared cache blochează la nivel de tabel (fără busy_timeout): cititorii nu
+                # iau lock-uri, iar scriitorii sunt oricum serializați de _write_lock
+                conn.execute("PRAGMA read_uncommitted=1")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=10000")
+            self._local.conn = conn
+        return conn
+
+    def _ensure_table(self, collection):
+        if collection in self._tables:
+            return
+        with self._tables_lock, self._write_lock:
+            if collection in self._tables:
+                return
+            table = _table(collection)
+            conn = self._conn()
+            conn.execute(f'CREATE TABLE IF NOT EXISTS "{table}" (id TEXT PRIMARY KEY, data TEXT NOT NULL)')
+            for fields in INDEXES.get(collection, []):
+                name = f"ix_{table}_" + "_".join(fields)
+                columns = ", ".join(_field_sql(f) for f in fields)
+                conn.execute(f'CREATE INDEX IF NOT EXISTS "{name}" ON "{table}" ({columns})')
+            self._tables.add(collection)
+
+    def _read(self, collection, sql, params):
+        self._ensure_table(collection)
+        return self._conn().execute(sql, params).fetchall()
+
+    def _load(self, conn, ref):
+        self._ensure_table(ref._collection)
+        row = conn.execute(f'SELECT data FROM "{_table(ref._collection)}" WHERE id = ?', (ref.id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def _get(self, ref, field_paths=None):
+        data = self._load(self._conn(), ref)
+        if data is not None and field_paths is not None:
+            data = {f: _get_field(data, f) for f in field_paths if _get_field(data, f) is not None}
+        return DocumentSnapshot(ref, data)
+
+    def _commit(self, ops):
+        for _, ref, _ in ops:
+            self._ensure_table(ref._collection)
+        now = dt.datetime.now(dt.UTC)
+        conn = self._conn()
+        with self._write_lock:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for kind, ref, data in ops:
+                    table = _table(ref._collection)
+                    if kind == "delete":
+                        conn.execute(f'DELETE FROM "{table}" WHERE id = ?', (ref.id,))
+                        continue
+                    if kind == "set":
+                        doc = _resolve(data, now)
+                    else:
+                        current = self._load(conn, ref)
+                        if current is None:
+                            raise KeyError(f"No document to update: {ref.path}")
+                        doc = _apply_update(_decode(current), data, now)
+                    conn.execute(f'INSERT OR REPLACE INTO "{table}" (id, data) VALUES (?, ?)',
+                                 (ref.id, json.dumps(_encode(doc))))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    # --- Firestore client API ---
+
+    def collection(self, name):
+        return CollectionReference(self, name)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def get_all(self, references, field_paths=None):
+        for ref in references:
+            yield self._get(ref, field_paths)
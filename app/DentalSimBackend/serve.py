@@ -0,0 +1,39 @@
+"""
+Production entry point for the backend.
+
+SERVER_MODE=gevent (default): every request runs in a greenlet. The
+standard library, `requests` (LLM gateway), smtplib and the Firestore gRPC
+channel are made cooperative, so a request waiting on ai_server, SMTP or
+Firestore yields instead of holding an OS thread, and one process keeps
+hundreds of chats in flight (SERVER_MAX_CONNECTIONS).
+SERVER_MODE=threads: the Werkzeug threaded server, one thread per request.
+
+    SERVER_MODE=gevent PORT=9003 python serve.py
+"""
+import os
+
+SERVER_MODE = os.getenv("SERVER_MODE", "gevent").lower()
+
+if SERVER_MODE == "gevent":
+    # trebuie făcut înainte de orice alt import (socket, ssl, threading, grpc)
+    from gevent import monkey
+    monkey.patch_all()
+    import grpc.experimental.gevent as grpc_gevent
+    grpc_gevent.init_gevent()
+
+from app import app  # noqa: E402
+
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "9003"))
+MAX_CONNECTIONS = int(os.getenv("SERVER_MAX_CONNECTIONS", "1000"))
+
+if __name__ == "__main__":
+    if SERVER_MODE == "gevent":
+        from gevent.pool import Pool
+        from gevent.pywsgi import WSGIServer
+
+        print(f"Starting DentalSim Backend (gevent, up to {MAX_CONNECTIONS} connections) on port {PORT}...")
+        WSGIServer((HOST, PORT), app, spawn=Pool(MAX_CONNECTIONS), log=None).serve_forever()
+    else:
+        print(f"Starting DentalSim Backend (threads) on port {PORT}...")
+        app.run(host=HOST, port=PORT, threaded=True)
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from context_builder import summary_line
+
+# cel mult atâtea linii de rezumat per sesiune (cele mai vechi se pierd)
+MAX_SUMMARY_LINES = 200
+
+
+class ChatSessionState:
+    """What /chat needs for one session: the session doc, the resolved system
+    prompt, the rolling window of the last messages (oldest first) and the
+    summary lines of the messages that already slid out of the window."""
+
+    def __init__(self, session, system_prompt, messages, window, summary_lines=()):
+        self.session = session
+        self.system_prompt = system_prompt
+        self.messages = deque(messages, maxlen=window)
+        self.summary_lines = deque(summary_lines, maxlen=MAX_SUMMARY_LINES)
+        self.touched_at = time.monotonic()
+
+    def append(self, sender, content):
+        if len(self.messages) == self.messages.maxlen:
+            # mesajul care iese din fereastră rămâne în rezumatul rulant
+            self.summary_lines.append(summary_line(self.messages[0]))
+        self.messages.append({"sender": sender, "content": content})
+        self.touched_at = time.monotonic()
+
+
+class SessionCache:
+    """
+    Bounded LRU of ChatSessionState with idle-TTL eviction.
+
+    Firestore is only read on a miss; every turn appends to the cached window,
+    so a running conversation costs no reads at all. The cache is per process:
+    with several backend processes a session simply warms up once in each.
+    """
+
+    def __init__(self, capacity=1000, ttl_seconds=1800, window=10):
+        self.capacity = capacity
+        self.ttl = ttl_seconds
+        self.window = window
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, session_id):
+        now = time.monotonic()
+        with self._lock:
+            state = self._items.get(session_id)
+            if state is not None and now - state.touched_at > self.ttl:
+                del self._items[session_id]
+                state = None
+            if state is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            state.touched_at = now
+            self._items.move_to_end(session_id)
+            return state
+
+    def put(self, session_id, session, system_prompt, messages, summary_lines=()):
+        state = ChatSessionState(session, system_prompt, messages, self.window, summary_lines)
+        with self._lock:
+            self._items[session_id] = state
+            self._items.move_to_end(session_id)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+        return state
+
+    def append(self, session_id, sender, content):
+        with self._lock:
+            state = self._items.get(session_id)
+            if state is not None:
+                state.append(sender, content)
+
+    def invalidate(self, session_id):
+        with self._lock:
+            self._items.pop(session_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._items), "capacity": self.capacity,
+                    "hits": self.hits, "misses": self.misses}
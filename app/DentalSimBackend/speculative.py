@@ -0,0 +1,140 @@
+"""
+Speculative decoding for the patient model.
+
+AI_SPECULATIVE selects how draft tokens are proposed:
+  off            plain decoding (default)
+  prompt_lookup  llama.cpp's LlamaPromptLookupDecoding: drafts by matching the
+                 last n-gram against the prompt + reply so far. No second
+                 model; works well for short, formulaic patient replies that
+                 repeat phrases from the system prompt and the conversation.
+  draft          a small GGUF (AI_DRAFT_MODEL) greedily proposes the next
+                 tokens. It must share the target's vocabulary: token ids
+                 are compared directly, so the loader refuses a draft whose
+                 vocabulary differs (e.g. a TinyLlama draft for a Llama-3 target).
+
+The target model verifies all drafted tokens in one batch and keeps the
+longest prefix it would have sampled itself, so replies are unchanged.
+CountingDraft records how many tokens were proposed and how many survived.
+"""
+import numpy as np
+from llama_cpp import Llama
+from llama_cpp.llama_speculative import LlamaDraftModel, LlamaPromptLookupDecoding
+
+
+class SmallModelDraft(LlamaDraftModel):
+    """Greedy drafts from a second, smaller llama.cpp model with the same vocabulary."""
+
+    def __init__(self, model_path, n_ctx=4096, n_threads=2, num_pred_tokens=4):
+        self.model = Llama(model_path=model_path, n_ctx=n_ctx, n_threads=n_threads,
+                           use_mmap=True, verbose=False)
+        self.num_pred_tokens = num_pred_tokens
+
+    def __call__(self, input_ids, /, **kwargs):
+        m = self.model
+        ids = input_ids.tolist()
+
+        # reluăm de la cel mai lung prefix deja evaluat în contextul draft-ului
+        prefix = 0
+        limit = min(m.n_tokens, len(ids))
+        while prefix < limit and m._input_ids[prefix] == ids[prefix]:
+            prefix += 1
+        if prefix == len(ids):
+            prefix -= 1  # avem nevoie de logits pentru ultima poziție
+        m._ctx.kv_cache_seq_rm(-1, prefix, -1)
+        m.n_tokens = prefix
+        m.eval(ids[prefix:])
+
+        drafts = []
+        eos = m.token_eos()
+        for _ in range(self.num_pred_tokens):
+            token = m.sample(top_k=1, temp=0.0)
+            if token == eos:
+                break
+            drafts.append(token)
+            m.eval([token])
+        return np.array(drafts, dtype=np.intc)
+
+
+class CountingDraft(LlamaDraftModel):
+    """
+    Wraps a draft model and counts verification steps and proposed tokens.
+    Accepted tokens are derived per generation: every step yields the
+    accepted drafts plus one token sampled by the target, and the first
+    token comes from the prompt pass, so accepted = completion - steps - 1.
+    """
+
+    def __init__(self, inner, mode):
+        self.inner = inner
+        self.mode = mode
+        self.steps = 0
+        self.proposed = 0
+
+    def __call__(self, input_ids, /, **kwargs):
+        drafts = self.inner(input_ids, **kwargs)
+        self.steps += 1
+        self.proposed += len(drafts)
+        return drafts
+
+    def snapshot(self):
+        return self.steps, self.proposed
+
+    def report(self, before, completion_tokens):
+        steps = self.steps - before[0]
+        proposed = self.proposed - before[1]
+        accepted = min(proposed, max(0, completion_tokens - steps - 1))
+        return {
+            "mode": self.mode,
+            "steps": steps,
+            "proposed_tokens": proposed,
+            "accepted_tokens": accepted,
+            "acceptance_rate": round(accepted / proposed, 3) if proposed else 0.0,
+            "tokens_per_step": round(completion_tokens / (steps + 1), 2),
+        }
+
+
+def check_draft_vocab(target, draft):
+    """Refuses a draft model whose token ids don't mean the same as the target's."""
+    inner = getattr(draft, "inner", draft)
+    if not isinstance(inner, SmallModelDraft):
+        return  # prompt lookup propune tokeni din contextul modelului mare
+    model = inner.model
+    if target.n_vocab() != model.n_vocab():
+        raise RuntimeError(f"draft vocabulary ({model.n_vocab()} tokens) differs from the "
+                           f"target's ({target.n_vocab()}); use AI_SPECULATIVE=prompt_lookup")
+    for token_id in range(0, min(target.n_vocab(), 5000), 97):
+        if target.detokenize([token_id]) != model.detokenize([token_id]):
+            raise RuntimeError(f"draft and target tokenizers disagree on token {token_id}; "
+                               f"use AI_SPECULATIVE=prompt_lookup")
+
+
+def make_draft(config):
+    """
+    Draft model for config["speculative"], or None. It must be passed to
+    Llama(draft_model=...): only then does llama-cpp-python enable logits_all,
+    which the verification of the drafted tokens reads.
+    """
+    mode = config.get("speculative", "off")
+    if mode == "off":
+        return None
+    if mode == "prompt_lookup":
+        inner = LlamaPromptLookupDecoding(
+            max_ngram_size=config.get("lookup_ngram", 2),
+            num_pred_tokens=config.get("draft_tokens", 10),
+        )
+    elif mode == "draft":
+        inner = SmallModelDraft(
+            config["draft_model_path"],
+            n_ctx=config.get("n_ctx", 4096),
+            n_threads=config.get("draft_threads", 2),
+            num_pred_tokens=config.get("draft_tokens", 4),
+        )
+    else:
+        raise ValueError(f"Unknown AI_SPECULATIVE mode: {mode}")
+    return CountingDraft(inner, mode)
+
+
+def scores_buffer_mb(config, n_vocab):
+    """Size of the logits_all buffer (n_ctx x n_vocab float32) speculative decoding adds per context."""
+    if config.get("speculative", "off") == "off":
+        return 0
+    return (config.get("n_ctx", 4096) * n_vocab * 4) >> 20
@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.join(BACKEND_DIR, "bench"))
+
+
+@pytest.fixture(scope="session")
+def stub_llm():
+    from stub_llm import start_stub
+    server, url = start_stub(latency=0.0)
+    yield url
+    server.shutdown()
+
+
+@pytest.fixture(scope="session")
+def loaded_app(stub_llm):
+    """app.py on the in-memory store, talking to the stub LLM (same setup as bench/run.py)."""
+    from run import load_app
+    return load_app(stub_llm)
+
+
+@pytest.fixture(scope="session")
+def app_module(loaded_app):
+    return loaded_app[0]
+
+
+@pytest.fixture(scope="session")
+def store(loaded_app):
+    """The store behind app.firebase_db, without op counting."""
+    return loaded_app[2]
+
+
+@pytest.fixture(scope="session")
+def op_counter(loaded_app):
+    """The load test's own OpCounter, wrapped around the store next to app.db_op_counter."""
+    return loaded_app[1]
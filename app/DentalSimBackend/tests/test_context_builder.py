@@ -0,0 +1,81 @@
+import datetime as dt
+
+import pytest
+from flask_jwt_extended import create_access_token
+
+from context_builder import ContextBuilder, PromptTooLong
+
+
+class WordCounter:
+    """One token per word; stands in for TokenCounter."""
+
+    def count_many(self, texts):
+        return [len(t.split()) for t in texts]
+
+
+def messages(*contents):
+    return [{"sender": "student" if i % 2 == 0 else "patient", "content": c} for i, c in enumerate(contents)]
+
+
+def test_history_is_trimmed_to_the_budget():
+    builder = ContextBuilder(WordCounter(), prompt_budget=60, summary_budget=20)
+    chat, stats = builder.build("system " * 10, messages(*["word " * 10] * 8 + ["Where does it hurt?"]))
+
+    assert chat[-1]["content"] == "Where does it hurt?"
+    assert stats["prompt_tokens"] <= 60
+    assert stats["messages_kept"] < 9
+
+
+def test_newest_message_over_budget_is_rejected():
+    builder = ContextBuilder(WordCounter(), prompt_budget=100, summary_budget=20)
+    with pytest.raises(PromptTooLong) as exc:
+        builder.build("system " * 10, messages("hello", "hi", "word " * 200))
+    assert exc.value.budget == 100
+    assert exc.value.tokens > 100
+
+
+def _seed_session(store, n_messages):
+    disease_ref = store.collection("disease").document()
+    disease_ref.set({"name": "Pulp Necrosis", "category": "Pulpal", "system_prompt": "You are a patient."})
+    session_ref = store.collection("chat_session").document()
+    session_ref.set({"user_id": "u1", "disease_id": disease_ref.id})
+    start = dt.datetime(2026, 1, 1, tzinfo=dt.timezone.utc)
+    batch = store.batch()
+    for i in range(n_messages):
+        batch.set(store.collection("chat_message").document(), {
+            "session_id": session_ref.id,
+            "sender": "student" if i % 2 == 0 else "patient",
+            "content": f"Message number {i}.",
+            "timestamp": start + dt.timedelta(seconds=i),
+        })
+    batch.commit()
+    return session_ref.id
+
+
+def test_chat_rejects_a_message_over_the_budget(app_module, store):
+    session_id = _seed_session(store, 2)
+    app_module.disease_catalog.refresh()
+    with app_module.app.app_context():
+        token = create_access_token(identity="u1")
+    response = app_module.app.test_client().post(
+        "/chat", headers={"Authorization": f"Bearer {token}"},
+        json={"session_id": session_id, "message": "It hurts " * 5000})
+
+    assert response.status_code == 413
+    app_module.message_writer.flush()
+    saved = store.collection("chat_message").where("session_id", "==", session_id).get()
+    assert len(saved) == 2  # the rejected message was not stored
+
+
+def test_summary_is_rebuilt_after_a_cache_miss(app_module, store):
+    window = app_module.session_cache.window
+    session_id = _seed_session(store, window + 10)
+    app_module.disease_catalog.refresh()
+    app_module.session_cache.invalidate(session_id)
+
+    state = app_module.get_chat_session_state(session_id)
+
+    assert len(state.messages) == window
+    assert state.messages[0]["content"] == "Message number 10."
+    assert len(state.summary_lines) == 10
+    assert state.summary_lines[0] == "- Student asked: Message number 0."
@@ -0,0 +1,38 @@
+import datetime as dt
+
+from flask_jwt_extended import create_access_token
+
+from run import Recorder
+
+
+def test_io_pool_ops_are_counted_in_the_callers_scope(app_module, op_counter):
+    op_counter.begin()
+    app_module.db_op_counter.begin()
+    future = app_module.run_concurrently(lambda: app_module.firebase_db.collection("disease").get())
+    future.result()
+
+    assert op_counter.end().get("queries") == 1
+    assert app_module.db_op_counter.end().get("queries") == 1
+
+
+def test_diagnose_counts_its_pooled_queries(app_module, store, op_counter):
+    disease_ref = store.collection("disease").document()
+    disease_ref.set({"name": "Pulp Necrosis", "category": "Pulpal", "system_prompt": "You are a patient."})
+    store.collection("user").document("diag-user").set({"username": "diag", "xp": 0})
+    session_ref = store.collection("chat_session").document()
+    session_ref.set({"user_id": "diag-user", "disease_id": disease_ref.id,
+                     "start_time": dt.datetime.now(dt.timezone.utc)})
+    app_module.disease_catalog.refresh()
+    with app_module.app.app_context():
+        token = create_access_token(identity="diag-user")
+    background_before = op_counter.background_totals().get("queries", 0)
+
+    recorder = Recorder(op_counter)
+    response = recorder.call(app_module.app.test_client(), "post", "/chat/diagnose",
+                             headers={"Authorization": f"Bearer {token}"},
+                             json={"session_id": session_ref.id, "diagnosis": "pulp necrosis"})
+
+    assert response.status_code == 200
+    _, _, ops = recorder.samples["/chat/diagnose"][0]
+    assert ops.get("queries", 0) >= 1  # user_badge, read on io_pool
+    assert op_counter.background_totals().get("queries", 0) == background_before
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from disease_catalog import DiseaseCatalog
+from repository import SQLiteRepository
+
+
+def _catalog(**kwargs):
+    db = SQLiteRepository(":memory:")
+    db.collection("disease").document("d1").set({"name": "Pulp Necrosis", "category": "Pulpal"})
+    return db, DiseaseCatalog(db, **kwargs)
+
+
+def test_unknown_ids_do_not_reload_the_collection_each_time(monkeypatch):
+    db, catalog = _catalog(miss_refresh_interval=60)
+    assert catalog.get("d1") is not None
+
+    reloads = []
+    monkeypatch.setattr(catalog, "refresh", lambda: reloads.append(1))
+    for _ in range(20):
+        assert catalog.get("deleted") is None
+        assert catalog.get(None) is None
+    assert reloads == []
+
+
+def test_a_new_disease_is_found_after_the_interval():
+    db, catalog = _catalog(miss_refresh_interval=0)
+    assert catalog.get("d2") is None
+    db.collection("disease").document("d2").set({"name": "Otitis", "category": "Non Endodontic"})
+    assert catalog.get("d2") is not None
+
+
+class SlowDiseaseReads:
+    """Wraps the store; every read of the collection takes a while and is counted."""
+
+    def __init__(self, db, delay=0.2):
+        self._db = db
+        self.delay = delay
+        self.reads = 0
+
+    def collection(self, name):
+        outer = self
+        inner = self._db.collection(name)
+
+        class Collection:
+            def get(self):
+                outer.reads += 1
+                time.sleep(outer.delay)
+                return inner.get()
+        return Collection()
+
+
+def _run_concurrently(fn, n=8):
+    threads = [threading.Thread(target=fn) for _ in range(n)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def test_concurrent_first_lookups_load_the_collection_once():
+    db, _ = _catalog()
+    slow = SlowDiseaseReads(db)
+    catalog = DiseaseCatalog(slow)
+    found = []
+
+    _run_concurrently(lambda: found.append(catalog.get("d1")))
+
+    assert slow.reads == 1
+    assert all(doc is not None for doc in found)
+
+
+def test_expired_catalog_is_refreshed_once_in_the_background():
+    db, _ = _catalog()
+    slow = SlowDiseaseReads(db, delay=0.0)
+    catalog = DiseaseCatalog(slow, ttl_seconds=0.3)
+    catalog.get("d1")
+    time.sleep(0.35)
+    slow.delay = 0.5
+    db.collection("disease").document("d2").set({"name": "Otitis", "category": "Non Endodontic"})
+
+    started = time.monotonic()
+    _run_concurrently(lambda: catalog.get_by_name("Pulp Necrosis"))
+    assert time.monotonic() - started < 0.3      # the stale copy was served meanwhile
+    assert catalog.get_by_name("Otitis") is None
+
+    deadline = time.monotonic() + 5
+    while catalog.get_by_name("Otitis") is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert catalog.get_by_name("Otitis") is not None
+    assert slow.reads == 2
@@ -0,0 +1,33 @@
+import threading
+import time
+
+from leaderboard_cache import LeaderboardCache
+from repository import SQLiteRepository
+
+
+def test_expired_boards_refresh_once_in_the_background():
+    db = SQLiteRepository(":memory:")
+    db.collection("user").document("u1").set({"username": "ana", "xp": 100, "university": "UMF"})
+    cache = LeaderboardCache(db, ["UMF"], ttl_seconds=0.05)
+    payload, _ = cache.get()
+
+    queries = []
+    original = cache._query_top
+
+    def slow_query(university=None):
+        queries.append(university)
+        time.sleep(0.2)
+        return original(university)
+    cache._query_top = slow_query
+    time.sleep(0.1)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=cache.get) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert time.perf_counter() - started < 0.2  # nobody waited for the refresh
+
+    time.sleep(0.6)
+    assert queries == [None, "UMF"]  # one refresh: global + one per university
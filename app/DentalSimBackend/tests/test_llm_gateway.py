@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from llm_gateway import LLMGateway, LLMUnavailable
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    status = 200
+    delay = 0.0
+    posts = 0
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay)
+        type(self).posts += 1
+        if self.path == "/tokenize":
+            return self.send_error(404)  # ai_server vechi: pagina HTML de la Flask
+        body = json.dumps({"generated_text": "ok"} if self.status == 200 else {"error": "bad"}).encode()
+        self.send_response(self.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def backend():
+    handler = type("Handler", (StatusHandler,), {})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield handler, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_client_errors_do_not_open_the_circuit(backend):
+    handler, url = backend
+    handler.status = 400
+    gateway = LLMGateway([url], failure_threshold=2, health_interval=0)
+    for _ in range(5):
+        with pytest.raises(LLMUnavailable):
+            gateway.generate({"messages": []})
+    stats = gateway.stats()[0]
+    assert stats["circuit"] == "closed"
+    assert stats["failures"] == 0
+
+
+def test_server_errors_open_the_circuit(backend):
+    handler, url = backend
+    handler.status = 500
+    gateway = LLMGateway([url], failure_threshold=2, health_interval=0)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            gateway.generate({"messages": []})
+    assert gateway.stats()[0]["circuit"] == "open"
+
+
+def test_only_the_trial_request_frees_the_trial_slot():
+    gateway = LLMGateway(["http://127.0.0.1:9"], health_interval=0)
+    backend = gateway.backends[0]
+    earlier = gateway._acquire([])          # placed while the circuit was closed
+    backend.open_until = time.monotonic() - 1  # cooldown over: half-open
+    trial = gateway._acquire([])
+    assert trial.trial
+
+    gateway._release(earlier, ok=False, count_failure=False)
+    assert gateway._acquire([]) is None      # the trial is still running
+
+    gateway._release(trial, ok=True)
+    assert gateway.stats()[0]["circuit"] == "closed"
+
+
+def test_missing_tokenize_is_not_a_backend_failure(backend):
+    handler, url = backend
+    gateway = LLMGateway([url], failure_threshold=2, health_interval=0)
+    for _ in range(5):
+        with pytest.raises(LLMUnavailable):
+            gateway.tokenize(["Does it hurt?"])
+
+    assert handler.posts == 1  # the 404 is remembered, no round-trip per turn
+    stats = gateway.stats()[0]
+    assert stats["circuit"] == "closed"
+    assert stats["failures"] == 0
+    assert gateway.generate({"messages": []})["generated_text"] == "ok"
+
+
+def test_transport_errors_open_the_circuit_and_fail_fast():
+    gateway = LLMGateway(["http://127.0.0.1:9"], connect_timeout=0.5, failure_threshold=2, health_interval=0)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailable):
+            gateway.generate({"messages": []})
+    assert gateway.stats()[0]["circuit"] == "open"
+
+    with pytest.raises(LLMUnavailable, match="no healthy LLM backend"):
+        gateway.generate({"messages": []})  # refused without a connection attempt
+
+
+def test_busy_backend_is_skipped_without_a_failure(backend):
+    handler, url = backend
+    handler.status = 503
+    gateway = LLMGateway([url], failure_threshold=1, health_interval=0)
+    with pytest.raises(LLMUnavailable, match="busy"):
+        gateway.generate({"messages": []})
+    stats = gateway.stats()[0]
+    assert stats["circuit"] == "closed"
+    assert stats["outstanding"] == 0
@@ -0,0 +1,30 @@
+import pytest
+
+from pagination import BadCursor, decode_cursor, encode_cursor
+
+
+def test_round_trip():
+    assert decode_cursor(encode_cursor({"xp": 1200, "id": "u1"}), int_fields=("xp",)) == {"xp": 1200, "id": "u1"}
+
+
+@pytest.mark.parametrize("data, int_fields", [
+    ({"xp": 10}, ("xp",)),
+    ({"id": 5}, ()),
+    ({"id": ""}, ()),
+    ({"id": "u1", "xp": "ten"}, ("xp",)),
+    ({"id": "u1", "xp": True}, ("xp",)),
+    ({"id": "u1"}, ("xp",)),
+])
+def test_malformed_cursors_are_rejected(data, int_fields):
+    with pytest.raises(BadCursor):
+        decode_cursor(encode_cursor(data), int_fields)
+
+
+def test_classroom_leaderboard_answers_400_for_a_cursor_without_id(app_module):
+    from flask_jwt_extended import create_access_token
+    with app_module.app.app_context():
+        token = create_access_token(identity="u1")
+    response = app_module.app.test_client().get(
+        "/classroom/c1/leaderboard", query_string={"cursor": encode_cursor({"xp": 5})},
+        headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 400
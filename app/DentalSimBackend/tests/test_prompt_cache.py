@@ -0,0 +1,112 @@
+import threading
+from types import SimpleNamespace
+
+from prompt_cache import PromptStateCache
+
+MB = 1 << 20
+
+
+class FakeLlama:
+    """The slice of llama_cpp.Llama that prepare() touches."""
+
+    def __init__(self, state_mb):
+        self.state_mb = state_mb
+        self._input_ids = []
+        self.evals = 0
+
+    @property
+    def n_tokens(self):
+        return len(self._input_ids)
+
+    def reset(self):
+        self._input_ids = []
+
+    def eval(self, tokens):
+        self.evals += 1
+        self._input_ids = self._input_ids + list(tokens)
+
+    def save_state(self):
+        return SimpleNamespace(llama_state_size=self.state_mb * MB, tokens=list(self._input_ids),
+                               scores=SimpleNamespace(nbytes=0), input_ids=SimpleNamespace(nbytes=0))
+
+    def load_state(self, state):
+        self._input_ids = list(state.tokens)
+
+
+def make_cache(monkeypatch, **kwargs):
+    cache = PromptStateCache(**kwargs)
+    # tokenii prefixului = un token per cuvânt din system prompt (fără chat template)
+    monkeypatch.setattr(cache, "_prefix_tokens",
+                        lambda llm, key, message: [hash(w) for w in message["content"].split()])
+    return cache
+
+
+def system(text):
+    return [{"role": "system", "content": text}, {"role": "user", "content": "Hello"}]
+
+
+def test_resident_and_restored_prompts_are_hits(monkeypatch):
+    cache = make_cache(monkeypatch, capacity=4, capacity_mb=100)
+    llm = FakeLlama(state_mb=10)
+
+    assert cache.prepare(llm, system("pulp necrosis patient")) == "miss"
+    assert cache.prepare(llm, system("pulp necrosis patient")) == "hit"    # still in the context
+    assert cache.prepare(llm, system("periodontal abscess patient")) == "miss"
+    assert cache.prepare(llm, system("pulp necrosis patient")) == "hit"    # restored snapshot
+    assert llm.evals == 2
+    assert cache.stats()["used_mb"] == 20
+
+
+def test_bytes_budget_evicts_least_recently_used(monkeypatch):
+    cache = make_cache(monkeypatch, capacity=10, capacity_mb=25)
+    llm = FakeLlama(state_mb=10)
+    for name in ("a", "b", "c"):
+        cache.prepare(llm, system(f"disease {name}"))
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["used_mb"] == 20
+    assert cache.prepare(llm, system("disease a")) == "miss"   # evicted first
+
+
+def test_oversized_state_is_skipped_without_reevaluating(monkeypatch):
+    cache = make_cache(monkeypatch, capacity=4, capacity_mb=100)
+    llm = FakeLlama(state_mb=500)
+
+    assert cache.prepare(llm, system("pulp necrosis patient")) == "skipped"
+    llm.reset()
+    assert cache.prepare(llm, system("pulp necrosis patient")) == "skipped"
+    assert llm.evals == 1   # no reset + prefix eval + snapshot on every request
+    assert cache.stats()["skipped"] == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_counters_are_exact_under_concurrent_slots(monkeypatch):
+    cache = make_cache(monkeypatch, capacity=4, capacity_mb=100)
+    slots = [FakeLlama(state_mb=1) for _ in range(8)]
+    for llm in slots:
+        cache.prepare(llm, system("pulp necrosis patient"))
+
+    def run(llm):
+        for _ in range(2000):
+            cache.prepare(llm, system("pulp necrosis patient"))
+
+    threads = [threading.Thread(target=run, args=(llm,)) for llm in slots]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    stats = cache.stats()
+    assert stats["hits"] + stats["misses"] == 8 * 2001
+
+
+def test_outcomes_are_exported_on_metrics():
+    from metrics import InferenceMetrics
+
+    metrics = InferenceMetrics()
+    for outcome in ("hit", "hit", "skipped"):
+        metrics.observe({"done": True, "prompt_cache": outcome})
+    rendered = metrics.render()
+
+    assert 'dentalsim_llm_prompt_cache_lookups_total{outcome="hit"} 2' in rendered
+    assert 'dentalsim_llm_prompt_cache_lookups_total{outcome="skipped"} 1' in rendered
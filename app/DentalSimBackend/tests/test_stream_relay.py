@@ -0,0 +1,17 @@
+import json
+
+from stub_llm import REPLY
+
+
+def test_relay_chat_stream_relays_ndjson_bytes(app_module):
+    payload = {"messages": [{"role": "user", "content": "Where does it hurt?"}], "max_new_tokens": 150}
+    with app_module.app.test_request_context("/chat", method="POST"):
+        response = app_module.relay_chat_stream("test-session", payload)
+        body = "".join(chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk
+                       for chunk in response.response)
+
+    events = [json.loads(line) for line in body.splitlines() if line]
+    assert not [e for e in events if "error" in e]
+    assert events[-1]["done"] is True
+    assert "".join(e["token"] for e in events if "token" in e).strip() == REPLY
+    assert all(b["failures"] == 0 for b in app_module.llm_gateway.stats())
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+from worker_pool import WorkerPool
+
+
+def fake_worker(worker_id, config, inbox, events):
+    """Stands in for _worker_main without a model: "crash" kills the process, "hang" never answers."""
+    events.send((None, {"ready": True}))
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+        if job[0] == "cancel":
+            continue
+        _, req_id, messages, _ = job
+        if messages == "crash":
+            os._exit(3)
+        if messages == "hang":
+            continue
+        events.send((req_id, {"token": "ok"}))
+        events.send((req_id, {"done": True, "generated_text": "ok", "queue_wait_ms": 0.0}))
+
+
+def wait_until(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool({}, n_workers=1, max_restarts=1, event_timeout=20.0, target=fake_worker)
+    yield pool
+    pool.close()
+
+
+def test_requests_on_a_dead_worker_fail_and_the_worker_restarts(pool):
+    waiting = pool.submit("hang")
+    crashing = pool.submit("crash")
+
+    for req in (waiting, crashing):
+        result = req.result()
+        assert "exited (exit code 3)" in result["error"]
+    assert pool.stats()["outstanding_per_worker"] == [0]
+
+    assert wait_until(lambda: pool.stats()["ready_workers"] == 1)
+    assert pool.submit("hello").result()["generated_text"] == "ok"
+    assert pool.stats()["restarts"] == 1
+
+
+def test_a_worker_out_of_restarts_leaves_routing(pool):
+    pool.submit("crash").result()
+    assert wait_until(lambda: pool.stats()["ready_workers"] == 1)
+    pool.submit("crash").result()
+
+    assert wait_until(lambda: pool.stats()["ready_workers"] == 0)
+    time.sleep(0.5)
+    assert pool.stats()["ready_workers"] == 0
+    with pytest.raises(Exception, match="No LLM worker"):
+        pool.submit("hello")
+
+
+def test_client_stops_waiting_after_the_event_timeout():
+    pool = WorkerPool({}, n_workers=1, event_timeout=0.5, target=fake_worker)
+    try:
+        result = pool.submit("hang").result()
+    finally:
+        pool.close()
+    assert "no event from the model" in result["error"]
+
+
+def dying_worker(worker_id, config, inbox, events):
+    os._exit(1)
+
+
+def test_a_worker_dying_while_loading_fails_startup():
+    with pytest.raises(RuntimeError, match="exited while loading the model"):
+        WorkerPool({}, n_workers=2, target=dying_worker)
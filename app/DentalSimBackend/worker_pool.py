@@ -0,0 +1,300 @@
+import atexit
+import multiprocessing as mp
+import os
+import threading
+from multiprocessing.connection import wait as wait_any
+
+from llm_scheduler import GenerationRequest, QueueFull
+
+
+# --- RAM BUDGET ---
+
+def available_memory_mb():
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+
+
+def max_workers_for_budget(model_path, per_worker_mb, reserve_mb=1024):
+    """
+    The weights are counted once (shared mmap); each worker adds its own
+    context, KV cache and state caches (`per_worker_mb`).
+    """
+    model_mb = os.path.getsize(model_path) // (1024 * 1024)
+    free_mb = available_memory_mb() - reserve_mb - model_mb
+    return max(0, free_mb // per_worker_mb), model_mb
+
+
+# --- WORKER PROCESS ---
+
+def _worker_main(worker_id, config, inbox, events):
+    """
+    Runs in its own process: one model context behind a 1-slot scheduler.
+    Jobs arrive on `inbox` as ("generate", req_id, messages, params) or
+    ("cancel", req_id); every event goes back on the `events` pipe as (req_id, event).
+    """
+    from llm_scheduler import GenerationScheduler
+    from model_loader import load_model
+    from prompt_cache import PromptStateCache
+
+    send_lock = threading.Lock()
+
+    def send(req_id, event):
+        with send_lock:
+            events.send((req_id, event))
+
+    try:
+        prompt_cache = PromptStateCache(capacity=config.get("prompt_cache_size", 16),
+                                        capacity_mb=config.get("prompt_cache_mb", 1024))
+        scheduler = GenerationScheduler(
+            lambda slot_id: load_model(config),
+            n_slots=1,
+            max_queue=0,  # nelimitat; limita e aplicata de dispecer
+            prepare=prompt_cache.prepare if prompt_cache.capacity > 0 else None
+        )
+    except Exception as e:
+        send(None, {"error": f"worker {worker_id}: {e}"})
+        return
+    send(None, {"ready": True})
+
+    running = {}
+
+    def forward(req_id, req):
+        try:
+            for event in req:
+                send(req_id, event)
+        finally:
+            running.pop(req_id, None)
+
+    while True:
+        job = inbox.get()
+        if job is None:
+            return
+        if job[0] == "cancel":
+            req = running.get(job[1])
+            if req is not None:
+                req.cancel()
+            continue
+
+        _, req_id, messages, params = job
+        req = scheduler.submit(messages, **params)
+        running[req_id] = req
+        threading.Thread(target=forward, args=(req_id, req), daemon=True).start()
+
+
+# --- DISPATCHER ---
+
+class WorkerPool:
+    """
+    N worker processes, each owning one llama.cpp context on the same
+    mmap-ed GGUF. Requests go to the worker with the fewest outstanding
+    generations; the returned GenerationRequest behaves like the in-process
+    scheduler's, so /generate does not care which mode is active.
+
+    Each worker sends its events back on its own pipe: a process killed
+    mid-write can't leave a lock shared with the other workers held.
+    A worker that exits (OOM, a crash inside llama.cpp) is noticed through
+    its process sentinel: its pending requests get an {"error"} event and it
+    is restarted, up to `max_restarts` times, after which it is left out of
+    routing. Clients also stop waiting after `event_timeout` seconds without
+    an event from their request.
+    """
+
+    def __init__(self, config, n_workers, max_queue=64, max_restarts=3, event_timeout=300.0,
+                 target=_worker_main):
+        self._ctx = mp.get_context("spawn")  # llama.cpp nu suporta fork dupa init
+        self._config = config
+        self._target = target
+        self.n_workers = n_workers
+        self.max_queue = max_queue
+        self.max_restarts = max_restarts
+        self.event_timeout = event_timeout
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._inboxes = [None] * n_workers
+        self._pipes = [None] * n_workers
+        self._processes = [None] * n_workers
+        self._ready = [False] * n_workers   # doar worker-ii gata primesc cereri
+        self._restarts = [0] * n_workers
+        self._outstanding = [0] * n_workers
+        self._requests = {}  # req.id -> (worker_id, GenerationRequest)
+        self._completed = 0
+        self._failed = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._starting = True
+        self._startup_error = None
+        self._closed = False
+
+        with self._lock:
+            for worker_id in range(n_workers):
+                self._start_worker(worker_id)
+        threading.Thread(target=self._collect, name="llm-pool-collector", daemon=True).start()
+        atexit.register(self.close)
+
+        # asteptam ca fiecare worker sa-si incarce modelul
+        with self._lock:
+            self._changed.wait_for(lambda: all(self._ready) or self._startup_error)
+            self._starting = False
+            error = self._startup_error
+        if error:
+            self.close()
+            raise RuntimeError(error)
+        print(f"[worker_pool] {n_workers} worker(s) ready")
+
+    def close(self):
+        """Stops the workers; exits from now on are expected, not restarted."""
+        with self._lock:
+            self._closed = True
+            inboxes = [inbox for inbox, p in zip(self._inboxes, self._processes) if p is not None]
+        for inbox in inboxes:
+            inbox.put(None)
+
+    def _start_worker(self, worker_id):
+        # coada si pipe-ul vechi erau ale procesului mort; se iau altele noi
+        inbox = self._ctx.Queue()
+        reader, writer = self._ctx.Pipe(duplex=False)
+        p = self._ctx.Process(target=self._target, args=(worker_id, self._config, inbox, writer),
+                              name=f"llm-worker-{worker_id}", daemon=True)
+        p.start()
+        writer.close()
+        self._inboxes[worker_id] = inbox
+        self._pipes[worker_id] = reader
+        self._processes[worker_id] = p
+
+    def submit(self, messages, **params):
+        with self._lock:
+            if sum(self._outstanding) >= self.max_queue:
+                raise QueueFull(f"Too many pending generations ({self.max_queue})")
+            ready = [i for i in range(self.n_workers) if self._ready[i]]
+            if not ready:
+                raise QueueFull("No LLM worker is running")
+            worker_id = min(ready, key=lambda i: self._outstanding[i])
+            self._outstanding[worker_id] += 1
+            req = PooledRequest(self, messages, params)
+            self._requests[req.id] = (worker_id, req)
+            inbox = self._inboxes[worker_id]
+
+        inbox.put(("generate", req.id, messages, params))
+        return req
+
+    def _cancel(self, req):
+        with self._lock:
+            entry = self._requests.get(req.id)
+            inbox = self._inboxes[entry[0]] if entry is not None else None
+        if inbox is not None:
+            inbox.put(("cancel", req.id))
+
+    def _collect(self):
+        """Reads every worker's pipe and watches the process sentinels, on one thread."""
+        while True:
+            with self._lock:
+                pipes = {c: i for i, c in enumerate(self._pipes) if c is not None}
+                sentinels = {p.sentinel: i for i, p in enumerate(self._processes) if p is not None}
+            if not sentinels:
+                return
+            for handle in wait_any(list(pipes) + list(sentinels), timeout=5.0):
+                if handle in pipes:
+                    self._receive(pipes[handle], handle)
+                else:
+                    self._worker_exited(sentinels[handle])
+
+    def _receive(self, worker_id, pipe):
+        """Handles one message from `pipe`; False once the pipe is closed or broken."""
+        if self._pipes[worker_id] is not pipe:
+            return False  # worker-ul a fost deja inlocuit
+        try:
+            req_id, event = pipe.recv()
+        except (EOFError, OSError):
+            return False  # procesul s-a oprit; sentinel-ul raporteaza iesirea
+        if req_id is None:
+            with self._lock:
+                if event.get("ready"):
+                    self._ready[worker_id] = True
+                    if not self._starting:
+                        print(f"[worker_pool] worker {worker_id} ready again")
+                elif "error" in event:
+                    print(f"[worker_pool] {event['error']}")
+                    if self._starting:
+                        self._startup_error = event["error"]
+                self._changed.notify_all()
+            return True
+        with self._lock:
+            entry = self._requests.get(req_id)
+            if entry is None:
+                return True
+            req = entry[1]
+            if "done" in event or "error" in event:
+                del self._requests[req_id]
+                self._outstanding[worker_id] -= 1
+                self._completed += 1
+                wait_ms = event.get("queue_wait_ms", 0.0)
+                self._total_wait_ms += wait_ms
+                self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+        req.events.put(event)
+        return True
+
+    def _worker_exited(self, worker_id):
+        process, pipe = self._processes[worker_id], self._pipes[worker_id]
+        process.join(1.0)  # exitcode e disponibil abia dupa join
+        # evenimentele trimise inainte de iesire (ex. un "done") sunt inca in pipe
+        while pipe.poll() and self._receive(worker_id, pipe):
+            pass
+        pipe.close()
+        with self._lock:
+            self._ready[worker_id] = False
+            lost = [(req_id, req) for req_id, (w, req) in self._requests.items() if w == worker_id]
+            for req_id, _ in lost:
+                del self._requests[req_id]
+            self._outstanding[worker_id] = 0
+            self._failed += len(lost)
+            restart = not self._closed and not self._starting and self._restarts[worker_id] < self.max_restarts
+            if restart:
+                self._restarts[worker_id] += 1
+                self._start_worker(worker_id)
+            else:
+                self._processes[worker_id] = None
+                self._pipes[worker_id] = None
+                if self._starting and not self._startup_error:
+                    self._startup_error = (f"worker {worker_id} exited while loading the model "
+                                           f"(exit code {process.exitcode})")
+            self._changed.notify_all()
+        if self._closed:
+            return
+        print(f"[worker_pool] worker {worker_id} exited (exit code {process.exitcode}), "
+              f"{len(lost)} request(s) failed, " + ("restarting" if restart else "left out of routing"))
+        for _, req in lost:
+            req.events.put({"error": f"LLM worker {worker_id} exited (exit code {process.exitcode})",
+                            "queue_wait_ms": req.queue_wait_ms})
+
+    def stats(self):
+        with self._lock:
+            completed = self._completed
+            return {
+                "workers": self.n_workers,
+                "ready_workers": sum(self._ready),
+                "restarts": sum(self._restarts),
+                "outstanding_per_worker": list(self._outstanding),
+                "active": sum(1 for n in self._outstanding if n > 0),
+                "queue_depth": sum(max(0, n - 1) for n in self._outstanding),
+                "completed": completed,
+                "failed_by_worker_exit": self._failed,
+                "avg_queue_wait_ms": round(self._total_wait_ms / completed, 1) if completed else 0.0,
+                "max_queue_wait_ms": round(self._max_wait_ms, 1),
+            }
+
+
+class PooledRequest(GenerationRequest):
+    def __init__(self, pool, messages, params):
+        super().__init__(messages, params)
+        self._pool = pool
+        self.event_timeout = pool.event_timeout
+
+    def cancel(self):
+        super().cancel()
+        self._pool._cancel(self)
@@ -68,6 +68,7 @@ const DiagnosisPage: React.FC = () => {
     ]);
     const [inputText, setInputText] = useState('');
     const [isAITyping, setIsAITyping] = useState(false);
+    const [isStreaming, setIsStreaming] = useState(false);
     const [error, setError] = useState('');
 
     const [showDiagnosisModal, setShowDiagnosisModal] = useState(false);
@@ -141,7 +142,7 @@ const DiagnosisPage: React.FC = () => {
     };
 
     const handleSendMessage = async () => {
-        if (!inputText.trim() || isAITyping) return;
+        if (!inputText.trim() || isAITyping || isStreaming) return;
 
         const userMsgText = inputText.trim();
 
@@ -168,27 +169,62 @@ const DiagnosisPage: React.FC = () => {
                 },
                 body: JSON.stringify({
                     session_id: caseId,
-                    message: userMsgText
+                    message: userMsgText,
+                    stream: true
                 })
             });
 
-            const data = await response.json();
-
-            if (!response.ok) throw new Error(data.error || 'Failed to send');
+            if (!response.ok || !response.body) {
+                const data = await response.json().catch(() => ({}));
+                throw new Error(data.error || 'Failed to send');
+            }
 
-            const aiMessage: Message = {
-                id: (Date.now() + 1).toString(),
-                type: 'patient',
-                content: data.reply,
-                timestamp: new Date(),
-            };
-            setMessages((prev) => [...prev, aiMessage]);
+            // The reply arrives as NDJSON: {"token": "..."} lines, then {"done": true}
+            const aiMessageId = (Date.now() + 1).toString();
+            let started = false;
+            setIsStreaming(true);
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+
+                const lines = buffer.split('\n');
+                buffer = lines.pop() ?? '';
+                for (const line of lines) {
+                    if (!line.trim()) continue;
+                    const event = JSON.parse(line);
+                    if (event.error) throw new Error(event.error);
+                    if (!event.token) continue;
+
+                    if (!started) {
+                        // first token: replace the typing indicator with the patient's bubble
+                        started = true;
+                        setIsAITyping(false);
+                        setMessages((prev) => [...prev, {
+                            id: aiMessageId,
+                            type: 'patient',
+                            content: event.token,
+                            timestamp: new Date(),
+                        }]);
+                    } else {
+                        setMessages((prev) => prev.map((m) =>
+                            m.id === aiMessageId ? { ...m, content: m.content + event.token } : m
+                        ));
+                    }
+                }
+            }
 
         } catch (e: unknown) {
             console.error(e);
             setError("Could not reach the patient (AI Error)");
         } finally {
             setIsAITyping(false);
+            setIsStreaming(false);
         }
     };
 
@@ -317,7 +353,12 @@ const DiagnosisPage: React.FC = () => {
 
             // 3. Handle Images (X-Ray / Examine)
             if (data.type === 'image') {
-                const secureImageUrl = `${API_BASE_URL}/chat/media/${caseId}/${tool}?t=${Date.now()}`;
+                // w = pixels actually needed on this screen; the backend picks the size bucket
+                const width = Math.round(window.innerWidth * (window.devicePixelRatio || 1));
+                // Prefer the signed URL (cacheable, no session lookup on the server)
+                const secureImageUrl = data.url
+                    ? `${API_BASE_URL}${data.url}&w=${width}`
+                    : `${API_BASE_URL}/chat/media/${caseId}/${tool}?w=${width}`;
                 setCurrentImageUrl(secureImageUrl);
                 setCurrentImageTitle(tool === 'xray' ? 'Radiograph' : 'Clinical Examination');
                 setShowImageModal(true);
@@ -463,7 +504,7 @@ const DiagnosisPage: React.FC = () => {
                     <IonButton
                         className="send-button"
                         onClick={handleSendMessage}
-                        disabled={!inputText.trim() || isAITyping || isPaused}
+                        disabled={!inputText.trim() || isAITyping || isStreaming || isPaused}
                     >
                         <IonIcon icon={send} slot="icon-only" />
                     </IonButton>